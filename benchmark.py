@@ -0,0 +1,279 @@
+"""Benchmarks of the engine optimizations, run with `python benchmark.py <name>`"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageChops, ImageStat
+
+from src.engine import Engine, Pyramid, ResultCache, operations
+from src.utils.tiles import pick_level, tile_box, tiles_in_view
+
+UHD = (3840, 2160)
+
+
+def sample_image(size: tuple[int, int] = UHD) -> Image.Image:
+    """A noisy gradient, so neither flat areas nor pure noise favour an implementation"""
+    x, y = np.meshgrid(np.linspace(0, 255, size[0], dtype=np.float32), np.linspace(0, 255, size[1], dtype=np.float32))
+    noise = np.random.default_rng(0).normal(0, 16, (size[1], size[0], 4)).astype(np.float32)
+    channels = np.stack((x, y, (x + y) / 2, np.full_like(x, 255)), axis=-1)
+    return Image.fromarray(np.clip(channels + noise, 0, 255).astype(np.uint8), "RGBA")
+
+
+def measure(function: callable, repeat: int) -> float:
+    """Median wall time of `function` in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def compare(image: Image.Image, steps: list[tuple[str, dict]], repeat: int):
+    steps = [(operations[name], params) for name, params in steps]
+    plain = measure(lambda: Engine(passes=()).run(image, steps), repeat)
+    fused = measure(lambda: Engine().run(image, steps), repeat)
+    names = " -> ".join(operation.name for operation, _ in steps)
+    print(f"{names:<60} {plain:>9.1f} ms {fused:>9.1f} ms {plain / fused:>6.1f}x")
+
+
+def point_fusion(repeat: int):
+    """Stacked Brightness, Contrast and Opacity nodes, one `ImageEnhance` pass each or a single lookup table"""
+    image = sample_image()
+    print(f"{image.width}x{image.height} {image.mode}, median of {repeat} runs")
+    print(f"{'':<60} {'separate':>12} {'fused':>12}")
+    adjustments = [
+        ("Brightness", {"percentage": 30}),
+        ("Contrast", {"percentage": 35}),
+        ("Opacity", {"percentage": 80}),
+        ("Brightness", {"percentage": 22}),
+        ("Contrast", {"percentage": 20}),
+    ]
+    for count in (3, 4, 5):
+        compare(image, adjustments[:count], repeat)
+
+
+def parallel_scaling(repeat: int):
+    """Every operation on its own, split into strips across 1 to N threads"""
+    image = sample_image()
+    counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    print(f"{image.width}x{image.height} {image.mode}, median of {repeat} runs, {os.cpu_count()} cores")
+    print(f"{'':<24}" + "".join(f"{f'{count} threads':>22}" for count in counts))
+    cases = [
+        ("Blur", {"mode": "Gaussian", "percentage": 300}),
+        ("Blur", {"mode": "Box", "percentage": 300}),
+        ("Brightness", {"percentage": 40}),
+        ("Contrast", {"percentage": 40}),
+        ("Sharpness", {"percentage": 80}),
+        ("Opacity", {"percentage": 50}),
+        ("Resize", {"percentage": 50}),
+        ("Rotate", {"degrees": 30}),
+        ("Flip", {"mode": "Horizontal"}),
+        ("Crop", {"left": 100, "top": 100}),
+    ]
+    for name, params in cases:
+        operation = operations[name]
+        steps = [(operation, {**operation.defaults(), **params})]
+        times = [
+            measure(lambda count=count, steps=steps: Engine(passes=(), workers=count).run(image, steps), repeat)
+            for count in counts
+        ]
+        label = f"{name} {params.get('mode', '')}".strip()
+        print(f"{label:<24}" + "".join(f"{time:>10.1f} ms {times[0] / time:>6.1f}x" for time in times))
+
+
+def blur_strategies(repeat: int):
+    """The Blur node against Pillow's filters, over the range of the slider"""
+    blur = operations["Blur"]
+    for size in ((1280, 720), UHD):
+        image = sample_image(size)
+        print(f"{image.width}x{image.height} {image.mode}, median of {repeat} runs")
+        print(f"{'':<24} {'factor':>6} {'Pillow':>12} {'node':>12} {'speedup':>8} {'max error':>10}")
+        for mode in ("Gaussian", "Box"):
+            for percentage in (50, 200, 400, 500):
+                params = {"mode": mode, "percentage": percentage}
+                exact = blur.filter(mode, blur.radius(params))
+                pillow = measure(lambda image=image, exact=exact: image.filter(exact), repeat)
+                node = measure(lambda image=image, params=params: blur.run(image, params), repeat)
+                error = ImageChops.difference(image.filter(exact), blur.run(image, params)).getextrema()
+                print(
+                    f"{f'{mode} {percentage}':<24} {blur.factor(params, image.size):>6} {pillow:>9.1f} ms"
+                    f" {node:>9.1f} ms {pillow / node:>7.1f}x {max(high for _, high in error):>10}"
+                )
+
+
+def resize_policies(repeat: int):
+    """The Resize node at every quality over a range of downscales of a large image,
+    and a JPEG file decoded at a reduced size for it
+    """
+    resize = operations["Resize"]
+    image = sample_image((2000, 1500)).resize((8000, 6000), Image.BICUBIC).convert("RGB")
+    print(f"{image.width}x{image.height} {image.mode}, median of {repeat} runs, mean error against Best")
+    print(f"{'':<8}" + "".join(f"{quality:>22}" for quality in resize.qualities))
+    for percentage in (67, 50, 25, 10, 5):
+        params = {**resize.defaults(), "percentage": percentage}
+        best = resize.run(image, {**params, "quality": "Best"})
+        cells = []
+        for quality in resize.qualities:
+            params = {**params, "quality": quality}
+            elapsed = measure(lambda params=params: resize.run(image, params), repeat)
+            error = statistics.mean(ImageStat.Stat(ImageChops.difference(best, resize.run(image, params))).mean)
+            cells.append(f"{elapsed:.1f} ms {error:>5.2f}")
+        print(f"{f'{percentage}%':<8}" + "".join(f"{cell:>22}" for cell in cells))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "image.jpg")
+        image.save(path, quality=90)
+        print(f"\nJPEG file, open and resize, median of {repeat} runs")
+        print(f"{'':<20} {'decoded':>12} {'draft':>12} {'speedup':>8}")
+        for percentage in (25, 10):
+            steps = [(resize, {**resize.defaults(), "percentage": percentage, "quality": "Balanced"})]
+            decoded = measure(lambda steps=steps: Engine().run(Image.open(path), steps), repeat)
+            draft = measure(lambda steps=steps: Engine().run(*Engine.open(path, steps)), repeat)
+            print(f"{f'Balanced {percentage}%':<20} {decoded:>9.1f} ms {draft:>9.1f} ms {decoded / draft:>7.1f}x")
+
+
+def crop_pushdown(repeat: int):
+    """Chains that end with a crop of a quarter of the image, computed whole and then cropped, or only where the crop
+    keeps the output
+    """
+    image = sample_image()
+    print(f"{image.width}x{image.height} {image.mode}, median of {repeat} runs")
+    print(f"{'':<60} {'whole':>12} {'pushed':>12}")
+    crop = ("Crop", {"left": 960, "top": 540, "right": 2880, "bottom": 1620})
+    chains = [
+        [("Blur", {"percentage": 200}), ("Sharpness", {"percentage": 70}), ("Brightness", {"percentage": 30}), crop],
+        [("Sharpness", {"percentage": 70}), ("Rotate", {"degrees": 90, "expand": True}), crop],
+        [("Blur", {"mode": "Box", "percentage": 300}), ("Resize", {"percentage": 200}), crop],
+    ]
+    for chain in chains:
+        steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in chain]
+        whole = measure(lambda steps=steps: Engine(passes=Engine.passes[:-1]).run(image, steps), repeat)
+        pushed = measure(lambda steps=steps: Engine().run(image, steps), repeat)
+        names = " -> ".join(name for name, _ in chain)
+        print(f"{names:<60} {whole:>9.1f} ms {pushed:>9.1f} ms {whole / pushed:>6.1f}x")
+
+
+def region_evaluation(repeat: int):
+    """A 512x512 region of the output of a 96 MP image at full resolution, against the whole output"""
+    image = sample_image((2000, 1500)).resize((12000, 8000), Image.BILINEAR).convert("RGB")
+    chain = [
+        ("Blur", {"percentage": 200}),
+        ("Rotate", {"degrees": 90, "expand": True}),
+        ("Sharpness", {"percentage": 70}),
+        ("Brightness", {"percentage": 30}),
+    ]
+    steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in chain]
+    print(f"{image.width}x{image.height} {image.mode}, " + " -> ".join(name for name, _ in chain))
+    whole = measure(lambda: Engine().run(image, steps), max(repeat // 5, 1))
+    region = measure(lambda: Engine().region(image, steps, (3000, 4000, 3512, 4512)), repeat)
+    print(f"{'whole output':<24} {whole:>9.1f} ms\n{'512x512 region':<24} {region:>9.1f} ms {whole / region:>6.0f}x")
+
+
+def tile_viewer(repeat: int):
+    """The tiles a 1600x900 output viewer shows of a 96 MP image, fitted and at 100%, against the whole output.
+    Each tile is rendered from the pyramid level that matches the zoom
+    """
+    image = sample_image((2000, 1500)).resize((12000, 8000), Image.BILINEAR).convert("RGB")
+    pyramid = Pyramid(image)
+    pyramid.ready.wait()
+    chain = [("Blur", {"percentage": 200}), ("Contrast", {}), ("Sharpness", {"percentage": 70})]
+    steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in chain]
+    print(f"{image.width}x{image.height} {image.mode}, " + " -> ".join(name for name, _ in chain))
+    whole = measure(lambda: Engine().run(image, steps), max(repeat // 5, 1))
+    print(f"{'':<24} {'edited':>12} {'speedup':>7} {'panned':>12}")
+    print(f"{'whole output':<24} {whole:>9.1f} ms")
+
+    window, tile_size = (1600, 900), 256
+    for label, zoom in (("fitted", min(window[0] / image.width, window[1] / image.height)), ("100%", 1.0)):
+        scales = [level.width / image.width for level in pyramid.levels]
+        level = pyramid.levels[pick_level(scales, zoom)]
+        scale = (level.width / image.width, level.height / image.height)
+        center = (level.width / 2, level.height / 2)
+        half = (window[0] / 2 / zoom * scale[0], window[1] / 2 / zoom * scale[1])
+        view = (center[0] - half[0], center[1] - half[1], center[0] + half[0], center[1] + half[1])
+        tiles = tiles_in_view(level.size, view, tile_size)
+
+        def show(engine, level=level, scale=scale, tiles=tiles):
+            for column, row in tiles:
+                engine.region(level, steps, tile_box(column, row, level.size, tile_size), key="input", scale=scale)
+
+        # After an edit the contrast of the level is measured first, panning around reuses it
+        edited = measure(lambda show=show: show(Engine()), repeat)
+        engine = Engine()
+        panned = measure(lambda show=show, engine=engine: show(engine), repeat)
+        print(f"{f'{label}, {len(tiles)} tiles':<24} {edited:>9.1f} ms {whole / edited:>6.0f}x {panned:>9.1f} ms")
+
+
+MEMORY_CHAIN = [
+    ("Brightness", {"percentage": 30}),
+    ("Blur", {"percentage": 100}),
+    ("Contrast", {"percentage": 35}),
+    ("Sharpness", {"percentage": 60}),
+    ("Opacity", {"percentage": 80}),
+    ("Flip", {"mode": "Horizontal"}),
+]
+
+
+def chain_peak(size: tuple[int, int], cached: bool, passes: bool, in_place: bool) -> float:
+    """Peak resident memory in MB of a process running `MEMORY_CHAIN` once on a noise image of `size`"""
+    pixels = np.random.default_rng(0).integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+    image = Image.fromarray(pixels, "RGBA")
+    del pixels
+
+    steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in MEMORY_CHAIN]
+    engine = Engine(ResultCache(1 << 40) if cached else None, None if passes else ())
+    engine.in_place = in_place
+    engine.run(image, steps, "image" if cached else None)
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def peak_memory(_repeat: int):
+    """Peak RSS of a 6 node chain, each run in its own process, with every result cached like the editor does
+    and without a cache like batch processing, with and without operations working in place on the images they own
+    """
+    size = (6000, 4000)
+    print(
+        f"{size[0]}x{size[1]} RGBA ({size[0] * size[1] * 4 / (1 << 20):.0f} MB), "
+        + " -> ".join(name for name, _ in MEMORY_CHAIN)
+    )
+    print(f"{'':<24} {'copies':>12} {'in place':>12}")
+    context = multiprocessing.get_context("spawn")
+    for cached in (True, False):
+        for passes in (False, True):
+            peaks = []
+            for in_place in (False, True):
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    peaks.append(executor.submit(chain_peak, size, cached, passes, in_place).result())
+            label = f"{'cached' if cached else 'uncached'}, {'fused' if passes else 'separate'}"
+            print(f"{label:<24} {peaks[0]:>9.0f} MB {peaks[1]:>9.0f} MB")
+
+
+benchmarks = {
+    "points": point_fusion,
+    "parallel": parallel_scaling,
+    "blur": blur_strategies,
+    "resize": resize_policies,
+    "crop": crop_pushdown,
+    "region": region_evaluation,
+    "viewer": tile_viewer,
+    "memory": peak_memory,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=benchmarks)
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Runs per measurement")
+    args = parser.parse_args()
+    benchmarks[args.benchmark](args.repeat)
@@ -0,0 +1,40 @@
+import argparse
+import sys
+
+from src.batch import batch
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="cresliant", description="A powerful node-based image editor made in Python.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = subparsers.add_parser("batch", help="Apply a project to every image in a directory")
+    batch_parser.add_argument("project", help="Path to a .cresliant project")
+    batch_parser.add_argument("input_dir", help="Directory with the images to process")
+    batch_parser.add_argument("output_dir", help="Directory where the results are written")
+    batch_parser.add_argument("-w", "--workers", type=int, help="Number of processes (defaults to the CPU count)")
+    batch_parser.add_argument("-f", "--format", help="Extension of the output files, e.g. png")
+    batch_parser.add_argument("--force", action="store_true", help="Process images even if their output is up to date")
+    batch_parser.add_argument(
+        "-t", "--tile-budget", type=int, metavar="MB", help="Process images in tiles using about this much memory each"
+    )
+
+    args = parser.parse_args()
+    if args.command == "batch":
+        try:
+            failed = batch(
+                args.project,
+                args.input_dir,
+                args.output_dir,
+                args.workers,
+                args.format,
+                args.force,
+                args.tile_budget and args.tile_budget * 1024 * 1024,
+            )
+        except (OSError, ValueError) as e:
+            parser.exit(1, f"cresliant: error: {e}\n")
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
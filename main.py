@@ -47,7 +47,9 @@ def export(info):
         filename += extension
 
     location = os.path.join(location, filename)
-    image = dpg.get_item_user_data("Output").pillow_image
+    image = node_editor.render_full()
+    if image is None:
+        image = dpg.get_item_user_data("Output").pillow_image
 
     try:
         image.save(location)
@@ -95,6 +97,7 @@ with dpg.window(
     dpg.add_text("To set an exact value on a slider, Ctrl+Click it.", bullet=True)
     dpg.add_text("To duplicate nodes, select them and press Ctrl+V.", bullet=True)
     dpg.add_text("To export the output, press Ctrl+E.", bullet=True)
+    dpg.add_text("To view the output up close, press Ctrl+F or double click it.", bullet=True)
 
 
 def handle_popup(_sender, app_data):
@@ -126,6 +129,7 @@ actions = {
     dpg.mvKey_B: lambda: webbrowser.open("https://github.com/Cresliant/Cresliant/issues/new/choose"),
     dpg.mvKey_Z: history_manager.undo,
     dpg.mvKey_Y: history_manager.redo,
+    dpg.mvKey_F: node_editor.viewer.open,
 }
 
 
@@ -176,6 +180,24 @@ with dpg.window(
         with dpg.menu(tag="edit", label="Edit"):
             dpg.add_menu_item(label="Undo    ", tag="undo", shortcut="Ctrl+Z", callback=history_manager.undo)
             dpg.add_menu_item(label="Redo    ", tag="redo", shortcut="Ctrl+Y", callback=history_manager.redo)
+            dpg.add_separator()
+            dpg.add_menu_item(
+                label="Preview Mode",
+                tag="preview",
+                check=True,
+                default_value=node_editor.preview,
+                callback=node_editor.toggle_preview,
+            )
+            dpg.add_menu_item(
+                label="Node Previews",
+                tag="node_previews",
+                check=True,
+                default_value=node_editor.previews.enabled,
+                callback=node_editor.previews.toggle,
+            )
+            dpg.add_menu_item(
+                label="Output Viewer    ", tag="viewer", shortcut="Ctrl+F", callback=node_editor.viewer.open
+            )
 
         with dpg.menu(tag="nodes", label="Nodes"):
             for module in node_editor.modules[1:]:
@@ -214,17 +236,19 @@ with dpg.window(
     auto_align("manual_modal", AlignmentType.Both)
 
 
+node_editor.viewer.create()
+
 dpg.setup_dearpygui()
 dpg.show_viewport()
 dpg.maximize_viewport()
 dpg.set_primary_window("Cresliant", True)
 
-if node_editor.debug:
-    # This makes debuggers actually work by stopping at breakpoints
-    while dpg.is_dearpygui_running():
+while dpg.is_dearpygui_running():
+    if node_editor.debug:
+        # This makes debuggers actually work by stopping at breakpoints
         jobs = dpg.get_callback_queue()
         dpg.run_callbacks(jobs)
-        dpg.render_dearpygui_frame()
+    node_editor.present()
+    dpg.render_dearpygui_frame()
 
-dpg.start_dearpygui()
 dpg.destroy_context()
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import suppress
+
+from PIL import Image
+
+from src.engine import Engine, Graph, load_project
+
+
+def process(graph: Graph, source: str, destination: str, tile_budget: int = None) -> float:
+    """The output is written next to `destination` and moved there once it's complete,
+    so a failed or interrupted image never leaves a truncated output behind
+    """
+    start = time.perf_counter()
+    directory, filename = os.path.split(destination)
+    name, ext = os.path.splitext(filename)
+    # Keeps the extension, which the format is chosen by
+    partial = os.path.join(directory, f".{name}.partial{ext}")
+    try:
+        image, steps = Engine.open(source, graph.steps())
+        with image:
+            if tile_budget:
+                Engine().export(image, steps, partial, tile_budget)
+            else:
+                output = Engine().run(image, steps)
+                try:
+                    output.save(partial)
+                except OSError:
+                    # Formats like JPEG can't store an alpha channel
+                    output.convert("RGB").save(partial)
+        os.replace(partial, destination)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(partial)
+        raise
+    return time.perf_counter() - start
+
+
+def batch(
+    project: str,
+    input_dir: str,
+    output_dir: str,
+    workers: int = None,
+    extension: str = None,
+    force: bool = False,
+    tile_budget: int = None,
+):
+    """Applies a project to every image in `input_dir` and writes the results to `output_dir`.
+    Outputs newer than both their source image and the project are skipped unless `force` is set.
+    With a `tile_budget` in bytes, images are processed in tiles and PNG outputs are written as they are computed
+    """
+    with open(project) as file:
+        graph = load_project(json.load(file))
+    graph.steps()  # Fails early if the input isn't connected to the output
+
+    os.makedirs(output_dir, exist_ok=True)
+    project_time = os.path.getmtime(project)
+    extensions = Image.registered_extensions()
+
+    jobs = []
+    skipped = 0
+    for filename in sorted(os.listdir(input_dir)):
+        source = os.path.join(input_dir, filename)
+        name, ext = os.path.splitext(filename)
+        if not os.path.isfile(source) or ext.lower() not in extensions:
+            continue
+
+        if extension:
+            filename = name + "." + extension.lstrip(".")
+        destination = os.path.join(output_dir, filename)
+        if (
+            not force
+            and os.path.exists(destination)
+            and os.path.getmtime(destination) >= max(os.path.getmtime(source), project_time)
+        ):
+            skipped += 1
+            continue
+        jobs.append((source, destination))
+
+    print(f"Processing {len(jobs)} images, {skipped} up to date")
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process, graph, source, destination, tile_budget): source for source, destination in jobs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            name = os.path.basename(futures[future])
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(jobs)}] {name} failed: {e}")
+                continue
+            print(f"[{done}/{len(jobs)}] {name} {elapsed * 1000:.1f} ms")
+
+    print(f"Done in {time.perf_counter() - start:.2f} s, {failed} failed")
+    return failed
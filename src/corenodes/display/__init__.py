@@ -1,2 +1,4 @@
 from .input import InputModule
 from .output import OutputModule
+from .viewer import OutputViewer
+from .previews import NodePreviews
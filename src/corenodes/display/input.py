@@ -1,6 +1,8 @@
 from dearpygui import dearpygui as dpg
 from PIL import Image
 
+from src.engine import Pyramid
+from src.engine.modes import native
 from src.utils import ImageController as dpg_img
 from src.utils import fd, theme, toaster
 from src.utils.paths import resource
@@ -10,10 +12,18 @@ class InputModule:
     name = "Input"
     tooltip = "Image input"
 
+    # Largest side of the image shown in the node, also the smallest level of the pyramid
+    thumbnail_size = 450
+
     def __init__(self, image: Image.Image, update_output: callable):
         self.counter = 0
         self.image = image
+        self.pyramid = Pyramid(image, self.thumbnail_size)
         self.image_path = resource("icon.ico")
+        self.revision = 0
+        self._proxies: dict[int, Image.Image] = {}
+        # The pyramid that was shown once it was built, it's built on another thread and shown on the UI thread
+        self._presented: Pyramid | None = None
         self.viewer = None
         self.update_output = update_output
         self.protected = True
@@ -26,13 +36,47 @@ class InputModule:
             toaster.show("Input", "Invalid image file.")
             return
 
-        image = image.convert("RGBA")
-        self.image = image.copy()
+        self.set_image(native(image), path)
+
+    def set_image(self, image: Image.Image, path: str):
+        """Replaces the image, the node and the output are updated once its pyramid has been built in the background"""
+        self.image = image
         self.image_path = path
-        image.thumbnail((450, 450), Image.LANCZOS)
-        self.viewer.load(image)
+        self.revision += 1
+        self._proxies = {}
+        self.pyramid = Pyramid(image, self.thumbnail_size)
+
+    def present(self):
+        """Shows the image in the node and updates the output once its pyramid is built,
+        must be called from the UI thread
+        """
+        pyramid = self.pyramid
+        if pyramid is self._presented or not pyramid.ready.is_set():
+            return
+
+        self._presented = pyramid
+        if self.viewer is not None:
+            self.viewer.load(pyramid.fit(self.thumbnail_size))
         self.update_output()
 
+    def get_proxy(self, size: int) -> tuple[Image.Image, tuple[float, float]]:
+        """Returns the image downscaled to fit in `size` and the (x, y) scale of it relative to the image.
+        It's resampled from the smallest level of the pyramid that is large enough.
+        The output is only rendered once the pyramid is built, until then the proxy comes from the levels that are
+        and isn't kept, so the results cached for it stay the same
+        """
+        proxy = self._proxies.get(size)
+        if proxy is None:
+            proxy = self.pyramid.fit(size)
+            if self.pyramid.ready.is_set():
+                self._proxies[size] = proxy
+
+        return proxy, (proxy.width / self.image.width, proxy.height / self.image.height)
+
+    @property
+    def cache_key(self) -> tuple:
+        return self.name, self.revision
+
     def new(self):
         if dpg.does_item_exist("Input"):
             dpg.delete_item("Input")
@@ -40,7 +84,7 @@ class InputModule:
         with dpg.node(
             parent="MainNodeEditor", tag="Input", label="Input", pos=[10, 100], user_data=self
         ), dpg.node_attribute(attribute_type=dpg.mvNode_Attr_Output):
-            self.viewer = dpg_img.add_image(self.image)
+            self.viewer = dpg_img.add_image(self.pyramid.fit(self.thumbnail_size))
             dpg.add_spacer(height=5)
             dpg.add_button(
                 label="Choose Image",
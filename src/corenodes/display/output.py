@@ -1,3 +1,6 @@
+from collections import OrderedDict
+
+import numpy as np
 from dearpygui import dearpygui as dpg
 from PIL import Image
 
@@ -8,11 +11,18 @@ class OutputModule:
     name = "Output"
     tooltip = "Image output"
 
-    def __init__(self, image):
+    # Previews of different sizes each need their own texture, the least recently used ones are released
+    pool_size = 4
+
+    def __init__(self, image, open_viewer: callable = None):
+        """:param open_viewer: Called when the image of the node is double clicked"""
         self.counter = 0
         self.image = image
+        self.open_viewer = open_viewer
+        self._handler = None
         self.pillow_image = Image.new("RGBA", (1, 1), (0, 0, 0, 0))
         self.protected = True
+        self._textures: OrderedDict[tuple[int, int], tuple[int | str, np.ndarray]] = OrderedDict()
 
     def new(self):
         if dpg.does_item_exist("Output"):
@@ -25,6 +35,54 @@ class OutputModule:
             pos=[800, 100],
             user_data=self,
         ), dpg.node_attribute(attribute_type=dpg.mvNode_Attr_Input, tag="Output_attribute"):
-            dpg.add_image(self.image)
+            dpg.add_image(self.image, tag="Output_image")
+            dpg.add_spacer(height=5, tag="Output_spacer", show=False)
+            dpg.add_text(tag="Output_size", show=False)
 
         dpg.bind_item_theme("Output", theme.red)
+        if self.open_viewer is not None:
+            if self._handler is None:
+                with dpg.item_handler_registry() as self._handler:
+                    dpg.add_item_double_clicked_handler(callback=self.open_viewer)
+            dpg.bind_item_handler_registry("Output_image", self._handler)
+
+    def texture(self, size: tuple[int, int]) -> tuple[int | str, np.ndarray]:
+        """A dynamic texture of `size` with its float32 buffer, both are reused by every preview of that size"""
+        if size in self._textures:
+            self._textures.move_to_end(size)
+            return self._textures[size]
+
+        buffer = np.zeros(size[0] * size[1] * 4, dtype=np.float32)
+        with dpg.texture_registry():
+            texture = dpg.add_dynamic_texture(*size, buffer)
+        self._textures[size] = texture, buffer
+
+        for old in list(self._textures):
+            if len(self._textures) <= self.pool_size:
+                break
+            # The texture that is still shown is released once another one replaces it
+            if self._textures[old][0] != self.image:
+                dpg.delete_item(self._textures.pop(old)[0])
+        return texture, buffer
+
+    def show(self, preview: Image.Image, size: tuple[int, int] | None = None):
+        """Updates the image of the node in place, `size` is shown below it when given.
+        Must be called from the UI thread
+        """
+        texture, buffer = self.texture(preview.size)
+        pixels = np.asarray(preview.convert("RGBA")).reshape(-1)
+        np.multiply(pixels, np.float32(1 / 255), out=buffer, dtype=np.float32)
+        dpg.set_value(texture, buffer)
+
+        if texture != self.image:
+            self.image = texture
+            dpg.configure_item("Output_image", texture_tag=texture, width=preview.width, height=preview.height)
+        dpg.configure_item("Output_image", show=True)
+        dpg.configure_item("Output_spacer", show=size is not None)
+        dpg.configure_item("Output_size", show=size is not None)
+        if size is not None:
+            dpg.set_value("Output_size", f"Image size: {size[0]}x{size[1]}")
+
+    def clear(self):
+        for tag in ("Output_image", "Output_spacer", "Output_size"):
+            dpg.configure_item(tag, show=False)
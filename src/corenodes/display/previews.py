@@ -0,0 +1,154 @@
+import time
+from typing import NamedTuple
+
+import numpy as np
+from dearpygui import dearpygui as dpg
+from PIL import Image
+
+from src.engine import Engine, Node, Operation
+from src.engine.pyramid import fit
+from src.utils.ImageController import HandlerDeleter
+from src.utils.render import RenderWorker
+
+
+class PreviewJob(NamedTuple):
+    node: str
+    # The input and the steps up to the node, the preview is rendered again once they change
+    signature: tuple
+    image: Image.Image
+    key: tuple
+    scale: tuple[float, float]
+    steps: list[tuple[Operation, dict]]
+
+
+class PreviewResult(NamedTuple):
+    node: str
+    signature: tuple
+    preview: Image.Image
+
+
+class NodePreviews:
+    """Thumbnails of the outputs of the nodes on the path, shown below their settings.
+    They're rendered with the same proxy and cache keys as the output, so a node's result is usually cached already
+    and only the nodes that were fused with the next one are computed. A preview is only rendered while its node is
+    visible on the canvas, one at a time and only while the output isn't rendering, which cancels it
+    """
+
+    size = 150
+    # Seconds after the last frame a node was visible in during which it still counts as visible
+    visible_time = 0.5
+    # Seconds between two previews
+    interval = 0.25
+
+    def __init__(self, engine: Engine, renderer: RenderWorker):
+        """:param renderer: Renders the output, previews wait for it"""
+        self.engine = engine
+        self.renderer = renderer
+        self.worker = RenderWorker(self.render)
+        self.enabled = False
+        # Attribute, image, texture, buffer and handler of the preview of every node
+        self._items: dict[str, tuple] = {}
+        self._visible: dict[str, float] = {}
+        self._signatures: dict[str, tuple] = {}
+        self._registry = None
+        self._submitted = 0.0
+
+    def toggle(self, _sender=None, app_data=None):
+        self.enabled = bool(app_data)
+        for node, (attribute, *_) in self._items.items():
+            if dpg.does_item_exist(attribute):
+                dpg.configure_item(attribute, show=self.enabled)
+            if not self.enabled:
+                self._signatures.pop(node, None)
+
+    def render(self, job: PreviewJob, cancelled: callable) -> PreviewResult:
+        image = self.engine.run(job.image, job.steps, job.key, job.scale, lambda: cancelled() or self.renderer.busy)
+        return PreviewResult(job.node, job.signature, fit(image, self.size))
+
+    def create(self, node: str) -> tuple:
+        if self._registry is None:
+            self._registry = dpg.add_texture_registry()
+        buffer = np.zeros(self.size * self.size * 4, dtype=np.float32)
+        texture = dpg.add_dynamic_texture(self.size, self.size, buffer, parent=self._registry)
+        with dpg.node_attribute(parent=node, attribute_type=dpg.mvNode_Attr_Static) as attribute:
+            image = dpg.add_image(texture, width=self.size, height=self.size)
+        with dpg.item_handler_registry() as handler:
+            dpg.add_item_visible_handler(callback=self.visible, user_data=node)
+        dpg.bind_item_handler_registry(image, handler)
+
+        self._items[node] = attribute, image, texture, buffer, handler
+        return self._items[node]
+
+    def visible(self, _sender, _app_data, node: str):
+        self._visible[node] = time.monotonic()
+
+    def release(self, node: str):
+        _, _, texture, _, handler = self._items.pop(node)
+        self._visible.pop(node, None)
+        self._signatures.pop(node, None)
+        dpg.delete_item(texture)
+        HandlerDeleter.add(handler)
+
+    def show(self, result: PreviewResult):
+        if result.node not in self._items:
+            return
+        _, image, texture, buffer, _ = self._items[result.node]
+        preview = result.preview
+        # The texture keeps its size, the preview takes its top left corner
+        pixels = buffer.reshape(self.size, self.size, 4)
+        pixels[:] = 0
+        np.multiply(
+            np.asarray(preview.convert("RGBA")), np.float32(1 / 255), out=pixels[: preview.height, : preview.width]
+        )
+        dpg.set_value(texture, buffer)
+        dpg.configure_item(
+            image,
+            width=preview.width,
+            height=preview.height,
+            uv_max=(preview.width / self.size, preview.height / self.size),
+        )
+        self._signatures[result.node] = result.signature
+
+    def present(self, nodes: list[Node], source: callable):
+        """Shows the previews that are ready and renders the next one, must be called from the UI thread.
+        :param nodes: Nodes of the path after the input
+        :param source: Returns the proxy, cache key and scale the output is rendered with
+        """
+        result = self.worker.poll()
+        if result is not None:
+            self.show(result)
+
+        # Deleting a node deletes its preview with it
+        for node in [node for node, (attribute, *_) in self._items.items() if not dpg.does_item_exist(attribute)]:
+            self.release(node)
+        if not self.enabled:
+            return
+
+        path = {node.id for node in nodes if node.operation is not None}
+        for node, (attribute, *_) in self._items.items():
+            dpg.configure_item(attribute, show=node in path)
+
+        now = time.monotonic()
+        if self.worker.busy or self.renderer.busy or now - self._submitted < self.interval:
+            return
+
+        image, key, scale = None, None, None
+        steps = []
+        for node in nodes:
+            if node.operation is None:
+                break
+            steps.append((node.operation, dict(node.params)))
+            if node.id not in self._items:
+                if dpg.does_item_exist(node.id):
+                    self.create(node.id)
+                continue
+            if now - self._visible.get(node.id, 0.0) > self.visible_time:
+                continue
+
+            if image is None:
+                image, key, scale = source()
+            signature = (key, tuple((operation.name, tuple(params.items())) for operation, params in steps))
+            if self._signatures.get(node.id) != signature:
+                self._submitted = now
+                self.worker.submit([PreviewJob(node.id, signature, image, key, scale, steps[:])])
+                return
@@ -0,0 +1,214 @@
+import numpy as np
+from dearpygui import dearpygui as dpg
+
+from src.engine import Engine, Operation, Pyramid
+from src.utils.render import TileJob, TileResult, TileWorker
+from src.utils.tiles import Tile, TileStore, pick_level, tile_box, tiles_in_view
+
+
+class OutputViewer:
+    """A window that shows the output at any zoom, dragged to pan and zoomed with the mouse wheel.
+    The output is rendered in tiles from the level of the input pyramid that matches the zoom, only the tiles in view
+    are rendered and uploaded, and the tiles of coarser levels fill in until they arrive
+    """
+
+    tag = "output_viewer"
+    tile_size = 256
+    # Bytes of tile textures kept, textures are float32 RGBA so a full tile takes 1 MB
+    texture_budget = 256 * 1024 * 1024
+    # Each notch of the mouse wheel zooms by this factor
+    zoom_step = 1.25
+    max_zoom = 16.0
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.worker = TileWorker(self.render)
+        self.tiles = TileStore(dpg.delete_item, self.texture_budget)
+        self.generation = 0
+        self.pyramid: Pyramid | None = None
+        self.key: tuple = ()
+        self.steps: list[tuple[Operation, dict]] | None = None
+        # Screen pixels per pixel of the full output and the point of it in the middle of the window,
+        # no zoom fits the output in the window
+        self.zoom: float | None = None
+        self.center = (0.0, 0.0)
+        # Image, scale and output size of every pyramid level that was built
+        self._levels: list[tuple] = []
+        self._canvas = (1, 1)
+        self._drag: tuple[float, float] | None = None
+        self._drawn = None
+        self._requested = None
+        self._registry = None
+
+    def create(self):
+        self._registry = dpg.add_texture_registry()
+        with dpg.window(tag=self.tag, label="Output Viewer", show=False, width=800, height=600, no_scrollbar=True):
+            dpg.add_drawlist(1, 1, tag=self.tag + "_canvas")
+
+        # The canvas fills the window up to its edges
+        with dpg.theme() as theme, dpg.theme_component(dpg.mvAll):
+            dpg.add_theme_style(dpg.mvStyleVar_WindowPadding, 0, 0, category=dpg.mvThemeCat_Core)
+        dpg.bind_item_theme(self.tag, theme)
+
+        with dpg.handler_registry():
+            dpg.add_mouse_wheel_handler(callback=self.wheel)
+
+    def open(self, _sender=None, _app_data=None):
+        self.zoom = None
+        dpg.show_item(self.tag)
+        dpg.focus_item(self.tag)
+
+    def refresh(self, pyramid: Pyramid, key: tuple, steps: list[tuple[Operation, dict]] | None):
+        """Renders the tiles again for new steps, `steps` is None when nothing is connected to the output.
+        The tiles that are shown stay until they're replaced
+        """
+        if pyramid is not self.pyramid:
+            self.tiles.clear()
+            self.zoom = None
+        self.generation += 1
+        self.pyramid, self.key, self.steps = pyramid, key, steps
+        self._levels = []
+        self._drawn = self._requested = None
+        self.worker.cancel()
+
+    def levels(self) -> list[tuple]:
+        """Image, scale and output size of the levels of the pyramid, more are added while it's being built"""
+        levels = self.pyramid.levels[:]
+        if len(levels) != len(self._levels):
+            size = levels[0].size
+            self._levels = []
+            for image in levels:
+                scale = (image.width / size[0], image.height / size[1])
+                steps = [(operation, operation.scale(params, scale)) for operation, params in self.steps]
+                self._levels.append((image, scale, self.engine.output_size(steps, image.size)))
+        return self._levels
+
+    def render(self, job: TileJob) -> TileResult:
+        tile = self.engine.region(job.image, job.steps, job.box, key=job.key, scale=job.scale)
+        # Converted on the worker thread, the UI thread only uploads it
+        pixels = np.asarray(tile.convert("RGBA")).reshape(-1)
+        return TileResult(
+            job.tile, job.generation, tile.size, np.multiply(pixels, np.float32(1 / 255), dtype=np.float32)
+        )
+
+    def wheel(self, _sender, app_data):
+        if self.zoom is None or not self._levels or not dpg.is_item_hovered(self.tag + "_canvas"):
+            return
+
+        # The point under the mouse stays where it is
+        mouse = self.mouse()
+        width, height = self._canvas
+        point = (
+            self.center[0] + (mouse[0] - width / 2) / self.zoom,
+            self.center[1] + (mouse[1] - height / 2) / self.zoom,
+        )
+        output = self._levels[0][2]
+        zoom = min(
+            max(self.zoom * self.zoom_step**app_data, min(width / output[0], height / output[1]) / 2), self.max_zoom
+        )
+        self.center = (point[0] - (mouse[0] - width / 2) / zoom, point[1] - (mouse[1] - height / 2) / zoom)
+        self.zoom = zoom
+
+    def mouse(self) -> tuple[float, float]:
+        """Position of the mouse on the canvas"""
+        mouse, origin = dpg.get_mouse_pos(local=False), dpg.get_item_rect_min(self.tag + "_canvas")
+        return mouse[0] - origin[0], mouse[1] - origin[1]
+
+    def pan(self):
+        if not dpg.is_mouse_button_down(dpg.mvMouseButton_Left):
+            self._drag = None
+            return
+        if self._drag is None and not dpg.is_item_hovered(self.tag + "_canvas"):
+            return
+
+        mouse = self.mouse()
+        if self._drag is not None:
+            self.center = (
+                self.center[0] - (mouse[0] - self._drag[0]) / self.zoom,
+                self.center[1] - (mouse[1] - self._drag[1]) / self.zoom,
+            )
+        self._drag = mouse
+
+    def upload(self):
+        """Turns the tiles that finished rendering into textures"""
+        for result in self.worker.poll():
+            if result.generation != self.generation:
+                continue
+            texture = dpg.add_static_texture(*result.size, result.pixels, parent=self._registry)
+            self.tiles.add(result.tile, texture, result.size, result.pixels.nbytes, result.generation)
+
+    def present(self):
+        """Uploads the tiles that are ready and draws the ones in view, must be called from the UI thread"""
+        canvas = self.tag + "_canvas"
+        self.upload()
+        if self.steps is None or not dpg.does_item_exist(self.tag) or not dpg.is_item_shown(self.tag):
+            self.tiles.evict(set())
+            if self._drawn is not None and dpg.does_item_exist(canvas):
+                dpg.delete_item(canvas, children_only=True)
+                self._drawn = None
+            return
+
+        # The canvas takes the window below its title bar
+        size, position = dpg.get_item_rect_size(self.tag), dpg.get_item_pos(self.tag)
+        origin = dpg.get_item_rect_min(canvas)
+        width = max(size[0] - (origin[0] - position[0]), 1)
+        height = max(size[1] - (origin[1] - position[1]), 1)
+        if self._canvas != (width, height):
+            self._canvas = (width, height)
+            dpg.configure_item(canvas, width=width, height=height)
+
+        levels = self.levels()
+        output = levels[0][2]
+        if self.zoom is None:
+            self.zoom = min(width / output[0], height / output[1])
+            self.center = (output[0] / 2, output[1] / 2)
+        self.pan()
+
+        view = (
+            self.center[0] - width / 2 / self.zoom,
+            self.center[1] - height / 2 / self.zoom,
+            self.center[0] + width / 2 / self.zoom,
+            self.center[1] + height / 2 / self.zoom,
+        )
+        level = pick_level([size[0] / output[0] for _, _, size in levels], self.zoom)
+        drawn, missing = self.place(levels, level, view)
+        # Coarser levels fill in under the tiles that are still missing, up to the first one that covers the view
+        covered = not missing
+        for index in range(level + 1, len(levels)):
+            if covered:
+                break
+            coarse, gaps = self.place(levels, index, view)
+            drawn, covered = coarse + drawn, not gaps
+
+        if drawn != self._drawn:
+            self._drawn = drawn
+            dpg.delete_item(canvas, children_only=True)
+            for _, texture, pmin, pmax in drawn:
+                dpg.draw_image(texture, pmin, pmax, parent=canvas)
+
+        requested = [(job.tile, job.generation) for job in missing]
+        if requested != self._requested:
+            self._requested = requested
+            self.worker.request(missing)
+        self.tiles.evict({tile for tile, *_ in drawn})
+
+    def place(self, levels: list[tuple], index: int, view: tuple) -> tuple[list[tuple], list[TileJob]]:
+        """Where the tiles of a level in `view` are drawn on the canvas, and the jobs of those that aren't rendered
+        for the current steps yet. `view` is in pixels of the full output
+        """
+        image, scale, size = levels[index]
+        output = levels[0][2]
+        ratio = (size[0] / output[0], size[1] / output[1])
+        drawn, missing = [], []
+        for column, row in tiles_in_view(
+            size, (view[0] * ratio[0], view[1] * ratio[1], view[2] * ratio[0], view[3] * ratio[1]), self.tile_size
+        ):
+            tile, box = Tile(index, column, row), tile_box(column, row, size, self.tile_size)
+            texture = self.tiles.show(tile)
+            if texture is None or texture.generation != self.generation:
+                missing.append(TileJob(tile, self.generation, image, (*self.key, scale), scale, self.steps, box))
+            if texture is not None:
+                pmin = ((box[0] / ratio[0] - view[0]) * self.zoom, (box[1] / ratio[1] - view[1]) * self.zoom)
+                pmax = ((box[2] / ratio[0] - view[0]) * self.zoom, (box[3] / ratio[1] - view[1]) * self.zoom)
+                drawn.append((tile, texture.texture, pmin, pmax))
+        return drawn, missing
@@ -1,5 +1,4 @@
 from dearpygui import dearpygui as dpg
-from PIL import Image, ImageFilter
 
 from src.utils import find_available_pos, theme
 from src.utils.nodes import NodeParent
@@ -47,13 +46,3 @@ class BlurModule(NodeParent):
         if history:
             self.update_history(tag)
         self.counter += 1
-
-    def run(self, image: Image.Image, tag: str) -> Image.Image:
-        if self.settings[tag]["blur_mode_" + tag.split("_")[-1]] == "Box":
-            return image.filter(
-                ImageFilter.BoxBlur(radius=self.settings[tag]["blur_percentage_" + tag.split("_")[-1]] / 50)
-            )
-
-        return image.filter(
-            ImageFilter.GaussianBlur(radius=self.settings[tag]["blur_percentage_" + tag.split("_")[-1]] / 65)
-        )
@@ -1,5 +1,4 @@
 from dearpygui import dearpygui as dpg
-from PIL import Image, ImageEnhance
 
 from src.utils import find_available_pos, theme
 from src.utils.nodes import NodeParent
@@ -39,8 +38,3 @@ class ContrastModule(NodeParent):
         if history:
             self.update_history(tag)
         self.counter += 1
-
-    def run(self, image: Image.Image, tag: str) -> Image.Image:
-        tag = tag.split("_")[-1]
-        percent = self.settings["contrast_" + tag]["contrast_percentage_" + tag]
-        return ImageEnhance.Contrast(image).enhance(percent / 25)
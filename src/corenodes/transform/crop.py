@@ -1,5 +1,4 @@
 from dearpygui import dearpygui as dpg
-from PIL import Image
 
 from src.utils import find_available_pos, theme
 from src.utils.nodes import NodeParent
@@ -72,11 +71,3 @@ class CropModule(NodeParent):
         if history:
             self.update_history(tag)
         self.counter += 1
-
-    def run(self, image: Image.Image, tag: str) -> Image.Image:
-        tag = tag.split("_")[-1]
-        left = self.settings["crop_" + tag]["left_" + tag]
-        top = self.settings["crop_" + tag]["top_" + tag]
-        right = self.settings["crop_" + tag]["right_" + tag]
-        bottom = self.settings["crop_" + tag]["bottom_" + tag]
-        return image.crop((left, top, right, bottom))
@@ -1,5 +1,4 @@
 from dearpygui import dearpygui as dpg
-from PIL import Image
 
 from src.utils import find_available_pos, theme
 from src.utils.nodes import NodeParent
@@ -37,13 +36,3 @@ class FlipModule(NodeParent):
         if history:
             self.update_history(tag)
         self.counter += 1
-
-    def run(self, image: Image.Image, tag: str) -> Image.Image:
-        mode_tag = "flip_mode_" + tag.split("_")[-1]
-        if self.settings[tag][mode_tag] == "Horizontal":
-            return image.transpose(Image.FLIP_LEFT_RIGHT)
-        if self.settings[tag][mode_tag] == "Vertical":
-            return image.transpose(Image.FLIP_TOP_BOTTOM)
-
-        image = image.transpose(Image.FLIP_LEFT_RIGHT)
-        return image.transpose(Image.FLIP_TOP_BOTTOM)
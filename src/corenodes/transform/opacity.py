@@ -1,5 +1,4 @@
 from dearpygui import dearpygui as dpg
-from PIL import Image, ImageEnhance
 
 from src.utils import find_available_pos, theme
 from src.utils.nodes import NodeParent
@@ -39,12 +38,3 @@ class OpacityModule(NodeParent):
         if history:
             self.update_history(tag)
         self.counter += 1
-
-    def run(self, image: Image.Image, tag: str) -> Image.Image:
-        image = image.copy()
-        alpha = image.split()[3]
-        alpha = ImageEnhance.Brightness(alpha).enhance(
-            self.settings[tag]["opacity_percentage_" + tag.split("_")[-1]] / 100
-        )
-        image.putalpha(alpha)
-        return image
@@ -1,5 +1,4 @@
 from dearpygui import dearpygui as dpg
-from PIL import Image
 
 from src.utils import find_available_pos, theme
 from src.utils.nodes import NodeParent
@@ -57,6 +56,14 @@ class ResizeModule(NodeParent):
                     format="%0.0f%%",
                     callback=self.update_output,
                 )
+                dpg.add_combo(
+                    tag="resize_quality_" + str(self.counter),
+                    label="Quality",
+                    items=["Best", "Balanced", "Fast"],
+                    default_value="Best",
+                    width=150,
+                    callback=self.update_output,
+                )
 
         tag = "resize_" + str(self.counter)
         dpg.bind_item_theme(tag, theme.blue)
@@ -64,18 +71,8 @@ class ResizeModule(NodeParent):
             "width_size_" + str(self.counter): input_image.width,
             "height_size_" + str(self.counter): input_image.height,
             "resize_percentage_" + str(self.counter): 100,
+            "resize_quality_" + str(self.counter): "Best",
         }
         if history:
             self.update_history(tag)
         self.counter += 1
-
-    def run(self, image: Image.Image, tag: str) -> Image.Image:
-        tag = tag.split("_")[-1]
-        percent = self.settings["resize_" + tag]["resize_percentage_" + tag]
-        return image.resize(
-            (
-                max(self.settings["resize_" + tag]["width_size_" + tag] * percent // 100, 1),
-                max(self.settings["resize_" + tag]["height_size_" + tag] * percent // 100, 1),
-            ),
-            Image.LANCZOS,
-        )
@@ -1,5 +1,4 @@
 from dearpygui import dearpygui as dpg
-from PIL import Image
 
 from src.utils import find_available_pos, theme
 from src.utils.nodes import NodeParent
@@ -32,13 +31,28 @@ class RotateModule(NodeParent):
                     format="%0.0f°",
                     callback=self.update_output,
                 )
+                dpg.add_checkbox(
+                    tag="rotate_expand_" + str(self.counter),
+                    label="Expand",
+                    default_value=False,
+                    callback=self.update_output,
+                )
+                dpg.add_combo(
+                    tag="rotate_resample_" + str(self.counter),
+                    label="Filter",
+                    items=["Nearest", "Bilinear", "Bicubic"],
+                    default_value="Nearest",
+                    width=150,
+                    callback=self.update_output,
+                )
 
         tag = "rotate_" + str(self.counter)
         dpg.bind_item_theme(tag, theme.green)
-        self.settings[tag] = {"rotate_degrees_" + str(self.counter): 1}
+        self.settings[tag] = {
+            "rotate_degrees_" + str(self.counter): 360,
+            "rotate_expand_" + str(self.counter): False,
+            "rotate_resample_" + str(self.counter): "Nearest",
+        }
         if history:
             self.update_history(tag)
         self.counter += 1
-
-    def run(self, image: Image.Image, tag: str) -> Image.Image:
-        return image.rotate(self.settings[tag]["rotate_degrees_" + tag.split("_")[1]])
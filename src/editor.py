@@ -1,13 +1,13 @@
 import json
 import os
 import sys
+import time
 from contextlib import suppress
 
 import dearpygui.dearpygui as dpg
-import numpy as np
 from PIL import Image
 
-from src.corenodes.display import InputModule, OutputModule
+from src.corenodes.display import InputModule, NodePreviews, OutputModule, OutputViewer
 from src.corenodes.transform import (
     BlurModule,
     BrightnessModule,
@@ -19,9 +19,13 @@ from src.corenodes.transform import (
     RotateModule,
     SharpnessModule,
 )
+from src.engine import INPUT, OUTPUT, Engine, Graph, ResultCache
+from src.engine.modes import native
+from src.engine.pyramid import fit, fit_size
 from src.utils import fd, toaster
-from src.utils.nodes import HistoryItem, Link, history_manager
+from src.utils.nodes import HistoryItem, Link, LinkStore, history_manager
 from src.utils.paths import resource
+from src.utils.render import RenderJob, RenderResult, RenderWorker
 
 
 class NodeEditor:
@@ -31,14 +35,31 @@ class NodeEditor:
     debug = not hasattr(sys, "_MEIPASS")
 
     modules = []
-    _node_links = []
     _data = None
 
     _project = None
 
     path = []
 
-    def __init__(self, pillow_image: Image.Image):
+    # Renders the output from a downscaled proxy of the input, the full resolution is only rendered on export
+    preview = True
+    proxy_size = 1024
+    # A first pass from a proxy this many times smaller shows up within milliseconds, the later passes refine it
+    coarse_factor = 8
+    # While a setting is dragged the output is approximated, it's rendered exactly once the setting is released
+    # or hasn't changed for this many seconds
+    settle_time = 0.3
+    _dragging = None
+    _dragged = 0.0
+
+    def __init__(self, pillow_image: Image.Image, cache_size: int = 512 * 1024 * 1024, workers: int = None):
+        self.cache = ResultCache(cache_size)
+        self.engine = Engine(self.cache, workers=workers or os.cpu_count() or 1)
+        self.links = LinkStore()
+        self.graph = self.new_graph()
+        self.renderer = RenderWorker(self.render)
+        self.viewer = OutputViewer(self.engine)
+        self.previews = NodePreviews(self.engine, self.renderer)
         self.modules = [
             InputModule(pillow_image, self.update_output),
             ResizeModule(self.update_output),
@@ -50,13 +71,15 @@ class NodeEditor:
             OpacityModule(self.update_output),
             CropModule(self.update_output),
             FlipModule(self.update_output),
-            OutputModule("output_0"),
+            OutputModule("output_0", self.viewer.open),
         ]
 
     def start(self):
         history_manager.update_path = self.update_path
         history_manager.update_output = self.update_output
-        history_manager.links = self._node_links
+        history_manager.add_link = self.add_link
+        history_manager.remove_link = self.remove_link
+        history_manager.remove_node = self.remove_node
 
         with dpg.node_editor(
             tag=self._tag,
@@ -74,35 +97,57 @@ class NodeEditor:
             with dpg.tooltip(parent=module.name + "_popup"):
                 dpg.add_text(module.tooltip)
 
+    @staticmethod
+    def new_graph() -> Graph:
+        graph = Graph()
+        graph.add_node(INPUT)
+        graph.add_node(OUTPUT)
+        return graph
+
     def update_path(self):
-        self.path.clear()
-        for node in dpg.get_all_items():
-            try:
-                data_ = dpg.get_item_user_data(node)
-            except SystemError:
-                continue
-            if data_ and data_.name == "Input":
-                self.path.append(node)
-                break
+        """The graph follows the links as they change, the output is then rendered from the graph alone"""
+        self.path = [node.id for node in self.graph.path()]
+
+    def graph_node(self, attribute: int) -> str:
+        """Adds the node of an attribute to the graph if it isn't there yet, and returns its alias"""
+        node = dpg.get_item_alias(dpg.get_item_info(attribute)["parent"])
+        if node not in self.graph.nodes:
+            module = dpg.get_item_user_data(node)
+            self.graph.add_node(module.name, node, **module.params(node))
+        return node
+
+    def add_link(self, source: int, target: int, link_id: int) -> Link | None:
+        """Records a link that was added to the editor, returns the link it replaced"""
+        replaced = self.links.add(Link(source=source, target=target, id=int(link_id)))
+        with suppress(SystemError):
+            self.graph.connect(self.graph_node(source), self.graph_node(target))
+        return replaced
 
-        while True:
-            link = dpg.get_item_info(self.path[-1])["children"][1][-1]
-            found = False
-            for link_ in self._node_links:
-                if link_.source == link:
-                    try:
-                        self.path.append(dpg.get_item_info(link_.target)["parent"])
-                    except SystemError:
-                        continue
-
-                    found = True
-                    break
+    def remove_link(self, source: int, target: int) -> Link | None:
+        """Deletes the link between two attributes from the editor"""
+        link = self.links.find(source, target)
+        if link is None:
+            return None
 
-            if not found:
-                break
+        self.links.remove(link.id)
+        with suppress(SystemError):
+            dpg.delete_item(link.id)
+        with suppress(SystemError):
+            self.graph.disconnect(dpg.get_item_alias(dpg.get_item_info(source)["parent"]))
+        return link
+
+    def remove_node(self, node: int | str):
+        """Forgets the links of a node that is about to be deleted"""
+        for link in self.links.touching(dpg.get_item_info(node)["children"][1]):
+            self.links.remove(link.id)
+
+        alias = dpg.get_item_alias(node) or node
+        if alias in self.graph.nodes:
+            self.graph.remove_node(alias)
 
     def update_output(self, sender=None, app_data=None, history=True):
-        if sender and app_data:
+        # Unchecked boxes and sliders at 0 are settings too
+        if sender is not None and app_data is not None:
             try:
                 node = dpg.get_item_info(dpg.get_item_info(sender)["parent"])["parent"]
                 module = dpg.get_item_user_data(node)
@@ -119,56 +164,142 @@ class NodeEditor:
                     )
                 )
             module.settings[alias][sender] = app_data
-        try:
-            output = dpg.get_item_user_data(self.path[-1])
-        except IndexError:
-            dpg.delete_item("Output_attribute", children_only=True)
+            if alias in self.graph.nodes:
+                self.graph.set(alias, **module.params(alias))
+
+            if dpg.is_item_active(sender):
+                self._dragging, self._dragged = sender, time.monotonic()
+                self.submit(coarse=False, approximate=True)
+                return
+
+        self.submit()
+
+    def submit(self, coarse: bool = True, approximate: bool = False):
+        """Starts rendering the output, see `create_passes`"""
+        input_module = self.modules[0]
+        if not input_module.pyramid.ready.is_set():
+            # The input module updates the output again once its pyramid is built
             return
-        if output.name != "Output":
-            dpg.delete_item("Output_attribute", children_only=True)
+        if not self.path or self.path[-1] != OUTPUT:
+            self.renderer.cancel()
+            self.viewer.refresh(input_module.pyramid, input_module.cache_key, None)
+            dpg.get_item_user_data("Output").clear()
             return
 
-        image = dpg.get_item_user_data("Input").image
-        img_size = image.size
-        for node in self.path[1:-1]:
-            tag = dpg.get_item_alias(node)
-            node = dpg.get_item_user_data(node)
-            image = node.run(image, tag)
+        self.renderer.submit(self.create_passes(coarse, approximate))
+        self.viewer.refresh(input_module.pyramid, input_module.cache_key, self.graph.steps())
 
-        dpg.delete_item(output.image)
+    def settle(self):
+        """Renders the output exactly once the setting being dragged settles, must be called from the UI thread"""
+        if self._dragging is None:
+            return
         with suppress(SystemError):
-            dpg.remove_alias(output.image)
-
-        counter = output.image.split("_")[-1]
-        output.image = "output_" + str(int(counter) + 1)
-        output.pillow_image = image.copy()
-        image.thumbnail((450, 450), Image.LANCZOS)
-        with dpg.texture_registry():
-            dpg.add_static_texture(
-                image.width,
-                image.height,
-                np.frombuffer(image.tobytes(), dtype=np.uint8) / 255.0,
-                tag=output.image,
-            )
-        dpg.delete_item("Output_attribute", children_only=True)
-        dpg.add_image(output.image, parent="Output_attribute")
-        if output.pillow_image.size != img_size:
-            dpg.add_spacer(height=5, parent="Output_attribute")
-            dpg.add_text(
-                f"Image size: {output.pillow_image.width}x{output.pillow_image.height}", parent="Output_attribute"
-            )
+            if dpg.is_item_active(self._dragging) and time.monotonic() - self._dragged < self.settle_time:
+                return
+
+        # The approximation already shows the preview, so there's no need for a coarse pass
+        self._dragging = None
+        self.submit(coarse=False)
+
+    def create_passes(self, coarse: bool = True, approximate: bool = False) -> list[RenderJob]:
+        """Passes rendering the output from a coarse proxy, the preview proxy and, outside preview mode, the full image.
+        Passes that wouldn't run on a larger image than the one before them are left out
+        """
+        passes = []
+        for size in (self.proxy_size // self.coarse_factor, self.proxy_size, None):
+            if size is None and self.preview:
+                break
+            if size is not None and size < self.proxy_size and not coarse:
+                continue
+
+            job = self.create_job(size, approximate)
+            if passes and job.image.size == passes[-1].image.size:
+                continue
+            if passes:
+                previous = passes[-1].image
+                passes[-1] = passes[-1]._replace(
+                    stretch=(job.image.width / previous.width, job.image.height / previous.height)
+                )
+            passes.append(job)
+        return passes
+
+    def create_job(self, size: int | None, approximate: bool = False) -> RenderJob:
+        """Snapshots the steps of the graph.
+        With a `size` the job runs on a proxy of the input downscaled to fit in it and size dependent parameters
+        are scaled to it, otherwise it runs on the full image
+        """
+        input_module = self.modules[0]
+        image, scale = input_module.image, (1.0, 1.0)
+        if size is not None:
+            image, scale = input_module.get_proxy(size)
+
+        steps = self.graph.steps()
+        return RenderJob(
+            image,
+            (*input_module.cache_key, scale),
+            scale,
+            steps,
+            input_module.image.size,
+            self.engine.output_size(steps, input_module.image.size),
+            approximate=approximate,
+        )
+
+    def preview_source(self) -> tuple[Image.Image, tuple, tuple[float, float]]:
+        """The proxy, cache key and scale the preview passes of the output run with"""
+        image, scale = self.modules[0].get_proxy(self.proxy_size)
+        return image, (*self.modules[0].cache_key, scale), scale
+
+    def render_full(self) -> Image.Image | None:
+        """Renders the output at full resolution on the calling thread"""
+        if not self.path or self.path[-1] != OUTPUT:
+            return None
+
+        job = self.create_job(None)
+        return self.engine.run(job.image, job.steps, job.key)
+
+    def render(self, job: RenderJob, cancelled: callable) -> RenderResult:
+        image = self.engine.run(job.image, job.steps, job.key, job.scale, cancelled, job.approximate)
+
+        # Halving with `reduce` first means the thumbnail never resamples the full result, which is also left untouched
+        preview = fit(image, self.modules[0].thumbnail_size)
+        if job.stretch != (1.0, 1.0):
+            # Shown at the size the next pass will have, so the node doesn't jump when it arrives
+            size = (round(image.width * job.stretch[0]), round(image.height * job.stretch[1]))
+            size = fit_size(size, self.modules[0].thumbnail_size)
+            if preview.size != size:
+                preview = preview.resize(size, Image.BILINEAR)
+        return RenderResult(image, job.input_size, job.output_size, preview)
+
+    def present(self):
+        """Shows the latest finished render in the output node, the viewer and the node previews,
+        must be called from the UI thread
+        """
+        self.modules[0].present()
+        self.settle()
+        self.viewer.present()
+        if self.modules[0].pyramid.ready.is_set():
+            self.previews.present(self.graph.path()[1:], self.preview_source)
+        result = self.renderer.poll()
+        if result is None:
+            return
+
+        output = dpg.get_item_user_data("Output")
+        output.pillow_image = result.image
+        output.show(result.preview, result.output_size if result.output_size != result.input_size else None)
+
+    def toggle_preview(self, _sender=None, app_data=None):
+        self.preview = bool(app_data)
+        self.update_output()
 
     def link_callback(self, sender, app_data):
-        for link in self._node_links:
-            if link.source == app_data[0]:
-                try:
-                    dpg.delete_item(link.id)
-                except SystemError:
-                    continue
-                self._node_links.remove(link)
+        # An output can only have one link, the previous link is replaced
+        previous = self.links.from_source(app_data[0])
+        if previous is not None:
+            with suppress(SystemError):
+                dpg.delete_item(previous.id)
 
         link = dpg.add_node_link(app_data[0], app_data[1], parent=sender)
-        self._node_links.append(Link(source=app_data[0], target=app_data[1], id=int(link)))
+        self.add_link(app_data[0], app_data[1], link)
         history_manager.append(
             HistoryItem(
                 tag=str(link),
@@ -185,22 +316,22 @@ class NodeEditor:
         self.update_output()
 
     def delink_callback(self, _sender, app_data):
-        dpg.delete_item(app_data)
-        for link in self._node_links:
-            if link.id == app_data:
-                history_manager.append(
-                    HistoryItem(
-                        tag=str(app_data),
-                        action="link_delete",
-                        data={
-                            "source": link.source,
-                            "target": link.target,
-                            "id": link.id,
-                        },
-                    )
+        link = self.links.get(app_data)
+        if link is None:
+            dpg.delete_item(app_data)
+        else:
+            self.remove_link(link.source, link.target)
+            history_manager.append(
+                HistoryItem(
+                    tag=str(app_data),
+                    action="link_delete",
+                    data={
+                        "source": link.source,
+                        "target": link.target,
+                        "id": link.id,
+                    },
                 )
-                self._node_links.remove(link)
-                break
+            )
 
         self.update_path()
         self.update_output()
@@ -225,35 +356,15 @@ class NodeEditor:
                 )
             )
 
+            self.remove_node(node)
             dpg.delete_item(node)
-            for link in self._node_links:
-                if link.source in node_links or link.target in node_links:
-                    self._node_links.remove(link)
 
         self.update_path()
         self.update_output()
 
     def delete_links(self, _sender, _app_data):
         for link in dpg.get_selected_links(self._tag):
-            dpg.delete_item(link)
-            for link_ in self._node_links:
-                if link_.id == link:
-                    history_manager.append(
-                        HistoryItem(
-                            tag=str(link),
-                            action="link_delete",
-                            data={
-                                "source": link_.source,
-                                "target": link_.target,
-                                "id": link_.id,
-                            },
-                        )
-                    )
-                    self._node_links.remove(link_)
-                    break
-
-        self.update_path()
-        self.update_output()
+            self.delink_callback(None, link)
 
     def duplicate_nodes(self, _sender=None, _app_data=None):
         for node in dpg.get_selected_nodes(self._tag):
@@ -273,7 +384,8 @@ class NodeEditor:
             except AttributeError:
                 continue
 
-        self._node_links.clear()
+        self.links.clear()
+        self.graph = self.new_graph()
         history_manager.clear()
         self._project = None
 
@@ -296,7 +408,7 @@ class NodeEditor:
                     "settings": data_.settings if hasattr(data_, "settings") else {},
                 }
 
-        for link in self._node_links:
+        for link in self.links:
             source = dpg.get_item_user_data(dpg.get_item_info(link.source)["parent"])
             target = dpg.get_item_user_data(dpg.get_item_info(link.target)["parent"])
             data["links"].append(
@@ -378,15 +490,8 @@ class NodeEditor:
                 dpg.set_value(setting_tag, data["nodes"][node]["settings"][node][setting])
                 module.settings[tag][setting_tag] = data["nodes"][node]["settings"][node][setting]
 
-        try:
-            image = Image.open(data["image"])
-            image = image.convert("RGBA")
-            self.modules[0].image = image.copy()
-            self.modules[0].image_path = data["image"]
-            image.thumbnail((450, 450), Image.LANCZOS)
-            self.modules[0].viewer.load(image)
-        except FileNotFoundError:
-            pass
+        with suppress(FileNotFoundError):
+            self.modules[0].set_image(native(Image.open(data["image"])), data["image"])
 
         for link in data["links"]:
             source = None
@@ -406,7 +511,7 @@ class NodeEditor:
                 target,
                 parent=self._tag,
             )
-            self._node_links.append(Link(source=source, target=target, id=int(link)))
+            self.add_link(source, target, link)
 
         self._project = location
         self.update_path()
@@ -0,0 +1,7 @@
+from .cache import ResultCache, image_nbytes
+from .engine import Engine
+from .errors import EvaluationCancelled, GraphError
+from .graph import INPUT, OUTPUT, Graph, Link, Node
+from .operations import Operation, Parameter, operations
+from .project import load_project
+from .pyramid import Pyramid
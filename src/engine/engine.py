@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import math
+from collections import OrderedDict
+from collections.abc import Hashable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+from src.engine import tiling
+from src.engine.cache import ResultCache
+from src.engine.errors import EvaluationCancelled
+from src.engine.fusion import fuse_geometry, fuse_points
+from src.engine.modes import native
+from src.engine.operations import operations
+from src.engine.writers import open_writer
+
+if TYPE_CHECKING:
+    from src.engine.graph import Graph
+    from src.engine.operations import Operation
+
+
+class Engine:
+    """Runs the operations of a graph.
+    With a cache, each result is stored under its upstream key and its parameters,
+    so after an edit only the edited node and the nodes after it are recomputed.
+    Before running, the steps go through the optimization passes, which may fuse several operations into one
+    """
+
+    passes = (fuse_geometry, fuse_points, tiling.push_crops)
+    # Images with fewer pixels aren't worth splitting into strips
+    parallel_pixels = 1024 * 1024
+    # Steps measured for `region`, for this many inputs and versions of the steps, the least recently used are dropped
+    prepared_size = 8
+    # Outputs of the steps that can't be computed in regions, which `region` computes whole, for this many inputs,
+    # versions of the steps and zooms
+    whole_size = 2
+    # Operations work in place on the images the engine owns, turned off to compare the memory it saves
+    in_place = True
+
+    def __init__(self, cache: ResultCache | None = None, passes: tuple[callable, ...] | None = None, workers: int = 1):
+        """:param workers: Number of threads every operation is split across, in horizontal strips"""
+        self.cache = cache
+        if passes is not None:
+            self.passes = passes
+        elif cache is not None:
+            # The cached results before a crop are reused when the crop is edited, which pushing it down would undo
+            self.passes = tuple(optimization for optimization in self.passes if optimization is not tiling.push_crops)
+        self.workers = workers
+        self._executor = None
+        self._prepared: OrderedDict[Hashable, list[tuple[Operation, dict]]] = OrderedDict()
+        self._whole: OrderedDict[Hashable, tuple[Image.Image, list[tuple[Operation, dict]]]] = OrderedDict()
+
+    def apply(
+        self, operation: Operation, params: dict, image: Image.Image, approximate: bool = False, owned: bool = False
+    ) -> Image.Image:
+        """Runs a single operation, in parallel strips if there are workers for it and the image is large enough.
+        The image is converted first if the operation doesn't support its mode.
+        With `owned` nothing else holds the image, so operations that can work in place may modify it
+        when it isn't split into strips
+        """
+        converted = operation.conform(image, params)
+        owned = owned or converted is not image
+        image = converted
+        if approximate:
+            return operation.approximate(image, params)
+        if self.workers <= 1 or not operation.parallel or image.width * image.height < self.parallel_pixels:
+            if owned and self.in_place and operation.in_place:
+                return operation.run_in_place(image, params)
+            return operation.run(image, params)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="engine")
+        return tiling.run_strips(operation, params, image, self._executor, self.workers)
+
+    def evaluate(
+        self,
+        graph: Graph,
+        image: Image.Image,
+        key: Hashable = None,
+        scale: tuple[float, float] = (1.0, 1.0),
+        cancelled: callable = None,
+    ) -> Image.Image:
+        """:param graph: Graph with a path from the input node to the output node
+        :param image: Image of the input node
+        :param key: Identifies the input image in the cache, nothing is cached without it
+        :param scale: Scale of `image` relative to the image the parameters were set for
+        :param cancelled: Checked between nodes, the evaluation raises `EvaluationCancelled` once it returns True
+        """
+        return self.run(image, graph.steps(), key, scale, cancelled)
+
+    def run(
+        self,
+        image: Image.Image,
+        steps: list[tuple[Operation, dict]],
+        key: Hashable = None,
+        scale: tuple[float, float] = (1.0, 1.0),
+        cancelled: callable = None,
+        approximate: bool = False,
+    ) -> Image.Image:
+        """Runs the steps on `image`, see `evaluate`.
+        With `approximate` the operations run their cheaper version, unless the exact result is cached already.
+        `image` and the cached results are never modified, an operation only works in place on the output
+        of the previous one when it isn't cached. With a cache every result is cached, so only the first operation
+        may work in place, on the copy `image` is converted to
+        """
+        converted = native(image)
+        owned = converted is not image
+        image = converted
+        steps = self.optimize(steps, scale)
+        for operation, params in steps:
+            if cancelled and cancelled():
+                raise EvaluationCancelled
+
+            if self.cache is None or key is None:
+                result = self.apply(operation, params, image, approximate, owned)
+                # Operations that return their input unchanged don't hand over an image they don't own
+                owned = owned or result is not image
+                image = result
+                continue
+
+            key = (key, operation.name, tuple(params.items()))
+            result = self.cache.get(key)
+            if result is None and approximate:
+                # Approximations are cached apart, so they never stand in for an exact result
+                key = (key, "approximate")
+                result = self.cache.get(key)
+            if result is None:
+                result = self.apply(operation, params, image, approximate, owned)
+                self.cache.put(key, result)
+            image = result
+            # Cached results are shared with later runs
+            owned = False
+
+        return image
+
+    def optimize(
+        self, steps: list[tuple[Operation, dict]], scale: tuple[float, float] = (1.0, 1.0)
+    ) -> list[tuple[Operation, dict]]:
+        if scale != (1.0, 1.0):
+            steps = [(operation, operation.scale(params, scale)) for operation, params in steps]
+        for optimization in self.passes:
+            steps = optimization(steps)
+        return steps
+
+    def stream(
+        self, image: Image.Image, steps: list[tuple[Operation, dict]], budget: int = tiling.TILE_BUDGET
+    ) -> Iterator[Image.Image]:
+        """Evaluates the steps tile by tile and yields the output in strips of its full width, from top to bottom.
+        Apart from the input image, memory is bounded by `budget` bytes (plus the borders of the tiles)
+        instead of growing with the size of the image and the number of steps. Nothing is cached
+        """
+        yield from tiling.strips(image, self.optimize(self.prepare(image, steps, budget)), budget)
+
+    def prepare(
+        self, image: Image.Image, steps: list[tuple[Operation, dict]], budget: int = tiling.TILE_BUDGET
+    ) -> list[tuple[Operation, dict]]:
+        """Lets the operations that depend on the whole image measure their input, which is evaluated tile by tile.
+        The other steps are returned as they are, without evaluating anything
+        """
+        prepared = []
+        for operation, params in steps:
+            params = operation.prepare(params, tiling.tiles(image, self.optimize(prepared), budget))
+            prepared.append((operation, params))
+        return prepared
+
+    def region(
+        self,
+        image: Image.Image,
+        steps: list[tuple[Operation, dict]],
+        box: tuple[int, int, int, int],
+        zoom: float = 1.0,
+        key: Hashable = None,
+        scale: tuple[float, float] = (1.0, 1.0),
+    ) -> Image.Image:
+        """Computes only the region `box` of the output, of which the whole output is `zoom` times the size.
+        The region is mapped back through the steps, geometric ones through their reverse transform, and every step
+        only computes the part of its output the region needs. Operations that depend on the whole image measure it
+        first, with a `key` that's done once for the input and the steps.
+        `image` may be a proxy, with `scale` like in `evaluate`, `box` and `zoom` are then relative to its output
+        """
+        steps = [(operation, operation.scale(params, scale)) for operation, params in steps]
+        if key is not None:
+            key = (key, tuple((operation.name, tuple(params.items())) for operation, params in steps))
+        steps = self._remember(self._prepared, key, self.prepared_size, lambda: self.prepare(image, steps))
+
+        if zoom != 1.0:
+            # The zoom is a resize of the whole output, which the geometric steps at the end fuse with
+            resize = operations["Resize"]
+            width, height = self.output_size(steps, image.size)
+            size = max(round(width * zoom), 1), max(round(height * zoom), 1)
+            steps = [*steps, (resize, {**resize.defaults(), "width": size[0], "height": size[1]})]
+        # Steps whose regions differ from the same part of their whole output run on the whole image
+        whole, steps = self._remember(
+            self._whole, key and (key, zoom), self.whole_size, lambda: tiling.run_inexact(image, self.optimize(steps))
+        )
+        return tiling.render(whole, steps, box)
+
+    @staticmethod
+    def _remember(store: OrderedDict, key: Hashable, size: int, compute: callable):
+        """The value computed for `key`, the least recently used of the `size` values in `store` are dropped.
+        Without a key it's computed every time
+        """
+        if key is None:
+            return compute()
+        value = store.get(key)
+        if value is None:
+            value = store[key] = compute()
+            while len(store) > size:
+                store.popitem(last=False)
+        else:
+            store.move_to_end(key)
+        return value
+
+    def export(
+        self, image: Image.Image, steps: list[tuple[Operation, dict]], path: str, budget: int = tiling.TILE_BUDGET
+    ):
+        """Evaluates the steps tile by tile and writes the output to `path` as it goes, see `stream`"""
+        with open_writer(path, self.output_size(steps, image.size)) as writer:
+            for strip in self.stream(image, steps, budget):
+                writer.write(strip)
+
+    @staticmethod
+    def open(path: str, steps: list[tuple[Operation, dict]]) -> tuple[Image.Image, list[tuple[Operation, dict]]]:
+        """Opens the image at `path` to run `steps` on it. When the first step is a resize that reduces the image
+        beforehand anyway, JPEG images are decoded at the fraction of their size that keeps the reducing gap,
+        which the decoder does much faster. That step is then given the size of its output explicitly
+        """
+        image = Image.open(path)
+        if not steps or steps[0][0].name != "Resize":
+            return image, steps
+
+        operation, params = steps[0]
+        size = operation.output_size(params, image.size)
+        gap = operation.qualities[params["quality"]][1]
+        if gap is not None and image.format == "JPEG":
+            original = image.size
+            image.draft(None, (math.ceil(size[0] * gap), math.ceil(size[1] * gap)))
+            if image.size != original:
+                steps = [(operation, {**params, "width": size[0], "height": size[1], "percentage": 100}), *steps[1:]]
+        return image, steps
+
+    @staticmethod
+    def output_size(steps: list[tuple[Operation, dict]], size: tuple[int, int]) -> tuple[int, int]:
+        for operation, params in steps:
+            size = operation.output_size(params, size)
+        return size
@@ -0,0 +1,430 @@
+import math
+from collections.abc import Iterable
+from fractions import Fraction
+
+import numpy as np
+from PIL import Image
+
+from src.engine.modes import promote
+from src.engine.operations import Operation, operations
+from src.engine.operations.base import EPSILON, IDENTITY, Box, apply_lut, inside, scaling, translation
+from src.engine.operations.resize import reducing_factor, resize_box
+
+# Every transpose with the linear part of its reverse transform
+# and the translation of it for a source image of size (w, h)
+transposes = (
+    (None, ((1, 0), (0, 1)), lambda w, h: (0, 0)),
+    (Image.FLIP_LEFT_RIGHT, ((-1, 0), (0, 1)), lambda w, h: (w, 0)),
+    (Image.FLIP_TOP_BOTTOM, ((1, 0), (0, -1)), lambda w, h: (0, h)),
+    (Image.ROTATE_180, ((-1, 0), (0, -1)), lambda w, h: (w, h)),
+    (Image.ROTATE_90, ((0, -1), (1, 0)), lambda w, h: (w, 0)),
+    (Image.ROTATE_270, ((0, 1), (-1, 0)), lambda w, h: (0, h)),
+    (Image.TRANSPOSE, ((0, 1), (1, 0)), lambda w, h: (0, 0)),
+    (Image.TRANSVERSE, ((0, -1), (-1, 0)), lambda w, h: (w, h)),
+)
+
+
+def _corners(size: tuple[int, int]) -> np.ndarray:
+    return np.array(((0, size[0], size[0], 0), (0, 0, size[1], size[1]), (1, 1, 1, 1)), dtype=float)
+
+
+def _snap(values: np.ndarray) -> np.ndarray:
+    rounded = np.round(values)
+    return np.where(np.abs(values - rounded) < EPSILON, rounded, values)
+
+
+def _coverage(reverse: np.ndarray, size: tuple[int, int], bounds: tuple[int, int]) -> np.ndarray:
+    """Which output pixels have their centre inside an image of size `bounds`, given the reverse transform to it.
+    Each row of a convex region is a single span, so the spans are solved for instead of testing every pixel
+    """
+    rows = np.arange(size[1]) + 0.5
+    start = np.zeros(size[1])
+    end = np.full(size[1], float(size[0]))
+    for axis in (0, 1):
+        # Along a row the coordinate is `slope * x + offset`, it has to stay in [0, bounds)
+        slope = reverse[axis, 0]
+        offset = reverse[axis, 1] * rows + reverse[axis, 2] + slope * 0.5
+        if abs(slope) < EPSILON:
+            end = np.where((offset >= 0) & (offset < bounds[axis]), end, 0)
+            continue
+
+        low, high = _snap(-offset / slope), _snap((bounds[axis] - offset) / slope)
+        if slope > 0:
+            start = np.maximum(start, np.ceil(low))
+            end = np.minimum(end, np.ceil(high))
+        else:
+            start = np.maximum(start, np.floor(high) + 1)
+            end = np.minimum(end, np.floor(low) + 1)
+
+    columns = np.arange(size[0])
+    return (columns >= start[:, None]) & (columns < end[:, None])
+
+
+def _clip_mask(
+    matrix: np.ndarray, size: tuple[int, int], intermediates: list[tuple[np.ndarray, tuple[int, int]]]
+) -> Image.Image | None:
+    """Every intermediate image cuts off what falls outside of its bounds, which a single transform doesn't do.
+    Returns a mask of the output covered by all intermediate images, or None if they all cover the whole output
+    """
+    mask = None
+    for prefix, intermediate_size in intermediates:
+        # Maps output coordinates to coordinates in the intermediate image
+        reverse = np.linalg.inv(prefix) @ matrix
+        if inside(reverse, size, intermediate_size):
+            continue
+
+        coverage = _coverage(reverse, size, intermediate_size)
+        mask = coverage if mask is None else mask & coverage
+
+    return None if mask is None else Image.fromarray(mask.astype(np.uint8) * 255, "L")
+
+
+def _reduction(linear: np.ndarray) -> int:
+    return int(min(np.hypot(*linear[:, 0]), np.hypot(*linear[:, 1])))
+
+
+def _fixed(value: float) -> int:
+    return math.floor(value * 65536 + 0.5)
+
+
+def _region_matrix(matrix: np.ndarray, box: Box, origin: tuple[int, int]) -> np.ndarray:
+    """Reverse transform of the region `box` of the output, for the part of the input at `origin`.
+    Pillow's nearest neighbour affine transform steps through the output in 16.16 fixed point, so the rounding depends
+    on where it starts. The offset is put where the transform of the whole image would be at the start of the region,
+    which makes the region identical to the same part of the whole image
+    """
+    region = translation(-origin[0], -origin[1]) @ matrix @ translation(box[0], box[1])
+    for row, start in ((0, origin[0]), (1, origin[1])):
+        # The transform starts at the centre of the first pixel
+        centre = (matrix[row, 0] + matrix[row, 1]) / 2
+        offset = _fixed(matrix[row, 2] + centre) + _fixed(matrix[row, 0]) * box[0] + _fixed(matrix[row, 1]) * box[1]
+        region[row, 2] = (offset - start * 65536) / 65536 - centre
+    return region
+
+
+def _source_box(
+    matrix: np.ndarray, size: tuple[int, int], scale: np.ndarray, reverse: tuple, origin: callable
+) -> tuple[float, float, float, float]:
+    """The box the output of `size` of an axis aligned transform is resized from, before its transpose"""
+    width, height = (size[1], size[0]) if reverse[0][0] == 0 else size
+    left, top = matrix[:2, 2] - np.diag(scale) * origin(width, height)
+    return tuple(_snap(np.array((left, top, left + scale[0, 0] * width, top + scale[1, 1] * height))))
+
+
+def transform(
+    image: Image.Image,
+    matrix: np.ndarray,
+    size: tuple[int, int],
+    smooth: bool,
+    fast: bool = False,
+    gap: float | None = None,
+    affine: int = Image.BICUBIC,
+    whole: tuple[np.ndarray, tuple[int, int], Box] | None = None,
+) -> Image.Image:
+    """Applies a reverse affine transform with at most one resampling pass.
+    Transforms that keep the axes aligned become a crop, or a resize of a box when `smooth` is set,
+    followed by a lossless transpose. Other transforms are a single affine pass,
+    nearest neighbour like `Image.rotate` unless `smooth` is set, then they're filtered with `affine`.
+    `fast` filters bilinearly instead, and with a reducing `gap` downscales are reduced by powers of two
+    before they are resized. When the output is a region of a larger one and the image part of a larger input,
+    `whole` is the reverse transform and the size of that output and the box of that input relative to the image,
+    resizes pad the image as far as for that output
+    """
+    linear = matrix[:2, :2]
+    for method, reverse, origin in transposes:
+        # The inverse of a signed permutation is its transpose
+        scale = linear @ np.transpose(reverse)
+        if abs(scale[0, 1]) > EPSILON or abs(scale[1, 0]) > EPSILON or scale[0, 0] <= 0 or scale[1, 1] <= 0:
+            continue
+
+        width, height = (size[1], size[0]) if reverse[0][0] == 0 else size
+        box = _source_box(matrix, size, scale, reverse, origin)
+        if np.allclose(np.diag(scale), 1, atol=EPSILON) and box == tuple(np.round(box)):
+            region = image.crop(tuple(round(value) for value in box))
+        elif smooth:
+            factors = reducing_factor(scale[0, 0], gap), reducing_factor(scale[1, 1], gap)
+            resample = Image.BILINEAR if fast else Image.LANCZOS
+            limits = None
+            if whole is not None:
+                bounds, extent = _source_box(*whole[:2], scale, reverse, origin), whole[2]
+                limits = (
+                    min(math.floor(bounds[0]), extent[0]),
+                    min(math.floor(bounds[1]), extent[1]),
+                    max(math.ceil(bounds[2]), extent[2]),
+                    max(math.ceil(bounds[3]), extent[3]),
+                )
+            region = resize_box(image, (width, height), box, resample, factors, limits)
+        else:
+            break
+        return region if method is None else region.transpose(method)
+
+    if smooth:
+        # Affine transforms don't filter when downscaling, so whole factors are reduced beforehand
+        factor = _reduction(linear)
+        if factor >= 2:
+            image = image.reduce(factor)
+            matrix = scaling(1 / factor, 1 / factor) @ matrix
+
+    resample = (Image.BILINEAR if fast else affine) if smooth else Image.NEAREST
+    return image.transform(size, Image.AFFINE, tuple(matrix[:2].ravel()), resample)
+
+
+class Geometry(Operation):
+    """A run of geometric operations fused into a single transform"""
+
+    name = "Geometry"
+
+    @staticmethod
+    def compose(
+        steps: tuple, size: tuple[int, int]
+    ) -> tuple[np.ndarray, tuple[int, int], list[tuple[np.ndarray, tuple[int, int]]]]:
+        """Returns the reverse transform of the steps, the output size, and the reverse transforms and sizes
+        of the intermediate images
+        """
+        matrix = np.identity(3)
+        intermediates = []
+        for name, params in steps:
+            step, size = operations[name].matrix(dict(params), size)
+            matrix = matrix @ step
+            intermediates.append((matrix, size))
+        return matrix, size, intermediates[:-1]
+
+    @staticmethod
+    def smooth(steps: tuple) -> bool:
+        # Like the separate operations, resizing and rotations with a filter filter, everything else takes
+        # the nearest pixel
+        return any(
+            name == "Resize" or (name == "Rotate" and dict(params).get("resample", "Nearest") != "Nearest")
+            for name, params in steps
+        )
+
+    @staticmethod
+    def resampling(steps: tuple, fast: bool = False) -> dict:
+        """Arguments of `transform` for the best quality any of the steps asks for: whether to filter bilinearly,
+        the reducing gap of resizes and the filter of affine transforms
+        """
+        resize = operations["Resize"]
+        qualities = [dict(params).get("quality", "Best") for name, params in steps if name == "Resize"]
+        quality = "Fast" if fast else min(qualities, key=list(resize.qualities).index, default="Best")
+        resample, gap = resize.qualities[quality]
+
+        # Bicubic unless the rotations only ask for bilinear filtering
+        filters = {dict(params).get("resample", "Nearest") for name, params in steps if name == "Rotate"}
+        affine = Image.BILINEAR if filters == {"Bilinear"} else Image.BICUBIC
+        return {"fast": resample != Image.LANCZOS, "gap": gap, "affine": affine}
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return self.run_region(image, params, image.size, (0, 0, *self.output_size(params, image.size)), (0, 0))
+
+    def approximate(self, image: Image.Image, params: dict) -> Image.Image:
+        box = (0, 0, *self.output_size(params, image.size))
+        return self.run_region(image, params, image.size, box, (0, 0), fast=True)
+
+    def aligned(self, params: dict, box: Box, size: tuple[int, int]) -> Box:
+        """The region extended to start and end at multiples of the alignment, or at the edges, so it's exact.
+        Mirrored axes are resized from the other end, so they are aligned from there
+        """
+        alignment = self.alignment(params, size)
+        if alignment == (1, 1):
+            return box
+
+        matrix, output_size, _ = self.compose(params["steps"], size)
+        box = list(box)
+        for axis, step in enumerate(alignment):
+            start, end, length = box[axis], box[axis + 2], output_size[axis]
+            mirrored = matrix[:2, axis].sum() < 0
+            if mirrored:
+                start, end = length - end, length - start
+            start, end = start // step * step, min(-(-end // step) * step, length)
+            if mirrored:
+                start, end = length - end, length - start
+            box[axis], box[axis + 2] = start, end
+        return tuple(box)
+
+    def source_box(self, params: dict, box: Box, size: tuple[int, int]) -> Box:
+        box = self.aligned(params, box, size)
+        matrix = self.compose(params["steps"], size)[0] @ translation(box[0], box[1])
+        x, y, _ = matrix @ _corners((box[2] - box[0], box[3] - box[1]))
+        margin, factors = 1, (1, 1)
+        if self.smooth(params["steps"]):
+            # Covers the support of the resampling filters, and keeps the region aligned to the reduction
+            # of an affine transform or of a resize
+            linear = matrix[:2, :2]
+            margin = math.ceil(3 * max(np.hypot(*linear[:, 0]), np.hypot(*linear[:, 1]), 1)) + 2
+            gap = self.resampling(params["steps"])["gap"]
+            factors = [
+                math.lcm(max(_reduction(linear), 1), reducing_factor(np.abs(linear[axis]).max(), gap))
+                for axis in (0, 1)
+            ]
+
+        left, top = math.floor(x.min()) - margin, math.floor(y.min()) - margin
+        right, bottom = math.ceil(x.max()) + margin, math.ceil(y.max()) + margin
+        return (
+            left // factors[0] * factors[0],
+            top // factors[1] * factors[1],
+            -(-right // factors[0]) * factors[0],
+            -(-bottom // factors[1]) * factors[1],
+        )
+
+    def alignment(self, params: dict, size: tuple[int, int]) -> tuple[int, int]:
+        return self._alignment(params, size)[0]
+
+    def exact(self, params: dict, size: tuple[int, int]) -> bool:
+        return self._alignment(params, size)[1]
+
+    def _alignment(self, params: dict, size: tuple[int, int]) -> tuple[tuple[int, int], bool]:
+        """The alignment, and whether aligned regions are exact.
+        Pillow takes the box of a resize in float32, so a region is only exact if it starts at a whole input pixel.
+        A filtered affine transform computes the coordinates of every pixel from the offset of the region,
+        which can round differently for different offsets
+        """
+        matrix = self.compose(params["steps"], size)[0]
+        if not self.smooth(params["steps"]):
+            return (1, 1), True
+        if np.count_nonzero(np.abs(matrix[:2, :2]) > EPSILON) != 2:
+            return (1, 1), False
+        if not np.allclose(matrix[:2, 2], np.round(matrix[:2, 2]), atol=EPSILON):
+            return (1, 1), False
+
+        alignment = []
+        for column in (0, 1):
+            scale = np.abs(matrix[:2, column]).max()
+            fraction = Fraction(scale).limit_denominator(1 << 16)
+            alignment.append(fraction.denominator if abs(fraction - scale) < EPSILON else None)
+        return tuple(step or 1 for step in alignment), None not in alignment
+
+    def run_region(
+        self,
+        image: Image.Image,
+        params: dict,
+        size: tuple[int, int],
+        box: Box,
+        origin: tuple[int, int],
+        fast: bool = False,
+    ) -> Image.Image:
+        aligned = self.aligned(params, box, size)
+        if aligned != box:
+            result = self.run_region(image, params, size, aligned, origin, fast)
+            left, top = box[0] - aligned[0], box[1] - aligned[1]
+            return result.crop((left, top, left + box[2] - box[0], top + box[3] - box[1]))
+
+        matrix, _, intermediates = self.compose(params["steps"], size)
+        smooth = self.smooth(params["steps"])
+        box_size = box[2] - box[0], box[3] - box[1]
+        if not image.width or not image.height:
+            # Nothing of the input ends up in this region
+            result = Image.new(image.mode, box_size)
+        elif smooth:
+            region = translation(-origin[0], -origin[1]) @ matrix @ translation(*box[:2])
+            extent = (-origin[0], -origin[1], size[0] - origin[0], size[1] - origin[1])
+            whole = translation(-origin[0], -origin[1]) @ matrix, self.output_size(params, size), extent
+            result = transform(image, region, box_size, True, whole=whole, **self.resampling(params["steps"], fast))
+        else:
+            result = transform(image, _region_matrix(matrix, box, origin), box_size, False)
+
+        mask = _clip_mask(matrix @ translation(*box[:2]), box_size, intermediates)
+        if mask is not None:
+            result = Image.composite(result, Image.new(result.mode, result.size), mask)
+        return result
+
+    def output_size(self, params: dict, size: tuple[int, int]) -> tuple[int, int]:
+        return self.compose(params["steps"], size)[1]
+
+    def input_mode(self, params: dict, mode: str, size: tuple[int, int]) -> str:
+        matrix, output_size, intermediates = self.compose(params["steps"], size)
+        reverses = [matrix] + [np.linalg.inv(prefix) @ matrix for prefix, _ in intermediates]
+        bounds = [size] + [intermediate_size for _, intermediate_size in intermediates]
+        if all(inside(reverse, output_size, bound) for reverse, bound in zip(reverses, bounds, strict=True)):
+            return promote(mode, self.modes)
+        # What falls outside of the input is left transparent
+        return "RGBA"
+
+
+class Tone(Operation):
+    """A run of point operations fused into a single lookup table"""
+
+    name = "Tone"
+    in_place = True
+
+    def prepare(self, params: dict, tiles: Iterable[Image.Image]) -> dict:
+        """Measures the mean of every Contrast step without one, like `Contrast.prepare` on the output of the steps
+        before it, so the run gives the same result as its nodes one after the other
+        """
+        if all(name != "Contrast" or dict(step).get("mean") is not None for name, step in params["steps"]):
+            return params
+
+        # Tiled evaluation prepares the steps before they're fused, the tiles are the whole image here
+        tiles = list(tiles)
+        steps = []
+        color = IDENTITY
+        for name, step in params["steps"]:
+            step = dict(step)
+            if name == "Contrast" and step.get("mean") is None:
+                if not np.array_equal(color, IDENTITY):
+                    # The grey conversion rounds every pixel, it's measured on the colours the steps before give
+                    tiles = [apply_lut(tile, color, IDENTITY) for tile in tiles]
+                    color = IDENTITY
+                step = operations[name].prepare(step, tiles)
+            color = operations[name].lut(step)[0][color]
+            steps.append((name, tuple(step.items())))
+        return {**params, "steps": tuple(steps)}
+
+    def local(self, params: dict) -> bool:
+        return all(operations[name].local(dict(step)) for name, step in params["steps"])
+
+    def input_mode(self, params: dict, mode: str, size: tuple[int, int]) -> str:
+        for name, step in params["steps"]:
+            mode = operations[name].input_mode(dict(step), mode, size)
+        return mode
+
+    def luts(self, image: Image.Image, params: dict) -> tuple[np.ndarray, np.ndarray]:
+        color = alpha = IDENTITY
+        for name, step in self.prepare(params, [image])["steps"]:
+            step_color, step_alpha = operations[name].lut(dict(step))
+            color, alpha = step_color[color], step_alpha[alpha]
+        return color, alpha
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return apply_lut(image, *self.luts(image, params))
+
+    def run_in_place(self, image: Image.Image, params: dict) -> Image.Image:
+        color, alpha = self.luts(image, params)
+        if not np.array_equal(color, IDENTITY) or "A" not in image.getbands():
+            return apply_lut(image, color, alpha)
+        # Runs of Opacity nodes only change the alpha band
+        image.putalpha(image.getchannel("A").point(alpha.tolist()))
+        return image
+
+
+geometry = Geometry()
+tone = Tone()
+
+
+def _fuse(steps: list[tuple[Operation, dict]], fusable: callable, fused: Operation) -> list[tuple[Operation, dict]]:
+    """Replaces runs of operations for which `fusable` is true with a single `fused` step"""
+    result = []
+    run = []
+    for operation, params in [*steps, (None, None)]:
+        if operation is not None and fusable(operation):
+            run.append((operation.name, tuple(params.items())))
+            continue
+
+        if len(run) > 1:
+            result.append((fused, {"steps": tuple(run)}))
+        else:
+            result.extend((operations[name], dict(params)) for name, params in run)
+        run = []
+        if operation is not None:
+            result.append((operation, params))
+
+    return result
+
+
+def fuse_geometry(steps: list[tuple[Operation, dict]]) -> list[tuple[Operation, dict]]:
+    """Replaces runs of geometric operations with a single `Geometry` step"""
+    return _fuse(steps, lambda operation: operation.geometric, geometry)
+
+
+def fuse_points(steps: list[tuple[Operation, dict]]) -> list[tuple[Operation, dict]]:
+    """Replaces runs of point operations with a single `Tone` step"""
+    return _fuse(steps, lambda operation: operation.point, tone)
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+
+from PIL import Image
+
+from src.engine.engine import Engine
+from src.engine.errors import GraphError
+from src.engine.operations import Operation, operations
+
+INPUT = "Input"
+OUTPUT = "Output"
+
+
+class Link(NamedTuple):
+    source: str
+    target: str
+
+
+class Node:
+    __slots__ = ("id", "kind", "params")
+
+    def __init__(self, node_id: str, kind: str, params: dict):
+        self.id = node_id
+        self.kind = kind
+        self.params = params
+
+    @property
+    def operation(self) -> Operation | None:
+        return operations.get(self.kind)
+
+    def __repr__(self):
+        return f"Node({self.id!r}, {self.kind!r}, {self.params!r})"
+
+
+class Graph:
+    """A node graph that can be evaluated without the editor.
+    Every node has at most one outgoing link, the image flows from the input node through the links to the output node.
+    Links are indexed both ways and the path from the input node is kept up to date as links change,
+    so an edit only walks the part of the path after the edited node
+    """
+
+    def __init__(self):
+        self.nodes: dict[str, Node] = {}
+        self._links: dict[str, str] = {}
+        self._sources: dict[str, set[str]] = {}
+        self._path: list[str] = []
+        self._positions: dict[str, int] = {}
+        self._counter = 0
+
+    def add_node(self, kind: str, node_id: str | None = None, **params) -> Node:
+        if kind in (INPUT, OUTPUT):
+            if params:
+                raise GraphError(f"{kind} has no parameters")
+            node_id = node_id or kind
+            params = {}
+        else:
+            operation = operations.get(kind)
+            if operation is None:
+                raise GraphError(f"Unknown operation: {kind!r}")
+            params = {**operation.defaults(), **operation.validate(params)}
+
+        if node_id is None:
+            node_id = f"{kind.lower()}_{self._counter}"
+            self._counter += 1
+        if node_id in self.nodes:
+            raise GraphError(f"Node {node_id!r} already exists")
+
+        node = self.nodes[node_id] = Node(node_id, kind, params)
+        if node_id == INPUT:
+            self._repath(INPUT)
+        return node
+
+    def remove_node(self, node_id: str):
+        self.disconnect(node_id)
+        for source in list(self._sources.get(node_id, ())):
+            self.disconnect(source)
+        self.nodes.pop(node_id)
+        self._sources.pop(node_id, None)
+        if node_id == INPUT:
+            self._path.clear()
+            self._positions.clear()
+
+    def set(self, node_id: str, **params):
+        node = self.nodes[node_id]
+        if node.operation is None:
+            raise GraphError(f"{node.kind} has no parameters")
+        node.params.update(node.operation.validate(params))
+
+    def connect(self, source: str | Node, target: str | Node):
+        """Links the output of `source` to the input of `target`, replacing the previous link of `source`"""
+        source = getattr(source, "id", source)
+        target = getattr(target, "id", target)
+        if source not in self.nodes or target not in self.nodes:
+            raise GraphError(f"Can't link unknown nodes {source!r} and {target!r}")
+        if source == target:
+            raise GraphError("Can't link a node to itself")
+        self.disconnect(source)
+        self._links[source] = target
+        self._sources.setdefault(target, set()).add(source)
+        self._repath(source)
+
+    def disconnect(self, source: str | Node):
+        source = getattr(source, "id", source)
+        target = self._links.pop(source, None)
+        if target is not None:
+            self._sources[target].discard(source)
+            self._repath(source)
+
+    def sources(self, node_id: str) -> set[str]:
+        """Nodes linked to `node_id`"""
+        return set(self._sources.get(node_id, ()))
+
+    def _repath(self, node_id: str):
+        """Follows the links again from `node_id`, if the path goes through it"""
+        if node_id == INPUT and not self._path:
+            self._path.append(INPUT)
+            self._positions[INPUT] = 0
+
+        position = self._positions.get(node_id)
+        if position is None:
+            return
+
+        for removed in self._path[position + 1 :]:
+            del self._positions[removed]
+        del self._path[position + 1 :]
+        while (target := self._links.get(self._path[-1])) is not None and target not in self._positions:
+            self._positions[target] = len(self._path)
+            self._path.append(target)
+
+    @property
+    def links(self) -> list[Link]:
+        return [Link(source, target) for source, target in self._links.items()]
+
+    def path(self) -> list[Node]:
+        """Nodes reachable from the input node by following the links, including the input node"""
+        return [self.nodes[node_id] for node_id in self._path]
+
+    def steps(self) -> list[tuple[Operation, dict]]:
+        """Operations between the input and the output, with a copy of their parameters"""
+        path = self.path()
+        if not path or path[-1].kind != OUTPUT:
+            raise GraphError("The input is not connected to the output")
+        return [(node.operation, dict(node.params)) for node in path[1:-1]]
+
+    def evaluate(self, image: Image.Image) -> Image.Image:
+        return Engine().evaluate(self, image)
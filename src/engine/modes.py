@@ -0,0 +1,29 @@
+"""Image modes the engine works in.
+Images keep the mode they are opened in through the chain, and are only converted before an operation that doesn't
+support their mode
+"""
+
+from PIL import Image
+
+MODES = ("L", "RGB", "RGBA")
+# Modes an image can be converted to without losing anything, closest first
+PROMOTIONS = {"L": ("L", "RGB", "RGBA"), "RGB": ("RGB", "RGBA"), "RGBA": ("RGBA",)}
+
+
+def native(image: Image.Image) -> Image.Image:
+    """Converts an opened image to the smallest of `MODES` that keeps what it shows"""
+    if image.mode in MODES:
+        return image
+    if "A" in image.getbands() or "a" in image.getbands() or "transparency" in image.info:
+        return image.convert("RGBA")
+    if image.mode in ("1", "I", "F") or image.mode.startswith("I;"):
+        return image.convert("L")
+    return image.convert("RGB")
+
+
+def promote(mode: str, modes: tuple[str, ...]) -> str:
+    """The closest mode to `mode` out of `modes`"""
+    for promoted in PROMOTIONS.get(mode, ()):
+        if promoted in modes:
+            return promoted
+    return "RGBA"
@@ -0,0 +1,25 @@
+from .base import Operation, Parameter
+from .blur import Blur
+from .brightness import Brightness
+from .contrast import Contrast
+from .crop import Crop
+from .flip import Flip
+from .opacity import Opacity
+from .resize import Resize
+from .rotate import Rotate
+from .sharpness import Sharpness
+
+operations: dict[str, Operation] = {
+    operation.name: operation
+    for operation in (
+        Resize(),
+        Rotate(),
+        Blur(),
+        Brightness(),
+        Contrast(),
+        Sharpness(),
+        Opacity(),
+        Crop(),
+        Flip(),
+    )
+}
@@ -0,0 +1,225 @@
+import math
+from collections.abc import Iterable
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from src.engine.errors import GraphError
+from src.engine.modes import MODES, promote
+
+Box = tuple[int, int, int, int]
+
+EPSILON = 1e-6
+
+
+class Parameter(NamedTuple):
+    name: str
+    type: type
+    default: object = None
+    min: float | None = None
+    max: float | None = None
+    choices: tuple | None = None
+    # Prefix of the setting in project files, the editor appends the node counter to it
+    key: str | None = None
+
+    def validate(self, value):
+        if value is None and self.default is None:
+            return None
+
+        try:
+            value = self.type(value)
+        except (TypeError, ValueError):
+            raise GraphError(f"Invalid value for {self.name}: {value!r}")
+        if self.choices and value not in self.choices:
+            raise GraphError(f"Invalid value for {self.name}: {value!r}, expected one of {self.choices}")
+        if self.min is not None:
+            value = max(value, self.min)
+        if self.max is not None:
+            value = min(value, self.max)
+        return value
+
+
+class Operation:
+    """Pure image processing part of a node, works on plain parameters and never touches the GUI"""
+
+    name: str = None
+    parameters: tuple[Parameter, ...] = ()
+    # Geometric operations only move pixels around and describe themselves with `matrix`, so runs of them can be fused
+    geometric = False
+    # Point operations map every value of a band on its own and describe themselves with `lut`, so runs of them can be
+    # fused into a single lookup table
+    point = False
+    # Operations that only copy memory around aren't worth splitting across threads
+    parallel = True
+    # Modes the operation runs in, images in other modes are converted to the closest of them first
+    modes: tuple[str, ...] = MODES
+    # Operations that can write their result into their input implement `run_in_place`, the engine calls it
+    # instead of `run` when nothing else holds the input
+    in_place = False
+    # Size of the strips `run_rows` works in
+    strip_pixels = 1024 * 1024
+
+    def defaults(self) -> dict:
+        return {parameter.name: parameter.default for parameter in self.parameters}
+
+    def validate(self, params: dict) -> dict:
+        names = {parameter.name: parameter for parameter in self.parameters}
+        for name in params:
+            if name not in names:
+                raise GraphError(f"{self.name} has no parameter {name!r}")
+        return {name: parameter.validate(params[name]) for name, parameter in names.items() if name in params}
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        """Returns the output as a new image, the input may be cached or shown and is never modified"""
+        raise NotImplementedError
+
+    def run_in_place(self, image: Image.Image, params: dict) -> Image.Image:
+        """Like `run`, but the input belongs to the operation, which may modify it and return it as the output"""
+        return self.run(image, params)
+
+    def input_mode(self, params: dict, mode: str, size: tuple[int, int]) -> str:
+        """Mode an image in `mode` of `size` is converted to before the operation runs on it"""
+        if self.geometric and not self.covers(params, size):
+            # What falls outside of the input is left transparent
+            return "RGBA"
+        return promote(mode, self.modes)
+
+    def conform(self, image: Image.Image, params: dict, size: tuple[int, int] | None = None) -> Image.Image:
+        """Converts the image if the operation doesn't run in its mode, `size` is the size of the whole input"""
+        mode = self.input_mode(params, image.mode, size or image.size)
+        return image if image.mode == mode else image.convert(mode)
+
+    def approximate(self, image: Image.Image, params: dict) -> Image.Image:
+        """A cheaper version of `run` that looks about the same, used while a setting is being dragged"""
+        return self.run(image, params)
+
+    def scale(self, params: dict, scale: tuple[float, float]) -> dict:
+        """Adapts size dependent parameters to an image scaled by `scale` (x, y)"""
+        return params
+
+    def output_size(self, params: dict, size: tuple[int, int]) -> tuple[int, int]:
+        return size
+
+    def matrix(self, params: dict, size: tuple[int, int]) -> tuple[np.ndarray, tuple[int, int]]:
+        """The reverse affine transform of a geometric operation, mapping output coordinates to input coordinates,
+        and the output size
+        """
+        raise NotImplementedError
+
+    def covers(self, params: dict, size: tuple[int, int]) -> bool:
+        """Whether every pixel of the output of a geometric operation comes from an input of `size`"""
+        matrix, output_size = self.matrix(params, size)
+        return inside(matrix, output_size, size)
+
+    def local(self, params: dict) -> bool:
+        """Whether a region of the output only needs the region of the input `source_box` gives,
+        operations that `prepare` by measuring the whole image first aren't
+        """
+        return True
+
+    def halo(self, params: dict) -> int:
+        """Border of input pixels needed around a region to compute that region of the output,
+        for operations that look at the neighbours of a pixel
+        """
+        return 0
+
+    def source_box(self, params: dict, box: Box, size: tuple[int, int]) -> Box:
+        """Region of an input of `size` needed to compute the region `box` of the output, it may exceed the input"""
+        halo = self.halo(params)
+        return box[0] - halo, box[1] - halo, box[2] + halo, box[3] + halo
+
+    def run_region(
+        self, image: Image.Image, params: dict, size: tuple[int, int], box: Box, origin: tuple[int, int]
+    ) -> Image.Image:
+        """Computes the region `box` of the output from `image`, which is the part of an input of `size` at `origin`"""
+        left, top = box[0] - origin[0], box[1] - origin[1]
+        return self.run(image, params).crop((left, top, left + box[2] - box[0], top + box[3] - box[1]))
+
+    def run_rows(self, image: Image.Image, params: dict) -> Image.Image:
+        """Runs an operation that keeps the size and mode of the image in the image itself, in strips of about
+        `strip_pixels`. A strip is read with its halo before the strip above it is written back, so every strip
+        sees the input it would have seen in the whole image
+        """
+        halo = self.halo(params)
+        rows = max(self.strip_pixels // image.width, halo, 1)
+        pending = None
+        for top in range(0, image.height, rows):
+            box = (0, top, image.width, min(top + rows, image.height))
+            source = (0, max(top - halo, 0), image.width, min(box[3] + halo, image.height))
+            region = image.crop(source)
+            if pending is not None:
+                image.paste(*pending)
+            pending = self.run_region(region, params, image.size, box, source[:2]), box[:2]
+        if pending is not None:
+            image.paste(*pending)
+        return image
+
+    def alignment(self, params: dict, size: tuple[int, int]) -> tuple[int, int]:
+        """Regions of the output starting at multiples of this are exactly like the same part of the whole output"""
+        return 1, 1
+
+    def exact(self, params: dict, size: tuple[int, int]) -> bool:
+        """Whether regions of the output that respect the alignment are exactly like the same part of the whole output,
+        otherwise only the whole output is exactly that
+        """
+        return True
+
+    def prepare(self, params: dict, tiles: Iterable[Image.Image]) -> dict:
+        """Measures what an operation needs to know about the whole image before it can run on a part of it.
+        Tiled evaluation passes the input of the operation as `tiles` and runs every tile with the returned parameters
+        """
+        return params
+
+    def lut(self, params: dict) -> tuple[np.ndarray, np.ndarray]:
+        """Lookup tables of a point operation for the colour bands and the alpha band"""
+        raise NotImplementedError
+
+
+IDENTITY = np.arange(256, dtype=np.uint8)
+
+
+def blend_lut(degenerate: float, factor: float) -> np.ndarray:
+    """Lookup table of `Image.blend` between a flat image and the image, with the same float32 arithmetic,
+    which is what `ImageEnhance` does
+    """
+    values = np.float32(degenerate) + np.float32(factor) * (IDENTITY.astype(np.float32) - np.float32(degenerate))
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def apply_lut(image: Image.Image, color: np.ndarray, alpha: np.ndarray) -> Image.Image:
+    """Maps the colour bands through `color` and the alpha band through `alpha`, in a single `point`.
+    An image without an alpha band is opaque, it only gets one filled with `alpha[255]` when that isn't opaque
+    """
+    if "A" not in image.getbands() and alpha[255] != 255:
+        image = image if np.array_equal(color, IDENTITY) else apply_lut(image, color, IDENTITY)
+        image = image.convert("RGBA")
+        image.putalpha(int(alpha[255]))
+        return image
+    return image.point(np.concatenate([alpha if band == "A" else color for band in image.getbands()]).tolist())
+
+
+def inside(reverse: np.ndarray, size: tuple[int, int], bounds: tuple[int, int]) -> bool:
+    """Whether an output of `size` lies within an image of size `bounds`, given the reverse transform to it"""
+    corners = np.array(((0, size[0], size[0], 0), (0, 0, size[1], size[1]), (1, 1, 1, 1)), dtype=float)
+    x, y, _ = reverse @ corners
+    return x.min() > -EPSILON and y.min() > -EPSILON and x.max() < bounds[0] + EPSILON and y.max() < bounds[1] + EPSILON
+
+
+def translation(x: float, y: float) -> np.ndarray:
+    return np.array(((1.0, 0.0, x), (0.0, 1.0, y), (0.0, 0.0, 1.0)))
+
+
+def scaling(x: float, y: float) -> np.ndarray:
+    return np.array(((x, 0.0, 0.0), (0.0, y, 0.0), (0.0, 0.0, 1.0)))
+
+
+def rotation(degrees: float, center: tuple[float, float]) -> np.ndarray:
+    # Same rounding as `Image.rotate`, so quarter turns stay exact
+    angle = -math.radians(degrees)
+    cos, sin = round(math.cos(angle), 15), round(math.sin(angle), 15)
+    return (
+        translation(*center)
+        @ np.array(((cos, sin, 0.0), (-sin, cos, 0.0), (0.0, 0.0, 1.0)))
+        @ translation(-center[0], -center[1])
+    )
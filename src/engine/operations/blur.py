@@ -0,0 +1,103 @@
+import math
+
+from PIL import Image, ImageFilter
+
+from .base import Box, Operation, Parameter
+
+
+class Blur(Operation):
+    name = "Blur"
+    parameters = (
+        Parameter("mode", str, "Gaussian", choices=("Gaussian", "Box"), key="blur_mode"),
+        Parameter("percentage", int, 1, 1, 500, key="blur_percentage"),
+    )
+
+    # Pillow blurs with running sums, so the cost doesn't grow with the radius, but a Gaussian blur is three passes.
+    # Wide Gaussian blurs of large images run on a downsampled image instead and are upsampled again,
+    # the detail that's lost is what the blur removes anyway
+    downsample_pixels = 1024 * 1024
+    # Radius the blur still has at the downsampled resolution, at least
+    downsample_radius = 1.5
+    # Downsampling and upsampling again costs about as much as two of the three passes, so it only pays off from here
+    downsample_factor = 4
+    # Pillow blurs into a temporary image and then into the output, in place only strips of them are needed.
+    # Strips are made tall enough that blurring their borders twice costs little
+    in_place = True
+    strip_pixels = 4 * 1024 * 1024
+
+    @staticmethod
+    def radius(params: dict) -> float:
+        return params["percentage"] / (50 if params["mode"] == "Box" else 65)
+
+    @staticmethod
+    def filter(mode: str, radius: float) -> ImageFilter.Filter:
+        return ImageFilter.BoxBlur(radius) if mode == "Box" else ImageFilter.GaussianBlur(radius)
+
+    @staticmethod
+    def border(mode: str, radius: float) -> int:
+        # Pillow's Gaussian blur is three box blur passes
+        return int(radius) + 1 if mode == "Box" else 3 * (int(radius) + 1)
+
+    def factor(self, params: dict, size: tuple[int, int]) -> int:
+        """Power of two an input of `size` is downsampled by before it's blurred, 1 blurs it exactly"""
+        factor = 1
+        if params["mode"] == "Box" or size[0] * size[1] < self.downsample_pixels:
+            return factor
+        while self.radius(params) / (factor * 2) >= self.downsample_radius:
+            factor *= 2
+        return factor if factor >= self.downsample_factor else 1
+
+    def blur(self, image: Image.Image, params: dict, factor: int) -> Image.Image:
+        """Blurs the image exactly, or on an image downsampled by `factor` which has to start on a whole block"""
+        if factor == 1:
+            return image.filter(self.filter(params["mode"], self.radius(params)))
+
+        small = image.reduce(factor).filter(self.filter(params["mode"], self.radius(params) / factor))
+        # The box keeps the scale at exactly `factor` when the size isn't a multiple of it, so every region
+        # is upsampled like the same part of the whole image. Resizing the bands one by one skips the conversion
+        # to premultiplied alpha, which the blur doesn't use either
+        box = (0, 0, image.width / factor, image.height / factor)
+        return Image.merge(image.mode, [band.resize(image.size, Image.BILINEAR, box=box) for band in small.split()])
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return self.blur(image, params, self.factor(params, image.size))
+
+    def run_in_place(self, image: Image.Image, params: dict) -> Image.Image:
+        if self.factor(params, image.size) > 1:
+            return self.run(image, params)
+        return self.run_rows(image, params)
+
+    def approximate(self, image: Image.Image, params: dict) -> Image.Image:
+        if params["mode"] == "Box" or self.factor(params, image.size) > 1:
+            return self.run(image, params)
+
+        # A single box blur with the same variance instead of three
+        sigma = self.radius(params)
+        return image.filter(ImageFilter.BoxBlur(radius=(math.sqrt(12 * sigma * sigma + 1) - 1) / 2))
+
+    def halo(self, params: dict) -> int:
+        return self.border(params["mode"], self.radius(params))
+
+    def source_box(self, params: dict, box: Box, size: tuple[int, int]) -> Box:
+        factor = self.factor(params, size)
+        if factor == 1:
+            return super().source_box(params, box, size)
+
+        # Whole blocks covering the border of the downsampled blur and the upsampling around the region
+        halo = factor * (self.border(params["mode"], self.radius(params) / factor) + 2)
+        return (
+            (box[0] - halo) // factor * factor,
+            (box[1] - halo) // factor * factor,
+            -(-(box[2] + halo) // factor) * factor,
+            -(-(box[3] + halo) // factor) * factor,
+        )
+
+    def run_region(
+        self, image: Image.Image, params: dict, size: tuple[int, int], box: Box, origin: tuple[int, int]
+    ) -> Image.Image:
+        left, top = box[0] - origin[0], box[1] - origin[1]
+        result = self.blur(image, params, self.factor(params, size))
+        return result.crop((left, top, left + box[2] - box[0], top + box[3] - box[1]))
+
+    def scale(self, params: dict, scale: tuple[float, float]) -> dict:
+        return {**params, "percentage": params["percentage"] * (scale[0] + scale[1]) / 2}
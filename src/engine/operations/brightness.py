@@ -0,0 +1,17 @@
+import numpy as np
+from PIL import Image
+
+from .base import IDENTITY, Operation, Parameter, apply_lut, blend_lut
+
+
+class Brightness(Operation):
+    name = "Brightness"
+    point = True
+    parameters = (Parameter("percentage", int, 1, 1, 100, key="brightness_percentage"),)
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        # Same result as `ImageEnhance.Brightness`, without the black image it blends with
+        return apply_lut(image, *self.lut(params))
+
+    def lut(self, params: dict) -> tuple[np.ndarray, np.ndarray]:
+        return blend_lut(0, params["percentage"] / 25), IDENTITY
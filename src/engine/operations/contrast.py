@@ -0,0 +1,35 @@
+from collections.abc import Iterable
+
+import numpy as np
+from PIL import Image
+
+from .base import IDENTITY, Operation, Parameter, apply_lut, blend_lut
+
+
+class Contrast(Operation):
+    name = "Contrast"
+    point = True
+    parameters = (Parameter("percentage", int, 1, 1, 100, key="contrast_percentage"),)
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        # Same result as `ImageEnhance.Contrast`, without the grey image it blends with
+        return apply_lut(image, *self.lut(self.prepare(params, [image])))
+
+    def prepare(self, params: dict, tiles: Iterable[Image.Image]) -> dict:
+        # The contrast pivots around the mean grey level of the whole image, which is a sum over all pixels
+        if params.get("mean") is not None:
+            return params
+
+        total = count = 0
+        for tile in tiles:
+            histogram = tile.convert("L").histogram()
+            total += np.dot(histogram, IDENTITY)
+            count += sum(histogram)
+        return {**params, "mean": int(total / max(count, 1) + 0.5)}
+
+    def local(self, params: dict) -> bool:
+        return params.get("mean") is not None
+
+    def lut(self, params: dict) -> tuple[np.ndarray, np.ndarray]:
+        # Needs the mean grey level of the image, which `prepare` measures
+        return blend_lut(params["mean"], params["percentage"] / 25), IDENTITY
@@ -0,0 +1,41 @@
+import numpy as np
+from PIL import Image
+
+from .base import Operation, Parameter, translation
+
+
+class Crop(Operation):
+    name = "Crop"
+    geometric = True
+    parallel = False
+    parameters = (
+        Parameter("left", int, 0, 0, key="left"),
+        Parameter("top", int, 0, 0, key="top"),
+        # None crops to the right and bottom edges of the image
+        Parameter("right", int, None, 1, key="right"),
+        Parameter("bottom", int, None, 1, key="bottom"),
+    )
+
+    def box(self, params: dict, size: tuple[int, int]) -> tuple[int, int, int, int]:
+        right = size[0] if params["right"] is None else params["right"]
+        bottom = size[1] if params["bottom"] is None else params["bottom"]
+        return params["left"], params["top"], right, bottom
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return image.crop(self.box(params, image.size))
+
+    def scale(self, params: dict, scale: tuple[float, float]) -> dict:
+        return {
+            "left": round(params["left"] * scale[0]),
+            "top": round(params["top"] * scale[1]),
+            "right": None if params["right"] is None else max(round(params["right"] * scale[0]), 1),
+            "bottom": None if params["bottom"] is None else max(round(params["bottom"] * scale[1]), 1),
+        }
+
+    def output_size(self, params: dict, size: tuple[int, int]) -> tuple[int, int]:
+        left, top, right, bottom = self.box(params, size)
+        return right - left, bottom - top
+
+    def matrix(self, params: dict, size: tuple[int, int]) -> tuple[np.ndarray, tuple[int, int]]:
+        left, top, _, _ = self.box(params, size)
+        return translation(left, top), self.output_size(params, size)
@@ -0,0 +1,29 @@
+import numpy as np
+from PIL import Image
+
+from .base import Operation, Parameter, scaling, translation
+
+transposes = {
+    "Horizontal": Image.FLIP_LEFT_RIGHT,
+    "Vertical": Image.FLIP_TOP_BOTTOM,
+    "Diagonal": Image.ROTATE_180,
+}
+
+
+class Flip(Operation):
+    name = "Flip"
+    geometric = True
+    parallel = False
+    parameters = (
+        Parameter("mode", str, "Horizontal", choices=("Horizontal", "Vertical", "Diagonal"), key="flip_mode"),
+    )
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        # Flipping both ways is a half turn, which is a single transpose
+        return image.transpose(transposes[params["mode"]])
+
+    def matrix(self, params: dict, size: tuple[int, int]) -> tuple[np.ndarray, tuple[int, int]]:
+        flip_x = params["mode"] != "Vertical"
+        flip_y = params["mode"] != "Horizontal"
+        matrix = translation(size[0] if flip_x else 0, size[1] if flip_y else 0)
+        return matrix @ scaling(-1 if flip_x else 1, -1 if flip_y else 1), size
@@ -0,0 +1,26 @@
+import numpy as np
+from PIL import Image
+
+from .base import IDENTITY, Operation, Parameter, apply_lut, blend_lut
+
+
+class Opacity(Operation):
+    name = "Opacity"
+    point = True
+    parameters = (Parameter("percentage", int, 100, -1, 100, key="opacity_percentage"),)
+    # Only the alpha band changes, it's replaced in the image itself
+    in_place = True
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        # Images without an alpha channel only get one when they become translucent, see `apply_lut`
+        return apply_lut(image, *self.lut(params))
+
+    def run_in_place(self, image: Image.Image, params: dict) -> Image.Image:
+        if "A" not in image.getbands():
+            return self.run(image, params)
+        image.putalpha(image.getchannel("A").point(self.lut(params)[1].tolist()))
+        return image
+
+    def lut(self, params: dict) -> tuple[np.ndarray, np.ndarray]:
+        # Same float32 arithmetic as `ImageEnhance.Brightness` on the alpha band
+        return IDENTITY, blend_lut(0, params["percentage"] / 100)
@@ -0,0 +1,119 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+from .base import Operation, Parameter, scaling
+
+
+def reducing_factor(scale: float, gap: float | None) -> int:
+    """Largest power of two an input `scale` times the size of the output can be reduced by beforehand,
+    while it stays at least `gap` times the size of the output. Reducing by powers of two keeps the coordinates
+    of the reduced image exact in the float32 boxes Pillow resizes, so regions stay exact
+    """
+    factor = 1
+    while gap is not None and scale / (factor * 2) >= gap:
+        factor *= 2
+    return factor
+
+
+def resize_box(
+    image: Image.Image,
+    size: tuple[int, int],
+    box: tuple[float, float, float, float],
+    resample: int,
+    factors: tuple[int, int] = (1, 1),
+    limits: tuple[int, int, int, int] | None = None,
+) -> Image.Image:
+    """Resizes the region `box` of the image to `size`, after reducing it by `factors` (x, y).
+    Where the box lies outside the image, the image is padded with transparent pixels. When the image is part of
+    a larger input and `box` a region of a larger output, `limits` is how far that input is padded for the whole
+    output, so the filter reads the same pixels as it does there. It's the image and the box by default.
+    The image is reduced in whole blocks counted from its top left corner, so a region of it that starts
+    on a block reduces the same blocks as the whole image
+    """
+    (x, y), (width, height) = factors, image.size
+    limits = limits or (
+        min(math.floor(box[0]), 0),
+        min(math.floor(box[1]), 0),
+        max(math.ceil(box[2]), width),
+        max(math.ceil(box[3]), height),
+    )
+    if factors == (1, 1) and limits == (0, 0, width, height):
+        return image.resize(size, resample, box=box)
+
+    # The filter reads around the box as well, up to three times the scale for Lanczos, and three pixels when it
+    # enlarges. Farther out the image is only padded, which the filter doesn't read
+    margin = [math.ceil(3 * max((box[axis + 2] - box[axis]) / size[axis], 1)) for axis in (0, 1)]
+    outer = (
+        math.floor(max(math.floor(box[0]) - margin[0], limits[0]) / x) * x,
+        math.floor(max(math.floor(box[1]) - margin[1], limits[1]) / y) * y,
+        math.ceil(min(math.ceil(box[2]) + margin[0], limits[2]) / x) * x,
+        math.ceil(min(math.ceil(box[3]) + margin[1], limits[3]) / y) * y,
+    )
+    inner = max(outer[0], 0), max(outer[1], 0), min(outer[2], width), min(outer[3], height)
+    if inner == outer:
+        reduced = image.crop(inner) if factors == (1, 1) else image.reduce(factors, inner)
+    else:
+        reduced = Image.new(image.mode, ((outer[2] - outer[0]) // x, (outer[3] - outer[1]) // y))
+        if inner[0] < inner[2] and inner[1] < inner[3]:
+            part = image.crop(inner) if factors == (1, 1) else image.reduce(factors, inner)
+            reduced.paste(part, ((inner[0] - outer[0]) // x, (inner[1] - outer[1]) // y))
+
+    left, top = outer[:2]
+    box = (box[0] - left) / x, (box[1] - top) / y, (box[2] - left) / x, (box[3] - top) / y
+    if box == tuple(map(round, box)) and (box[2] - box[0], box[3] - box[1]) == size:
+        # Pillow copies the image instead of resampling it at the same size, which would round the premultiplied
+        # alpha, so regions are cropped like that as well
+        return reduced.crop(tuple(map(round, box)))
+    return reduced.resize(size, resample, box=box)
+
+
+class Resize(Operation):
+    name = "Resize"
+    geometric = True
+    parameters = (
+        # None keeps the size of the image
+        Parameter("width", int, None, 1, 10000, key="width_size"),
+        Parameter("height", int, None, 1, 10000, key="height_size"),
+        Parameter("percentage", int, 100, 1, 500, key="resize_percentage"),
+        # Best resizes like the node always has, the others have to be chosen
+        Parameter("quality", str, "Best", choices=("Best", "Balanced", "Fast"), key="resize_quality"),
+    )
+
+    # Resampling filter of every quality, and the reducing gap: downscales first reduce the image by powers of two
+    # while it stays at least that many times the size of the output, which is much cheaper than filtering
+    # with a support that wide. Best always filters the full resolution image
+    qualities = {
+        "Best": (Image.LANCZOS, None),
+        "Balanced": (Image.LANCZOS, 2.0),
+        "Fast": (Image.BILINEAR, 1.0),
+    }
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return self.resample(image, params, params["quality"])
+
+    def approximate(self, image: Image.Image, params: dict) -> Image.Image:
+        return self.resample(image, params, "Fast")
+
+    def resample(self, image: Image.Image, params: dict, quality: str) -> Image.Image:
+        size = self.output_size(params, image.size)
+        resample, gap = self.qualities[quality]
+        factors = reducing_factor(image.width / size[0], gap), reducing_factor(image.height / size[1], gap)
+        return resize_box(image, size, (0, 0, *image.size), resample, factors)
+
+    def scale(self, params: dict, scale: tuple[float, float]) -> dict:
+        return {
+            **params,
+            "width": None if params["width"] is None else max(round(params["width"] * scale[0]), 1),
+            "height": None if params["height"] is None else max(round(params["height"] * scale[1]), 1),
+        }
+
+    def output_size(self, params: dict, size: tuple[int, int]) -> tuple[int, int]:
+        width = size[0] if params["width"] is None else params["width"]
+        height = size[1] if params["height"] is None else params["height"]
+        return max(width * params["percentage"] // 100, 1), max(height * params["percentage"] // 100, 1)
+
+    def matrix(self, params: dict, size: tuple[int, int]) -> tuple[np.ndarray, tuple[int, int]]:
+        width, height = self.output_size(params, size)
+        return scaling(size[0] / width, size[1] / height), (width, height)
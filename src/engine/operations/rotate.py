@@ -0,0 +1,75 @@
+import functools
+import math
+
+import numpy as np
+from PIL import Image
+
+from .base import Operation, Parameter, rotation, translation
+
+# Transposes of the quarter turns, counter clockwise like `Image.rotate`
+turns = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+filters = {"Nearest": Image.NEAREST, "Bilinear": Image.BILINEAR, "Bicubic": Image.BICUBIC}
+
+
+@functools.lru_cache(maxsize=256)
+def _matrix(degrees: int, size: tuple[int, int], expand: bool) -> tuple[np.ndarray, tuple[int, int]]:
+    width, height = size
+    if degrees % 90 == 0:
+        # Where every pixel of the turned image comes from, it's moved by whole pixels to the centre of the output
+        turned = (height, width) if degrees % 180 else size
+        matrix = {
+            0: translation(0, 0),
+            90: np.array(((0.0, -1.0, width), (1.0, 0.0, 0.0), (0.0, 0.0, 1.0))),
+            180: np.array(((-1.0, 0.0, width), (0.0, -1.0, height), (0.0, 0.0, 1.0))),
+            270: np.array(((0.0, 1.0, 0.0), (-1.0, 0.0, height), (0.0, 0.0, 1.0))),
+        }[degrees]
+        output = turned if expand else size
+        # `Image.rotate` centres it on the same pixels, rounding half a pixel down on one axis and up on the other
+        x, y = output[0] - turned[0], output[1] - turned[1]
+        offset = {90: (x // 2, -(-y // 2)), 270: (-(-x // 2), y // 2)}.get(degrees, (0, 0))
+        matrix = matrix @ translation(-offset[0], -offset[1])
+    else:
+        matrix = rotation(degrees, (width / 2, height / 2))
+        output = size
+        if expand:
+            # The bounding box of the rotated image, like `Image.rotate` measures it
+            corners = np.array(((0, width, width, 0), (0, 0, height, height), (1, 1, 1, 1)), dtype=float)
+            x, y, _ = matrix @ corners
+            output = math.ceil(x.max()) - math.floor(x.min()), math.ceil(y.max()) - math.floor(y.min())
+            matrix = matrix @ translation(-(output[0] - width) / 2, -(output[1] - height) / 2)
+
+    matrix.setflags(write=False)
+    return matrix, output
+
+
+class Rotate(Operation):
+    name = "Rotate"
+    geometric = True
+    parameters = (
+        Parameter("degrees", int, 360, 1, 360, key="rotate_degrees"),
+        # Grows the image to fit the rotated image instead of cutting off its corners
+        Parameter("expand", bool, False, key="rotate_expand"),
+        # Filter of rotations that aren't a quarter turn, quarter turns move whole pixels
+        Parameter("resample", str, "Nearest", choices=tuple(filters), key="rotate_resample"),
+    )
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        degrees = params["degrees"] % 360
+        if degrees % 90:
+            return image.rotate(degrees, filters[params["resample"]], expand=params["expand"])
+
+        # Quarter turns move whole pixels, a transpose when the output fits the turned image
+        matrix, size = self.matrix(params, image.size)
+        if degrees == 0:
+            return image
+        if size == (image.height, image.width) or degrees == 180:
+            return image.transpose(turns[degrees])
+        # Only the middle of the turned image is kept, the transform doesn't resample at whole pixel offsets
+        return image.transform(size, Image.AFFINE, tuple(matrix[:2].ravel()), Image.NEAREST)
+
+    def output_size(self, params: dict, size: tuple[int, int]) -> tuple[int, int]:
+        return self.matrix(params, size)[1]
+
+    def matrix(self, params: dict, size: tuple[int, int]) -> tuple[np.ndarray, tuple[int, int]]:
+        # The matrix is needed for every region and every render, and it only depends on these
+        return _matrix(params["degrees"] % 360, size, params["expand"])
@@ -0,0 +1,28 @@
+from PIL import Image, ImageEnhance, ImageFilter
+
+from .base import Operation, Parameter
+
+
+class Sharpness(Operation):
+    name = "Sharpness"
+    parameters = (Parameter("percentage", int, 1, 1, 100, key="sharpness_percentage"),)
+    # `ImageEnhance` keeps a smoothed copy of the whole image around, in strips only a strip of it is
+    in_place = True
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return ImageEnhance.Sharpness(image).enhance(params["percentage"] / 25)
+
+    def run_in_place(self, image: Image.Image, params: dict) -> Image.Image:
+        return self.run_rows(image, params)
+
+    def approximate(self, image: Image.Image, params: dict) -> Image.Image:
+        # The smoothing kernel is 5/13 of the pixel and 8/13 of its neighbours, which is 4/13 of the pixel and 9/13
+        # of a 3x3 box blur, so blending with the box blur directly only needs a different factor
+        blurred = image.filter(ImageFilter.BoxBlur(1))
+        if "A" in image.getbands():
+            blurred.putalpha(image.getchannel("A"))
+        return Image.blend(blurred, image, 1 + 9 / 13 * (params["percentage"] / 25 - 1))
+
+    def halo(self, params: dict) -> int:
+        # The sharpened image is blended with a 3x3 smoothing of it
+        return 1
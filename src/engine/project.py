@@ -0,0 +1,38 @@
+from src.engine.graph import INPUT, OUTPUT, Graph
+from src.engine.operations import operations
+
+
+def load_project(data: dict) -> Graph:
+    """Builds a graph from a project written by `NodeEditor.save`.
+    Links only store the names of their nodes, so like `NodeEditor.open_callback`
+    they are resolved to the last node of that type
+    """
+    graph = Graph()
+    graph.add_node(INPUT)
+    graph.add_node(OUTPUT)
+
+    nodes = {INPUT.lower(): INPUT, OUTPUT.lower(): OUTPUT}
+    for node, info in data["nodes"].items():
+        if node in (INPUT, OUTPUT):
+            continue
+
+        for operation in operations.values():
+            if operation.name.lower() in node.lower():
+                counter = node.split("_")[-1]
+                settings = info["settings"].get(node, {})
+                params = {
+                    parameter.name: settings[parameter.key + "_" + counter]
+                    for parameter in operation.parameters
+                    if parameter.key + "_" + counter in settings
+                }
+                graph.add_node(operation.name, node, **params)
+                nodes[node.split("_", maxsplit=2)[0].lower()] = node
+                break
+
+    for link in data["links"]:
+        source = nodes.get(link["source"].lower())
+        target = nodes.get(link["target"].lower())
+        if source and target and source != target:
+            graph.connect(source, target)
+
+    return graph
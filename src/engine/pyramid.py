@@ -0,0 +1,67 @@
+import threading
+
+from PIL import Image
+
+
+def fit_size(size: tuple[int, int], limit: int) -> tuple[int, int]:
+    """`size` scaled down to fit in a `limit` square, keeping its aspect ratio"""
+    if max(size) <= limit:
+        return size
+    ratio = limit / max(size)
+    return max(round(size[0] * ratio), 1), max(round(size[1] * ratio), 1)
+
+
+def fit(image: Image.Image, size: int) -> Image.Image:
+    """Downscales the image to fit in a `size` square, halving it with `reduce` before the final resample.
+    The image itself is returned when it already fits
+    """
+    if max(image.size) <= size:
+        return image
+
+    target = fit_size(image.size, size)
+    factor = 1
+    while max(image.size) // (factor * 2) >= size:
+        factor *= 2
+    if factor > 1:
+        image = image.reduce(factor)
+    return image.resize(target, Image.LANCZOS)
+
+
+class Pyramid:
+    """The image at full, half, quarter... resolution, down to the first level that is smaller than twice `smallest`.
+    The levels are built once on a background thread, until then the ones that are ready are used
+    """
+
+    def __init__(self, image: Image.Image, smallest: int = 450, on_ready: callable = None):
+        """:param on_ready: Called as `on_ready(pyramid)` on the background thread once every level is built"""
+        self.smallest = smallest
+        self.on_ready = on_ready
+        self.levels = [image]
+        self.ready = threading.Event()
+        threading.Thread(target=self._build, daemon=True).start()
+
+    @property
+    def image(self) -> Image.Image:
+        return self.levels[0]
+
+    def _build(self):
+        level = self.levels[0]
+        while max(level.size) // 2 >= self.smallest:
+            level = level.reduce(2)
+            self.levels.append(level)
+
+        self.ready.set()
+        if self.on_ready is not None:
+            self.on_ready(self)
+
+    def level(self, size: int) -> Image.Image:
+        """The smallest level that still covers a `size` square, or the full image when it's smaller than that"""
+        levels = self.levels[:]
+        for level in reversed(levels):
+            if max(level.size) >= size:
+                return level
+        return levels[0]
+
+    def fit(self, size: int) -> Image.Image:
+        """The image downscaled to fit in a `size` square, resampled from the nearest level above it"""
+        return fit(self.level(size), size)
@@ -0,0 +1,224 @@
+"""Tiled evaluation, where memory is bounded by the size of the tiles instead of the size of the image.
+Each tile of the output is computed on its own, the region every step needs is found by walking the steps backwards
+"""
+
+import math
+from collections.abc import Iterator
+from concurrent.futures import Executor
+
+from PIL import Image
+
+from src.engine.fusion import geometry
+from src.engine.modes import native
+from src.engine.operations import Operation
+from src.engine.operations.base import Box
+
+TILE_BUDGET = 64 * 1024 * 1024
+
+
+def clamp(box: Box, size: tuple[int, int]) -> Box:
+    left, top = min(max(box[0], 0), size[0]), min(max(box[1], 0), size[1])
+    return left, top, max(min(box[2], size[0]), left), max(min(box[3], size[1]), top)
+
+
+def tile_shape(size: tuple[int, int], budget: int) -> tuple[int, int]:
+    """Width and height of the tiles for an output of `size`.
+    A third of the budget goes to the strip of tiles being assembled, the rest to the input and output of a step
+    """
+    side = max(math.isqrt(budget // 12), 16)
+    return min(side, size[0]), max(min(side, budget // (12 * size[0]), size[1]), 1)
+
+
+def tileable(steps: list[tuple[Operation, dict]]) -> list[tuple[Operation, dict]]:
+    """Geometric operations map regions through their matrix, so every one of them becomes a `Geometry` step"""
+    return [
+        (geometry, {"steps": ((operation.name, tuple(params.items())),)})
+        if operation.geometric
+        else (operation, params)
+        for operation, params in steps
+    ]
+
+
+def sizes(steps: list[tuple[Operation, dict]], size: tuple[int, int]) -> list[tuple[int, int]]:
+    """Size of the input of every step, followed by the size of the output"""
+    result = [size]
+    for operation, params in steps:
+        result.append(operation.output_size(params, result[-1]))
+    return result
+
+
+def source_boxes(steps: list[tuple[Operation, dict]], size: tuple[int, int], box: Box) -> list[Box]:
+    """Region of the input of every step needed for the region `box` of the output, followed by `box`,
+    `steps` have to be `tileable`
+    """
+    step_sizes = sizes(steps, size)
+    boxes = [box]
+    for (operation, params), size in zip(reversed(steps), reversed(step_sizes[:-1]), strict=True):
+        boxes.append(clamp(operation.source_box(params, boxes[-1], size), size))
+    return boxes[::-1]
+
+
+def render(
+    image: Image.Image,
+    steps: list[tuple[Operation, dict]],
+    box: Box,
+    size: tuple[int, int] | None = None,
+    origin: tuple[int, int] = (0, 0),
+) -> Image.Image:
+    """Computes the region `box` of the output of `steps` on an input of `size`, of which `image` is the part at
+    `origin`. By default `image` is the whole input
+    """
+    steps = tileable(steps)
+    step_sizes = sizes(steps, size or image.size)
+    boxes = source_boxes(steps, step_sizes[0], box)
+    # Tiles are only converted where an operation needs another mode, so the input can stay in its own mode
+    left, top, right, bottom = boxes[0]
+    tile = native(image.crop((left - origin[0], top - origin[1], right - origin[0], bottom - origin[1])))
+    for (operation, params), size, source, target in zip(steps, step_sizes, boxes, boxes[1:], strict=False):
+        tile = operation.run_region(operation.conform(tile, params, size), params, size, target, source[:2])
+    return tile
+
+
+def run_inexact(image: Image.Image, steps: list[tuple[Operation, dict]]) -> tuple[Image.Image, list]:
+    """Runs the steps up to the last one whose regions aren't `exact` on the whole image,
+    returns their output and the steps after them, which can be computed in regions
+    """
+    split = 0
+    for index, ((operation, params), size) in enumerate(zip(tileable(steps), sizes(steps, image.size), strict=False)):
+        if not operation.exact(params, size):
+            split = index + 1
+    for operation, params in steps[:split]:
+        image = operation.run(operation.conform(image, params), params)
+    return image, steps[split:]
+
+
+def rows(size: tuple[int, int], budget: int) -> Iterator[list[Box]]:
+    """Rows of tiles covering an output of `size`, from top to bottom"""
+    width, height = tile_shape(size, budget)
+    for top in range(0, size[1], height):
+        bottom = min(top + height, size[1])
+        yield [(left, top, min(left + width, size[0]), bottom) for left in range(0, size[0], width)]
+
+
+def tiles(image: Image.Image, steps: list[tuple[Operation, dict]], budget: int) -> Iterator[Image.Image]:
+    image, steps = run_inexact(image, steps)
+    for row in rows(sizes(steps, image.size)[-1], budget):
+        for box in row:
+            yield render(image, steps, box)
+
+
+def strips(image: Image.Image, steps: list[tuple[Operation, dict]], budget: int) -> Iterator[Image.Image]:
+    """The output of `steps` in strips of its full width, from top to bottom.
+    Steps whose regions aren't exact, and the ones before them, run on the whole image first
+    """
+    image, steps = run_inexact(image, steps)
+    size = sizes(steps, image.size)[-1]
+    for row in rows(size, budget):
+        strip = None
+        for box in row:
+            tile = render(image, steps, box)
+            if strip is None:
+                strip = Image.new(tile.mode, (size[0], row[0][3] - row[0][1]))
+            strip.paste(tile, (box[0], 0))
+        yield strip
+
+
+def run_strips(operation: Operation, params: dict, image: Image.Image, executor: Executor, count: int) -> Image.Image:
+    """Runs a single operation on `count` horizontal strips of the image in parallel and stitches the results.
+    Every strip reads its region of the input, including the overlap neighbourhood filters need
+    """
+    image = operation.conform(image, params)
+    params = operation.prepare(params, [image])
+    ((tiled, tiled_params),) = tileable([(operation, params)])
+    if not tiled.exact(tiled_params, image.size):
+        return operation.run(image, params)
+
+    operation, params = tiled, tiled_params
+    size = operation.output_size(params, image.size)
+    alignment = operation.alignment(params, image.size)[1]
+    height = -(-size[1] // count)
+    height = -(-height // alignment) * alignment
+    boxes = [(0, top, size[0], min(top + height, size[1])) for top in range(0, size[1], height)]
+
+    def strip(box: Box) -> Image.Image:
+        source = clamp(operation.source_box(params, box, image.size), image.size)
+        return operation.run_region(image.crop(source), params, image.size, box, source[:2])
+
+    parts = list(executor.map(strip, boxes))
+    # Operations may return another mode than their input, like an opacity that adds an alpha band
+    result = Image.new(parts[0].mode, size)
+    for box, part in zip(boxes, parts, strict=True):
+        result.paste(part, box[:2])
+    return result
+
+
+class Cropped(Operation):
+    """A crop with the operations before it, which only compute the part of their output that the crop keeps.
+    Every step has to be `local`, the steps are kept as operations with their parameters as items
+    """
+
+    name = "Cropped"
+
+    @staticmethod
+    def steps(params: dict) -> list[tuple[Operation, dict]]:
+        return [(operation, dict(step)) for operation, step in params["steps"]]
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        image, steps = run_inexact(image, self.steps(params))
+        if not steps:
+            return image
+        return render(image, steps, (0, 0, *sizes(steps, image.size)[-1]))
+
+    def output_size(self, params: dict, size: tuple[int, int]) -> tuple[int, int]:
+        return sizes(self.steps(params), size)[-1]
+
+    def input_mode(self, params: dict, mode: str, size: tuple[int, int]) -> str:
+        # The steps convert their part of the image where they need to
+        return mode
+
+    def exact(self, params: dict, size: tuple[int, int]) -> bool:
+        steps = tileable(self.steps(params))
+        step_sizes = sizes(steps, size)
+        return all(operation.exact(step, size) for (operation, step), size in zip(steps, step_sizes, strict=False))
+
+    def source_box(self, params: dict, box: Box, size: tuple[int, int]) -> Box:
+        return source_boxes(tileable(self.steps(params)), size, box)[0]
+
+    def run_region(
+        self, image: Image.Image, params: dict, size: tuple[int, int], box: Box, origin: tuple[int, int]
+    ) -> Image.Image:
+        return render(image, self.steps(params), box, size, origin)
+
+
+cropped = Cropped()
+
+
+def _crops(operation: Operation, params: dict) -> bool:
+    if operation is geometry:
+        return any(name == "Crop" for name, _ in params["steps"])
+    return operation.name == "Crop"
+
+
+def push_crops(steps: list[tuple[Operation, dict]]) -> list[tuple[Operation, dict]]:
+    """Replaces every crop and the `local` operations before it with a single `Cropped` step,
+    so those operations only compute the region of their output the crop keeps, plus the border they need
+    """
+    result = []
+    for operation, params in steps:
+        if not _crops(operation, params):
+            result.append((operation, params))
+            continue
+
+        start = len(result)
+        while start and result[start - 1][0].local(result[start - 1][1]):
+            start -= 1
+        if start == len(result):
+            result.append((operation, params))
+            continue
+
+        run = []
+        for step, items in [*result[start:], (operation, params)]:
+            # The steps of an earlier crop join the run
+            run.extend(cropped.steps(items) if step is cropped else [(step, items)])
+        result[start:] = [(cropped, {"steps": tuple((step, tuple(items.items())) for step, items in run)})]
+    return result
@@ -0,0 +1,106 @@
+"""Writers that take an image in strips from top to bottom, for the output of tiled evaluation"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+# PNG colour types of the modes the engine produces
+COLOR_TYPES = {"L": 0, "RGB": 2, "LA": 4, "RGBA": 6}
+
+
+class ImageWriter:
+    """Assembles the strips and saves the image with Pillow once it's complete.
+    Used for formats that can't be written incrementally, so memory grows with the image
+    """
+
+    def __init__(self, path: str, size: tuple[int, int]):
+        self.path = path
+        self.size = size
+        self.image = None
+        self.top = 0
+
+    def write(self, strip: Image.Image):
+        if self.image is None:
+            self.image = Image.new(strip.mode, self.size)
+        self.image.paste(strip, (0, self.top))
+        self.top += strip.height
+
+    def incomplete(self):
+        """Cleans up after an output that didn't get all of its rows, and raises"""
+        self.abort()
+        raise ValueError(f"Only {self.top} of {self.size[1]} rows of the output were written")
+
+    def close(self):
+        if self.image is None or self.top < self.size[1]:
+            self.incomplete()
+        try:
+            self.image.save(self.path)
+        except OSError:
+            # Formats like JPEG can't store an alpha channel
+            self.image.convert("RGB").save(self.path)
+
+    def abort(self):
+        self.image = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PngWriter(ImageWriter):
+    """Compresses every strip as it arrives, only one row of the image is kept between strips"""
+
+    def __init__(self, path: str, size: tuple[int, int]):
+        super().__init__(path, size)
+        self.file = None
+        self.compressor = zlib.compressobj(6)
+        self.previous = None
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)) + kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+    def write(self, strip: Image.Image):
+        if strip.mode not in COLOR_TYPES:
+            strip = strip.convert("RGBA")
+        if self.file is None:
+            self.file = open(self.path, "wb")  # noqa: SIM115
+            self.file.write(b"\x89PNG\r\n\x1a\n")
+            self._chunk(b"IHDR", struct.pack(">IIBBBBB", *self.size, 8, COLOR_TYPES[strip.mode], 0, 0, 0))
+            self.previous = np.zeros(self.size[0] * len(strip.getbands()), dtype=np.uint8)
+
+        # Every row is stored as its difference to the row above (the "Up" filter), which compresses well for photos
+        data = np.asarray(strip).reshape(strip.height, -1)
+        filtered = data - np.vstack((self.previous, data[:-1]))
+        self.previous = data[-1].copy()
+        rows = np.hstack((np.full((strip.height, 1), 2, dtype=np.uint8), filtered))
+        if compressed := self.compressor.compress(rows.tobytes()):
+            self._chunk(b"IDAT", compressed)
+        self.top += strip.height
+
+    def close(self):
+        if self.file is None or self.top < self.size[1]:
+            self.incomplete()
+        self._chunk(b"IDAT", self.compressor.flush())
+        self._chunk(b"IEND", b"")
+        self.file.close()
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.remove(self.path)
+
+
+def open_writer(path: str, size: tuple[int, int]) -> ImageWriter:
+    if os.path.splitext(path)[1].lower() == ".png":
+        return PngWriter(path, size)
+    return ImageWriter(path, size)
@@ -1,6 +1,12 @@
+import sys
+import time
+
 import dearpygui.dearpygui as dpg
+from PIL import Image
 from pydantic import BaseModel
 
+from src.engine.operations import Operation, operations
+
 
 def find_available_pos():
     x, y = dpg.get_mouse_pos(local=False)
@@ -13,6 +19,73 @@ class Link(BaseModel):
     id: int
 
 
+class LinkStore:
+    """Links of the node editor, indexed by source attribute, target attribute and id.
+    An output attribute has at most one link, adding another link from it replaces the previous one
+    """
+
+    def __init__(self):
+        self._ids: dict[int, Link] = {}
+        self._sources: dict[int, Link] = {}
+        self._targets: dict[int, dict[int, Link]] = {}
+
+    def add(self, link: Link) -> Link | None:
+        """Adds a link and returns the link it replaced, if any"""
+        replaced = self._sources.get(link.source)
+        if replaced is not None:
+            self.remove(replaced.id)
+
+        self._ids[link.id] = link
+        self._sources[link.source] = link
+        self._targets.setdefault(link.target, {})[link.id] = link
+        return replaced
+
+    def remove(self, link_id: int) -> Link | None:
+        link = self._ids.pop(link_id, None)
+        if link is not None:
+            del self._sources[link.source]
+            del self._targets[link.target][link_id]
+            if not self._targets[link.target]:
+                del self._targets[link.target]
+        return link
+
+    def get(self, link_id: int) -> Link | None:
+        return self._ids.get(link_id)
+
+    def from_source(self, source: int) -> Link | None:
+        return self._sources.get(source)
+
+    def to_target(self, target: int) -> list[Link]:
+        return list(self._targets.get(target, {}).values())
+
+    def find(self, source: int, target: int) -> Link | None:
+        link = self._sources.get(source)
+        return link if link is not None and link.target == target else None
+
+    def touching(self, attributes: list[int]) -> list[Link]:
+        """Links from or to any of the attributes, like the attributes of a node"""
+        links = {}
+        for attribute in attributes:
+            if (link := self._sources.get(attribute)) is not None:
+                links[link.id] = link
+            links.update(self._targets.get(attribute, {}))
+        return list(links.values())
+
+    def clear(self):
+        self._ids.clear()
+        self._sources.clear()
+        self._targets.clear()
+
+    def __iter__(self):
+        return iter(list(self._ids.values()))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, link_id: int):
+        return link_id in self._ids
+
+
 class NodeParent:
     def __init__(self, update_output: callable):
         self.counter = 0
@@ -20,6 +93,19 @@ class NodeParent:
         self.settings = {}
         self.protected = False
 
+    @property
+    def operation(self) -> Operation:
+        return operations[self.name]
+
+    def params(self, tag: str, settings: dict | None = None) -> dict:
+        """Maps the settings of a node, which are keyed by DPG tags, to the parameters of its operation"""
+        settings = settings or self.settings[tag]
+        counter = tag.split("_")[-1]
+        return {parameter.name: settings[parameter.key + "_" + counter] for parameter in self.operation.parameters}
+
+    def run(self, image: Image.Image, tag: str, settings: dict | None = None) -> Image.Image:
+        return self.operation.run(image, self.params(tag, settings))
+
     def update_history(self, tag):
         history_manager.append(
             HistoryItem(
@@ -34,49 +120,123 @@ class NodeParent:
         )
 
 
-class HistoryItem(BaseModel):
-    tag: str
-    action: str
-    data: dict
+class HistoryItem:
+    """An undo step. `update` steps hold `{sender: (value, previous value)}` in their data"""
+
+    __slots__ = ("action", "data", "nbytes", "tag", "time")
+
+    def __init__(self, tag: str, action: str, data: dict):
+        self.tag = tag
+        self.action = action
+        self.data = data
+        # When the step was last appended or merged into
+        self.time = time.monotonic()
+        # Estimated, objects shared with the editor like the modules of the nodes aren't counted
+        self.nbytes = sys.getsizeof(self) + sys.getsizeof(data) + sum(sys.getsizeof(value) for value in data.values())
+
+    def merge(self, item: "HistoryItem", window: float) -> bool:
+        """Merges a later update of the same setting within `window` seconds into this one,
+        undoing it then goes back to the value before both
+        """
+        if self.action != "update" or item.action != "update" or self.tag != item.tag:
+            return False
+        if self.data.keys() != item.data.keys() or item.time - self.time > window:
+            return False
+
+        ((sender, (_, previous)),) = self.data.items()
+        self.data[sender] = (item.data[sender][0], previous)
+        self.time = item.time
+        return True
 
 
 class HistoryManager:
-    def __init__(self):
-        self.history: list[HistoryItem] = []
+    """Undo steps in a list, undo and redo move an index through it.
+    Updates of the same setting within `merge_window` seconds of each other are merged into one step,
+    so a dragged slider is undone at once. The oldest steps are dropped beyond `max_entries` or `max_bytes`
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 4 * 1024 * 1024, merge_window: float = 1.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.merge_window = merge_window
+        # The oldest steps are dropped by moving `_start` past them, the list is only shortened once they make up
+        # half of it, so the steps are indexed directly and appending stays O(1)
+        self._steps: list[HistoryItem | None] = []
+        self._start = 0
         self.index = -1
+        self.nbytes = 0
+        # Whether the last step was appended, steps that were undone and redone aren't merged into
+        self._mergeable = False
         self.update_output = None
         self.update_path = None
-        self.links = None
+        # Keep the links and the graph of the editor up to date
+        self.add_link = None
+        self.remove_link = None
+        self.remove_node = None
+
+    def __len__(self) -> int:
+        return len(self._steps) - self._start
+
+    @property
+    def history(self) -> list[HistoryItem]:
+        """The steps, oldest first"""
+        return self._steps[self._start :]
+
+    def step(self, index: int) -> HistoryItem:
+        """The step at `index`, negative indices count from the newest step like for lists"""
+        return self._steps[index if index < 0 else self._start + index]
 
     def clear(self):
-        self.history = []
+        self._steps.clear()
+        self._start = 0
         self.index = -1
+        self.nbytes = 0
+        self._mergeable = False
 
     def append(self, item: HistoryItem):
-        if self.index != len(self.history) - 1:
-            self.history = self.history[: self.index + 1]
+        if self.index == len(self) - 1:
+            if self._mergeable and self._steps[-1].merge(item, self.merge_window):
+                return
+        else:
+            # The steps that were undone can't be redone anymore
+            while len(self) - 1 > self.index:
+                self.nbytes -= self._steps.pop().nbytes
 
-        self.history.append(item)
+        self._steps.append(item)
+        self.nbytes += item.nbytes
         self.index += 1
+        self._mergeable = True
+        while len(self) > 1 and (len(self) > self.max_entries or self.nbytes > self.max_bytes):
+            self.nbytes -= self._steps[self._start].nbytes
+            self._steps[self._start] = None
+            self._start += 1
+            self.index -= 1
+        if self._start > len(self._steps) // 2:
+            del self._steps[: self._start]
+            self._start = 0
 
     def undo(self):
+        self._mergeable = False
         if self.index >= 0:
-            item = self.history[self.index]
+            item = self.step(self.index)
             try:
                 match item.action:
                     case "new":
                         try:
-                            self.history[self.index].data["pos"] = dpg.get_item_pos(item.tag)
+                            self.step(self.index).data["pos"] = dpg.get_item_pos(item.tag)
                         except SystemError:
-                            self.index = len(self.history) - 1
+                            self.index = len(self) - 1
                             return
+                        self.remove_node(item.tag)
                         dpg.delete_item(item.tag)
+                        self.update_path()
+                        self.update_output()
                     case "update":
                         key, value = next(iter(item.data.items()))
                         try:
                             dpg.set_value(key, value[1])
                         except SystemError:
-                            self.index = len(self.history) - 1
+                            self.index = len(self) - 1
                             return
                         self.update_output(key, value[1], False)
                     case "delete":
@@ -99,15 +259,12 @@ class HistoryManager:
                             item.data["target"],
                             parent="MainNodeEditor",
                         )
-                        self.history[self.index].data["id"] = tag
-                        self.links.append(Link(source=item.data["source"], target=item.data["target"], id=tag))
+                        self.step(self.index).data["id"] = tag
+                        self.add_link(item.data["source"], item.data["target"], tag)
                         self.update_path()
                         self.update_output()
                     case "link_create":
-                        dpg.delete_item(item.data["id"])
-                        for link in self.links:
-                            if link.source == item.data["source"] and link.target == item.data["target"]:
-                                self.links.remove(link)
+                        self.remove_link(item.data["source"], item.data["target"])
                         self.update_path()
                         self.update_output()
                     case _:
@@ -118,9 +275,10 @@ class HistoryManager:
             self.index -= 1
 
     def redo(self):
-        if self.index < len(self.history) - 1:
+        self._mergeable = False
+        if self.index < len(self) - 1:
             self.index += 1
-            item = self.history[self.index]
+            item = self.step(self.index)
             try:
                 match item.action:
                     case "new":
@@ -130,7 +288,7 @@ class HistoryManager:
                             data.new(history=False)
                         except SystemError:
                             data.counter += 1
-                            self.index = len(self.history) - 1
+                            self.index = len(self) - 1
                             return
 
                         tag = "_".join(item.tag.split("_")[:-1]) + "_" + str(data.counter - 1)
@@ -149,21 +307,21 @@ class HistoryManager:
                         try:
                             dpg.set_value(key, value[0])
                         except SystemError:
-                            self.index = len(self.history) - 1
+                            self.index = len(self) - 1
                             return
                         self.update_output(key, value[0], False)
                     case "delete":
                         try:
-                            self.history[self.index].data["pos"] = dpg.get_item_pos(item.tag)
+                            self.step(self.index).data["pos"] = dpg.get_item_pos(item.tag)
                         except SystemError:
-                            self.index = len(self.history) - 1
+                            self.index = len(self) - 1
                             return
+                        self.remove_node(item.tag)
                         dpg.delete_item(item.tag)
+                        self.update_path()
+                        self.update_output()
                     case "link_delete":
-                        dpg.delete_item(item.data["id"])
-                        for link in self.links:
-                            if link.source == item.data["source"] and link.target == item.data["target"]:
-                                self.links.remove(link)
+                        self.remove_link(item.data["source"], item.data["target"])
                         self.update_path()
                         self.update_output()
                     case "link_create":
@@ -172,8 +330,8 @@ class HistoryManager:
                             item.data["target"],
                             parent="MainNodeEditor",
                         )
-                        self.history[self.index].data["id"] = tag
-                        self.links.append(Link(source=item.data["source"], target=item.data["target"], id=tag))
+                        self.step(self.index).data["id"] = tag
+                        self.add_link(item.data["source"], item.data["target"], tag)
                         self.update_path()
                         self.update_output()
                     case _:
@@ -183,8 +341,8 @@ class HistoryManager:
 
     @property
     def current(self):
-        if self.history:
-            return self.history[self.index]
+        if len(self):
+            return self.step(self.index)
 
         return None
 
@@ -0,0 +1,179 @@
+import threading
+import traceback
+from collections.abc import Hashable
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from src.engine import EvaluationCancelled, Operation
+
+
+class RenderJob(NamedTuple):
+    image: Image.Image
+    key: tuple
+    scale: tuple[float, float]
+    steps: list[tuple[Operation, dict]]
+    # Full resolution sizes, the job itself may run on a downscaled proxy
+    input_size: tuple[int, int]
+    output_size: tuple[int, int]
+    # How much larger the image of the next pass is, the thumbnail of a coarse pass is stretched to take its place
+    stretch: tuple[float, float] = (1.0, 1.0)
+    # Runs the cheaper versions of the operations, while a setting is being dragged
+    approximate: bool = False
+
+
+class RenderResult(NamedTuple):
+    image: Image.Image
+    input_size: tuple[int, int]
+    output_size: tuple[int, int]
+    # Thumbnail for the output node
+    preview: Image.Image
+
+
+class RenderWorker:
+    """Renders jobs on a background thread.
+    A job is submitted as passes of increasing quality, the result of each pass replaces the one before it.
+    Only the latest submitted job is kept, superseded jobs are dropped before they start
+    and cancelled between nodes and passes while they run. The finished result is picked up by the UI thread with `poll`
+    """
+
+    def __init__(self, render: callable):
+        """:param render: Called as `render(job, cancelled)` on the worker thread for every pass,
+        `cancelled()` returns True once a newer job has been submitted
+        """
+        self.render = render
+        self.generation = 0
+        self._job: tuple[int, list[RenderJob]] | None = None
+        self._result: RenderResult | None = None
+        self._running = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @property
+    def busy(self) -> bool:
+        """Whether a job is waiting or running"""
+        return self._job is not None or self._running
+
+    def submit(self, passes: list[RenderJob]):
+        with self._condition:
+            self.generation += 1
+            self._job = (self.generation, passes)
+            self._condition.notify()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def cancel(self):
+        with self._condition:
+            self.generation += 1
+            self._job = None
+            self._result = None
+
+    def poll(self) -> RenderResult | None:
+        with self._condition:
+            result, self._result = self._result, None
+        return result
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while self._job is None:
+                    self._condition.wait()
+                generation, passes = self._job
+                self._job = None
+                self._running = True
+
+            for job in passes:
+                try:
+                    result = self.render(job, lambda generation=generation: generation != self.generation)
+                except EvaluationCancelled:
+                    break
+                except Exception:
+                    traceback.print_exc()
+                    break
+
+                with self._condition:
+                    if generation != self.generation:
+                        break
+                    self._result = result
+
+            with self._condition:
+                self._running = False
+
+
+class TileJob(NamedTuple):
+    tile: Hashable
+    # Version of the steps, tiles of an older one are dropped
+    generation: int
+    image: Image.Image
+    key: tuple
+    scale: tuple[float, float]
+    steps: list[tuple[Operation, dict]]
+    box: tuple[int, int, int, int]
+
+
+class TileResult(NamedTuple):
+    tile: Hashable
+    generation: int
+    size: tuple[int, int]
+    # RGBA float32 pixels, ready to be uploaded as a texture
+    pixels: np.ndarray
+
+
+class TileWorker:
+    """Renders the tiles of the output viewer on a background thread, in the order they are requested.
+    Every request replaces the tiles still waiting, so tiles that went out of view before their turn are never rendered.
+    Finished tiles are picked up by the UI thread with `poll`
+    """
+
+    def __init__(self, render: callable):
+        """:param render: Called as `render(job)` on the worker thread for every tile, returns its `TileResult`"""
+        self.render = render
+        self._jobs: list[TileJob] = []
+        self._running: TileJob | None = None
+        self._results: list[TileResult] = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def request(self, jobs: list[TileJob]):
+        with self._condition:
+            # Tiles that are being rendered or haven't been picked up yet aren't rendered again
+            busy = {(result.tile, result.generation) for result in self._results}
+            if self._running is not None:
+                busy.add((self._running.tile, self._running.generation))
+            self._jobs = [job for job in jobs if (job.tile, job.generation) not in busy]
+            self._condition.notify()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def cancel(self):
+        with self._condition:
+            self._jobs = []
+            self._results = []
+
+    def poll(self) -> list[TileResult]:
+        with self._condition:
+            results, self._results = self._results, []
+        return results
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._jobs:
+                    self._condition.wait()
+                job = self._running = self._jobs.pop(0)
+
+            try:
+                result = self.render(job)
+            except Exception:
+                traceback.print_exc()
+                result = None
+
+            with self._condition:
+                self._running = None
+                if result is not None:
+                    self._results.append(result)
@@ -0,0 +1,113 @@
+"""Tiles of the output for the output viewer.
+Every level of the input pyramid has its own output, cut into tiles. Only the tiles in view are rendered,
+and their textures are kept up to a memory budget
+"""
+
+import math
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import NamedTuple
+
+Box = tuple[int, int, int, int]
+
+
+class Tile(NamedTuple):
+    level: int
+    column: int
+    row: int
+
+
+class TileTexture(NamedTuple):
+    texture: int | str
+    size: tuple[int, int]
+    nbytes: int
+    # Version of the steps the tile was rendered from, older tiles are still shown until they're rendered again
+    generation: int
+    # When the tile was last in view
+    shown: float
+
+
+def pick_level(scales: list[float], zoom: float) -> int:
+    """The smallest level that still has a pixel for every pixel on screen, or the full resolution when zoomed in.
+    `scales` are the sizes of the outputs of the levels relative to the full output, largest first
+    """
+    for level in range(len(scales) - 1, 0, -1):
+        # Levels are halved with `reduce`, which rounds their size down
+        if scales[level] >= zoom * 0.99:
+            return level
+    return 0
+
+
+def tile_box(column: int, row: int, size: tuple[int, int], tile_size: int) -> Box:
+    """The region of an output of `size` that a tile covers, tiles on the right and bottom edges are smaller"""
+    left, top = column * tile_size, row * tile_size
+    return left, top, min(left + tile_size, size[0]), min(top + tile_size, size[1])
+
+
+def tiles_in_view(size: tuple[int, int], view: tuple[float, float, float, float], tile_size: int) -> list[tuple]:
+    """Columns and rows of the tiles of an output of `size` that overlap `view`, the ones closest to its center first"""
+    left, top = max(math.floor(view[0] / tile_size), 0), max(math.floor(view[1] / tile_size), 0)
+    right = min(math.ceil(view[2] / tile_size), math.ceil(size[0] / tile_size))
+    bottom = min(math.ceil(view[3] / tile_size), math.ceil(size[1] / tile_size))
+    center = ((view[0] + view[2]) / 2 / tile_size - 0.5, (view[1] + view[3]) / 2 / tile_size - 0.5)
+    tiles = [(column, row) for row in range(top, bottom) for column in range(left, right)]
+    return sorted(tiles, key=lambda tile: (tile[0] - center[0]) ** 2 + (tile[1] - center[1]) ** 2)
+
+
+class TileStore:
+    """Textures of the tiles that have been shown, released the way `ImageController.Controller` releases images:
+    once a tile has been out of view for `max_inactive_time`, and sooner when the textures take more than `budget`
+    bytes, the ones that have been out of view the longest first. Tiles in view are never released
+    """
+
+    def __init__(self, release: Callable[[int | str], None], budget: int = 256 * 1024 * 1024, max_inactive_time=10):
+        """:param release: Called with the texture of every tile that is released"""
+        self.release = release
+        self.budget = budget
+        self.max_inactive_time = max_inactive_time
+        self.nbytes = 0
+        # Least recently shown first
+        self._tiles: OrderedDict[Hashable, TileTexture] = OrderedDict()
+
+    def __contains__(self, tile: Hashable) -> bool:
+        return tile in self._tiles
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def get(self, tile: Hashable) -> TileTexture | None:
+        return self._tiles.get(tile)
+
+    def show(self, tile: Hashable) -> TileTexture | None:
+        """The texture of a tile that is in view, if it has one"""
+        texture = self._tiles.get(tile)
+        if texture is not None:
+            texture = self._tiles[tile] = texture._replace(shown=time.monotonic())
+            self._tiles.move_to_end(tile)
+        return texture
+
+    def add(self, tile: Hashable, texture: int | str, size: tuple[int, int], nbytes: int, generation: int):
+        """Stores the texture of a tile that was rendered, releasing the one it replaces"""
+        self.discard(tile)
+        self._tiles[tile] = TileTexture(texture, size, nbytes, generation, time.monotonic())
+        self.nbytes += nbytes
+
+    def discard(self, tile: Hashable):
+        texture = self._tiles.pop(tile, None)
+        if texture is not None:
+            self.nbytes -= texture.nbytes
+            self.release(texture.texture)
+
+    def evict(self, visible: set[Hashable]):
+        """Releases the tiles out of view that have been for too long, or that don't fit in the budget"""
+        now = time.monotonic()
+        for tile, texture in list(self._tiles.items()):
+            if self.nbytes <= self.budget and now - texture.shown <= self.max_inactive_time:
+                break
+            if tile not in visible:
+                self.discard(tile)
+
+    def clear(self):
+        for tile in list(self._tiles):
+            self.discard(tile)
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageChops
+
+import cresliant
+from src.batch import process
+from src.engine import load_project
+
+PROJECT = {
+    "nodes": {
+        "Input": {"pos": [0, 0], "settings": {}},
+        "flip_0": {"pos": [0, 0], "settings": {"flip_0": {"flip_mode_0": "Vertical"}}},
+        "Output": {"pos": [0, 0], "settings": {}},
+    },
+    "links": [{"source": "Input", "target": "Flip"}, {"source": "Flip", "target": "Output"}],
+}
+
+
+def run(monkeypatch, *args: str) -> int:
+    monkeypatch.setattr(sys, "argv", ["cresliant", "batch", *args, "--workers", "1"])
+    with pytest.raises(SystemExit) as exit_info:
+        cresliant.main()
+    return exit_info.value.code
+
+
+def test_batch(tmp_path, monkeypatch, capsys):
+    project, images, output = tmp_path / "flip.cresliant", tmp_path / "images", tmp_path / "output"
+    project.write_text(json.dumps(PROJECT))
+    images.mkdir()
+    gradient = Image.linear_gradient("L").convert("RGBA")
+    gradient.save(images / "a.png")
+    gradient.rotate(90).save(images / "b.png")
+    (images / "notes.txt").write_text("not an image")
+    paths = [str(project), str(images), str(output)]
+
+    # Every image in the folder is processed, other files are left out
+    assert run(monkeypatch, *paths) == 0
+    assert sorted(os.listdir(output)) == ["a.png", "b.png"]
+    with Image.open(output / "a.png") as result:
+        assert ImageChops.difference(result, gradient.transpose(Image.FLIP_TOP_BOTTOM)).getbbox() is None
+    assert "Processing 2 images, 0 up to date" in capsys.readouterr().out
+
+    # Outputs newer than their image and the project are skipped, unless forced
+    old = os.path.getmtime(project) - 10
+    os.utime(images / "b.png", (old, old))
+    os.utime(output / "a.png", (old, old))
+    assert run(monkeypatch, *paths) == 0
+    assert "Processing 1 images, 1 up to date" in capsys.readouterr().out
+    assert run(monkeypatch, *paths) == 0
+    assert "Processing 0 images, 2 up to date" in capsys.readouterr().out
+    assert run(monkeypatch, *paths, "--force") == 0
+    assert "Processing 2 images, 0 up to date" in capsys.readouterr().out
+
+    # Outputs can be written in another format, JPEG drops the alpha channel
+    assert run(monkeypatch, *paths, "--format", "jpg") == 0
+    assert sorted(os.listdir(output)) == ["a.jpg", "a.png", "b.jpg", "b.png"]
+    with Image.open(output / "b.jpg") as result:
+        assert result.format == "JPEG"
+        assert result.size == (256, 256)
+
+    # Images that fail are counted and the exit code isn't zero, the others are still written
+    (images / "broken.png").write_bytes(b"not a png")
+    assert run(monkeypatch, *paths, "--force") == 1
+    out = capsys.readouterr().out
+    assert "broken.png failed" in out
+    assert "1 failed" in out
+    assert not (output / "broken.png").exists()
+
+    # Errors before anything is processed exit with an error message
+    assert run(monkeypatch, str(tmp_path / "missing.cresliant"), str(images), str(output)) == 1
+    assert "cresliant: error:" in capsys.readouterr().err
+
+
+def test_interrupted_output(tmp_path, monkeypatch):
+    Image.linear_gradient("L").save(tmp_path / "a.png")
+    output = tmp_path / "output"
+    output.mkdir()
+    (output / "a.png").write_bytes(b"previous output")
+
+    def interrupted(image, path, *args, **kwargs):
+        with open(path, "wb") as file:
+            file.write(b"trunc")
+        raise KeyboardInterrupt
+
+    # The output is only replaced once it's complete
+    monkeypatch.setattr(Image.Image, "save", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        process(load_project(PROJECT), str(tmp_path / "a.png"), str(output / "a.png"))
+    assert os.listdir(output) == ["a.png"]
+    assert (output / "a.png").read_bytes() == b"previous output"
@@ -0,0 +1,29 @@
+from PIL import Image
+
+from src.engine.cache import ResultCache, image_nbytes
+
+
+def test_result_cache():
+    image = Image.new("RGBA", (10, 10))
+    assert image_nbytes(image) == 400
+
+    cache = ResultCache(max_bytes=1000)
+    assert cache.get("a") is None
+    cache.put("a", image)
+    cache.put("b", image.copy())
+    assert cache.get("a") is image
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+    # "b" is the least recently used entry, so it is evicted first
+    cache.put("c", image.copy())
+    assert "b" not in cache
+    assert "a" in cache
+    assert cache.nbytes == 800
+
+    cache.put("d", Image.new("RGBA", (20, 20)))
+    assert "d" not in cache
+
+    cache.set_budget(400)
+    assert len(cache) == 1
+    assert "c" in cache
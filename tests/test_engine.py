@@ -0,0 +1,510 @@
+import itertools
+
+import numpy as np
+import pytest
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+from src.engine import Engine, Graph, GraphError, ResultCache, load_project, operations, tiling
+from src.engine.fusion import fuse_geometry, fuse_points
+from src.engine.writers import open_writer
+
+
+def same(a: Image.Image, b: Image.Image) -> bool:
+    return a.size == b.size and ImageChops.difference(a, b).getbbox(alpha_only=False) is None
+
+
+def test_graph():
+    image = Image.radial_gradient("L").convert("RGBA")
+    graph = Graph()
+    graph.add_node("Input")
+    blur = graph.add_node("Blur", percentage=130)
+    crop = graph.add_node("Crop", left=10, top=20)
+    graph.add_node("Output")
+    graph.connect("Input", blur)
+    graph.connect(blur, crop)
+
+    with pytest.raises(GraphError):
+        graph.steps()
+    graph.connect(crop, "Output")
+
+    expected = image.filter(ImageFilter.GaussianBlur(radius=2)).crop((10, 20, 256, 256))
+    assert same(graph.evaluate(image), expected)
+    assert Engine.output_size(graph.steps(), image.size) == (246, 236)
+
+    with pytest.raises(GraphError):
+        graph.add_node("Blur", mode="Motion")
+    with pytest.raises(GraphError):
+        graph.set(blur.id, radius=3)
+    graph.set(blur.id, percentage=1000)
+    assert blur.params["percentage"] == 500
+
+    engine = Engine(ResultCache())
+    engine.evaluate(graph, image, key="image")
+    graph.set(crop.id, left=0)
+    engine.evaluate(graph, image, key="image")
+    assert engine.cache.hits == 1
+
+
+def test_load_project():
+    data = {
+        "nodes": {
+            "Input": {"pos": [0, 0], "settings": {}},
+            "rotate_1": {"pos": [0, 0], "settings": {"rotate_1": {"rotate_degrees_1": 90}}},
+            "flip_0": {"pos": [0, 0], "settings": {"flip_0": {"flip_mode_0": "Vertical"}}},
+            "Output": {"pos": [0, 0], "settings": {}},
+        },
+        "links": [
+            {"source": "Input", "target": "Rotate"},
+            {"source": "Rotate", "target": "Flip"},
+            {"source": "Flip", "target": "Output"},
+        ],
+    }
+    graph = load_project(data)
+    assert [node.id for node in graph.path()] == ["Input", "rotate_1", "flip_0", "Output"]
+    assert graph.nodes["rotate_1"].params == {"degrees": 90, "expand": False, "resample": "Nearest"}
+
+    image = Image.linear_gradient("L").convert("RGBA")
+    assert same(graph.evaluate(image), image.rotate(90).transpose(Image.FLIP_TOP_BOTTOM))
+
+
+def test_fuse_geometry():
+    image = Image.linear_gradient("L").resize((64, 48)).convert("RGBA")
+    chains = [
+        [("Rotate", {"degrees": 90}), ("Flip", {"mode": "Horizontal"}), ("Crop", {"left": 5, "bottom": 30})],
+        [("Crop", {"left": 10, "top": 3}), ("Rotate", {"degrees": 45}), ("Crop", {"right": 40})],
+        [("Flip", {"mode": "Diagonal"}), ("Rotate", {"degrees": 270})],
+        [("Resize", {"percentage": 50}), ("Rotate", {"degrees": 180})],
+    ]
+    for chain in chains:
+        graph = Graph()
+        previous = graph.add_node("Input")
+        for kind, params in chain:
+            node = graph.add_node(kind, **params)
+            graph.connect(previous, node)
+            previous = node
+        graph.connect(previous, graph.add_node("Output"))
+
+        steps = graph.steps()
+        fused = Engine().run(image, steps)
+        assert len(fuse_geometry(steps)) == 1
+        assert same(fused, Engine(passes=()).run(image, steps))
+
+
+def test_fuse_points():
+    image = Image.radial_gradient("L").convert("RGBA")
+    image.putalpha(Image.linear_gradient("L"))
+    graph = Graph()
+    graph.add_node("Input")
+    nodes = [
+        graph.add_node("Contrast", percentage=60),
+        graph.add_node("Brightness", percentage=20),
+        graph.add_node("Opacity", percentage=40),
+        graph.add_node("Contrast", percentage=10),
+    ]
+    for source, target in zip(["Input", *nodes], [*nodes, graph.add_node("Output")], strict=True):
+        graph.connect(source, target)
+
+    steps = graph.steps()
+    assert len(fuse_points(steps)) == 1
+    assert same(Engine().run(image, steps), Engine(passes=()).run(image, steps))
+
+
+def test_fused_contrast_mean():
+    """A contrast after a brightness measures the mean grey of the brightened colour image, like it does unfused"""
+    rng = np.random.default_rng(1)
+    brightness, contrast = operations["Brightness"], operations["Contrast"]
+    for _ in range(300):
+        width, height = rng.integers(2, 40, 2)
+        image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+        steps = [
+            (brightness, {**brightness.defaults(), "percentage": int(rng.integers(1, 300))}),
+            (contrast, {**contrast.defaults(), "percentage": int(rng.integers(1, 300))}),
+        ]
+        assert same(Engine().run(image, steps), Engine(passes=()).run(image, steps))
+
+
+def test_tiled_export(tmp_path):
+    image = Image.radial_gradient("L").resize((300, 200)).convert("RGB")
+    graph = Graph()
+    nodes = [
+        graph.add_node("Input"),
+        graph.add_node("Blur", percentage=200),
+        graph.add_node("Rotate", degrees=30),
+        graph.add_node("Contrast", percentage=50),
+        graph.add_node("Sharpness", percentage=70),
+        graph.add_node("Output"),
+    ]
+    for source, target in itertools.pairwise(nodes):
+        graph.connect(source, target)
+
+    # Small enough for tiles of 32x32 pixels
+    Engine().export(image, graph.steps(), tmp_path / "output.png", budget=12 * 32 * 32)
+    with Image.open(tmp_path / "output.png") as output:
+        assert same(output, graph.evaluate(image.convert("RGBA")))
+
+    # Crops after resizes by fractions, which aren't exact in tiles
+    for chain in [
+        [("Resize", {"percentage": 83}), ("Crop", {"left": 20, "top": 10})],
+        [("Resize", {"percentage": 45, "quality": "Fast"}), ("Brightness", {"percentage": 70}), ("Crop", {"left": 3})],
+    ]:
+        steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in chain]
+        Engine().export(image, steps, tmp_path / "output.png", budget=12 * 32 * 32)
+        with Image.open(tmp_path / "output.png") as output:
+            assert same(output, Engine().run(image, steps))
+
+
+def test_incomplete_export(tmp_path):
+    """An output that doesn't get all of its rows, like a cancelled export, leaves no file behind"""
+    for name in ("output.png", "output.tif"):
+        path = str(tmp_path / name)
+        with pytest.raises(ValueError):
+            open_writer(path, (20, 10)).close()
+        writer = open_writer(path, (20, 10))
+        writer.write(Image.new("RGB", (20, 4)))
+        with pytest.raises(ValueError):
+            writer.close()
+        assert not (tmp_path / name).exists()
+
+
+def test_modes(tmp_path):
+    image = Image.radial_gradient("L").resize((300, 200))
+    graph = Graph()
+    nodes = [
+        graph.add_node("Input"),
+        graph.add_node("Brightness", percentage=40),
+        graph.add_node("Blur", percentage=150),
+        graph.add_node("Resize", percentage=70),
+        graph.add_node("Flip", mode="Horizontal"),
+        graph.add_node("Output"),
+    ]
+    for source, target in itertools.pairwise(nodes):
+        graph.connect(source, target)
+
+    output = graph.evaluate(image)
+    assert output.mode == "L"
+    assert same(output.convert("RGBA"), graph.evaluate(image.convert("RGBA")))
+    Engine().export(image, graph.steps(), tmp_path / "output.png", budget=12 * 32 * 32)
+    with Image.open(tmp_path / "output.png") as tiled:
+        assert tiled.mode == "L"
+        assert same(tiled, output)
+
+    # Translucent images need an alpha channel, and so does what a rotation leaves uncovered
+    for kind, params, mode in [
+        ("Opacity", {"percentage": 100}, "L"),
+        ("Opacity", {"percentage": 50}, "RGBA"),
+        ("Rotate", {"degrees": 30}, "RGBA"),
+    ]:
+        graph.connect(nodes[-2], node := graph.add_node(kind, **params))
+        graph.connect(node, nodes[-1])
+        assert graph.evaluate(image).mode == mode
+        assert same(graph.evaluate(image).convert("RGBA"), graph.evaluate(image.convert("RGBA")))
+        graph.connect(nodes[-2], nodes[-1])
+
+
+def test_resize_quality(tmp_path):
+    image = Image.effect_noise((640, 480), 40).convert("RGB").filter(ImageFilter.GaussianBlur(2))
+    graph = Graph()
+    nodes = [graph.add_node("Input"), graph.add_node("Resize", percentage=10), graph.add_node("Output")]
+    for source, target in itertools.pairwise(nodes):
+        graph.connect(source, target)
+
+    # Projects without a quality resize like before the setting existed
+    best = graph.evaluate(image)
+    assert same(best, image.resize((64, 48), Image.LANCZOS))
+    graph.set(nodes[1].id, quality="Best")
+    assert same(graph.evaluate(image), best)
+    for quality in ("Balanced", "Fast"):
+        graph.set(nodes[1].id, quality=quality)
+        output = graph.evaluate(image)
+        assert 0 < ImageStat.Stat(ImageChops.difference(output, best)).mean[0] < 2
+        # Regions of the reduced image are exact
+        Engine().export(image, graph.steps(), tmp_path / "output.png", budget=12 * 16 * 16)
+        with Image.open(tmp_path / "output.png") as tiled:
+            assert same(tiled, output)
+
+    # JPEG files are decoded at a reduced size that keeps the reducing gap, the output keeps its size
+    graph.set(nodes[1].id, quality="Balanced")
+    image.save(tmp_path / "input.jpg")
+    opened, steps = Engine.open(tmp_path / "input.jpg", graph.steps())
+    assert opened.size == (160, 120)
+    assert Engine().run(opened, steps).size == best.size
+
+
+def test_rotate(tmp_path):
+    image = Image.effect_noise((71, 50), 40).convert("RGB")
+    rotate = operations["Rotate"]
+
+    # Quarter turns move whole pixels, a full turn is the image itself
+    assert rotate.run(image, {"degrees": 360, "expand": False, "resample": "Bicubic"}) is image
+    for degrees, method in [(90, Image.ROTATE_90), (180, Image.ROTATE_180), (270, Image.ROTATE_270)]:
+        turned = rotate.run(image, {"degrees": degrees, "expand": True, "resample": "Bicubic"})
+        assert same(turned, image.transpose(method))
+
+    for params in [{"degrees": 30, "expand": True, "resample": "Bilinear"}, {"degrees": 90, "resample": "Nearest"}]:
+        steps = [(rotate, {**rotate.defaults(), **params})]
+        output = Engine().run(image, steps)
+        if params["degrees"] == 30:
+            assert same(output, image.convert("RGBA").rotate(30, Image.BILINEAR, expand=True))
+        Engine().export(image, steps, tmp_path / "output.png", budget=12 * 16 * 16)
+        with Image.open(tmp_path / "output.png") as tiled:
+            assert same(tiled, output)
+
+
+@pytest.mark.parametrize("size", [(71, 50), (50, 71), (8, 5), (5, 8), (70, 50)])
+@pytest.mark.parametrize("degrees", [90, 270])
+def test_quarter_turn_crop(tmp_path, size, degrees):
+    """Quarter turns that keep the size of the image take the same pixels as `Image.rotate`"""
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    steps = [(operations["Rotate"], {**operations["Rotate"].defaults(), "degrees": degrees})]
+    output = Engine().run(image, steps)
+    assert same(output, image.convert("RGBA").rotate(degrees, expand=False))
+
+    Engine().export(image, steps, tmp_path / "output.png", budget=3 * 4 * 4)
+    with Image.open(tmp_path / "output.png") as tiled:
+        assert same(tiled, output)
+
+
+def test_parallel_strips():
+    image = Image.radial_gradient("L").resize((400, 300)).convert("RGBA")
+    for kind, params in [
+        ("Blur", {"mode": "Box", "percentage": 300}),
+        ("Sharpness", {"percentage": 90}),
+        ("Contrast", {"percentage": 70}),
+        ("Resize", {"percentage": 170}),
+        ("Rotate", {"degrees": 45}),
+    ]:
+        graph = Graph()
+        node = graph.add_node(kind, **params)
+        graph.connect(graph.add_node("Input"), node)
+        graph.connect(node, graph.add_node("Output"))
+
+        engine = Engine(workers=3)
+        engine.parallel_pixels = 0
+        assert same(engine.evaluate(graph, image), graph.evaluate(image))
+
+
+def test_filtered_rotation_regions(tmp_path):
+    """Filtered rotations round differently in parts of the image, strips and tiles run them on the whole image"""
+    rotate = operations["Rotate"]
+    for size, degrees in [((21, 87), 45), ((113, 29), 30)]:
+        pixels = np.random.default_rng(0).integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+        image = Image.fromarray(pixels, "RGBA")
+        steps = [(rotate, {**rotate.defaults(), "degrees": degrees, "resample": "Bilinear"})]
+        output = Engine().run(image, steps)
+
+        engine = Engine(workers=3)
+        engine.parallel_pixels = 0
+        assert same(engine.run(image, steps), output)
+        Engine().export(image, steps, tmp_path / "output.png", budget=12 * 16 * 16)
+        with Image.open(tmp_path / "output.png") as tiled:
+            assert same(tiled, output)
+
+
+def test_parallel_alpha():
+    """Opacity adds an alpha band to images without one, also when they're split into strips"""
+    pixels = np.random.default_rng(0).integers(0, 256, (900, 1200, 3), dtype=np.uint8)
+    assert Engine.parallel_pixels <= 1200 * 900
+    for image in (Image.fromarray(pixels, "RGB"), Image.fromarray(pixels[..., 0], "L")):
+        for chain in (
+            [("Opacity", {"percentage": 50})],
+            [("Brightness", {"percentage": 30}), ("Opacity", {"percentage": 80})],
+        ):
+            steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in chain]
+            serial = Engine().run(image, steps)
+            assert serial.mode == "RGBA"
+            parallel = Engine(workers=4).run(image, steps)
+            assert parallel.mode == "RGBA"
+            assert same(parallel, serial)
+
+
+def test_downsampled_blur(tmp_path):
+    image = Image.radial_gradient("L").resize((1100, 1000)).convert("RGBA")
+    graph = Graph()
+    blur = graph.add_node("Blur", percentage=450)
+    graph.connect(graph.add_node("Input"), blur)
+    graph.connect(blur, graph.add_node("Output"))
+    assert blur.operation.factor(blur.params, image.size) == 4
+
+    output = graph.evaluate(image)
+    exact = image.filter(ImageFilter.GaussianBlur(radius=450 / 65))
+    assert max(high for _, high in ImageChops.difference(output, exact).getextrema()) <= 2
+
+    # Tiles and strips start on whole blocks of the downsampled image, so they match the whole image
+    engine = Engine(workers=3)
+    engine.parallel_pixels = 0
+    assert same(engine.evaluate(graph, image), output)
+    Engine().export(image, graph.steps(), tmp_path / "output.png", budget=12 * 200 * 200)
+    with Image.open(tmp_path / "output.png") as tiled:
+        assert same(tiled, output)
+
+
+def test_approximate():
+    image = Image.radial_gradient("L").resize((300, 200)).convert("RGBA")
+    graph = Graph()
+    nodes = [
+        graph.add_node("Input"),
+        graph.add_node("Sharpness", percentage=60),
+        graph.add_node("Blur", percentage=400),
+        graph.add_node("Resize", percentage=70),
+        graph.add_node("Output"),
+    ]
+    for source, target in itertools.pairwise(nodes):
+        graph.connect(source, target)
+
+    engine = Engine(ResultCache())
+    approximation = engine.run(image, graph.steps(), "image", approximate=True)
+    exact = engine.evaluate(graph, image, "image")
+    assert 0 < ImageStat.Stat(ImageChops.difference(approximation, exact)).mean[0] < 2
+
+    # Exact results that are already cached are used instead of approximating them again
+    graph.set(nodes[3].id, percentage=60)
+    hits = engine.cache.hits
+    engine.run(image, graph.steps(), "image", approximate=True)
+    assert engine.cache.hits == hits + 2
+
+
+def test_in_place(monkeypatch):
+    image = Image.radial_gradient("L").resize((300, 200)).convert("RGBA")
+    pixels = image.tobytes()
+    steps = [
+        ("Flip", {"mode": "Vertical"}),
+        ("Blur", {"percentage": 200}),
+        ("Sharpness", {"percentage": 90}),
+        ("Opacity", {"percentage": 40}),
+    ]
+    steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in steps]
+
+    expected = image
+    for operation, params in steps:
+        expected = operation.run(expected, params)
+    # Strips of a few rows, so they see the rows of their neighbours
+    for name in ("Blur", "Sharpness"):
+        monkeypatch.setattr(operations[name], "strip_pixels", 300 * 16)
+    cache = ResultCache()
+    # Only the outputs of earlier operations are modified, never the input or what is cached
+    assert same(Engine(passes=()).run(image, steps), expected)
+    assert same(Engine(cache, passes=()).run(image, steps, "image"), expected)
+    assert same(Engine(cache, passes=()).run(image, steps, "image"), expected)
+    assert image.tobytes() == pixels
+
+    # With a cache only the copy a palette image is converted to is worked on in place
+    palette = image.convert("RGB").convert("P")
+    steps = steps[1:3]
+    expected = Engine(passes=()).run(palette.convert("RGB"), steps)
+    worked = []
+
+    def tracked(operation):
+        run_in_place = operation.run_in_place
+
+        def run(image, params):
+            worked.append(operation.name)
+            return run_in_place(image, params)
+
+        return run
+
+    for operation, _ in steps:
+        monkeypatch.setattr(operation, "run_in_place", tracked(operation))
+    cache = ResultCache()
+    assert same(Engine(cache, passes=()).run(palette, steps, "palette"), expected)
+    assert same(Engine(cache, passes=()).run(palette, steps, "palette"), expected)
+    assert worked == ["Blur"]
+
+
+def test_in_place_strips(monkeypatch):
+    """Operations on an image the engine owns still run in strips when it's large enough"""
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (900, 1200, 4), dtype=np.uint8), "RGBA")
+    steps = [("Flip", {"mode": "Vertical"}), ("Blur", {"percentage": 200}), ("Sharpness", {"percentage": 90})]
+    steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in steps]
+    expected = Engine(passes=()).run(image, steps)
+
+    run_strips, split = tiling.run_strips, []
+
+    def measured(operation, *args):
+        split.append(operation.name)
+        return run_strips(operation, *args)
+
+    monkeypatch.setattr(tiling, "run_strips", measured)
+    assert same(Engine(passes=(), workers=4).run(image, steps), expected)
+    assert split == ["Blur", "Sharpness"]
+
+
+def test_push_crops(tmp_path):
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (71, 97, 3), dtype=np.uint8))
+    # Every node, with filters that only come out exact on the whole image among them
+    nodes = [
+        ("Blur", {"percentage": 200}),
+        ("Blur", {"mode": "Box", "percentage": 500}),
+        ("Brightness", {"percentage": 40}),
+        ("Contrast", {"percentage": 40}),
+        ("Sharpness", {"percentage": 80}),
+        ("Opacity", {"percentage": 50}),
+        ("Resize", {"percentage": 170}),
+        ("Resize", {"percentage": 60, "quality": "Fast"}),
+        ("Rotate", {"degrees": 90}),
+        ("Rotate", {"degrees": 20, "resample": "Bilinear"}),
+        ("Flip", {"mode": "Horizontal"}),
+        ("Crop", {"left": 7, "top": 3}),
+    ]
+    nodes = [(operations[name], {**operations[name].defaults(), **params}) for name, params in nodes]
+    crop = operations["Crop"]
+    separate = Engine(passes=(fuse_geometry, fuse_points))
+    for node, box in itertools.product(nodes, [(10, 12, 50, 40), (33, 5, None, None)]):
+        params = dict(zip(("left", "top", "right", "bottom"), box, strict=True))
+        for steps in ([nodes[0], node, nodes[4], (crop, params)], [nodes[4], node, (crop, params)]):
+            assert same(Engine().run(image, steps), separate.run(image, steps))
+
+    # The crop and the local operations before it become a single step, which tiles like any other
+    steps = [nodes[3], nodes[0], nodes[8], nodes[4], (crop, {"left": 40, "top": 10, "right": 60, "bottom": 90})]
+    assert [operation.name for operation, _ in Engine().optimize(steps)] == ["Contrast", "Cropped"]
+    Engine().export(image, steps, tmp_path / "output.png", budget=12 * 16 * 16)
+    with Image.open(tmp_path / "output.png") as tiled:
+        assert same(tiled, separate.run(image, steps))
+
+
+def test_region(monkeypatch):
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (200, 300, 3), dtype=np.uint8))
+    chains = [
+        [("Blur", {"percentage": 200}), ("Rotate", {"degrees": 90}), ("Contrast", {"percentage": 40})],
+        [("Sharpness", {"percentage": 70}), ("Rotate", {"degrees": 90}), ("Flip", {"mode": "Vertical"})],
+        [("Resize", {"percentage": 50}), ("Brightness", {"percentage": 30}), ("Crop", {"left": 20, "top": 10})],
+        # Resizes by fractions whose regions aren't exact run whole
+        [("Resize", {"percentage": 83}), ("Crop", {"left": 20, "top": 10})],
+        [("Resize", {"percentage": 45}), ("Crop", {"left": 20, "top": 10})],
+    ]
+    resize = operations["Resize"]
+    engine = Engine()
+    for chain in chains:
+        steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in chain]
+        size = engine.output_size(steps, image.size)
+        for zoom in (1.0, 0.25, 2.0):
+            # A zoom is like resizing the output, but only the region is computed
+            width, height = round(size[0] * zoom), round(size[1] * zoom)
+            zoomed = [*steps, (resize, {**resize.defaults(), "width": width, "height": height})]
+            output = engine.run(image, zoomed)
+            for box in [(0, 0, *output.size), (3, 5, 20, 30), (output.width - 17, output.height - 9, *output.size)]:
+                assert same(engine.region(image, steps, box, zoom, "image"), output.crop(box))
+
+    # The mean of a contrast is measured once for the input and the steps, not for every region
+    contrast, measured = operations["Contrast"], []
+    prepare = contrast.prepare
+    monkeypatch.setattr(
+        contrast, "prepare", lambda params, tiles: measured.append(params.get("mean")) or prepare(params, tiles)
+    )
+    steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in chains[0]]
+    for box in [(0, 0, 10, 10), (10, 0, 20, 10)]:
+        engine.region(image, steps, box, key="other")
+    assert measured.count(None) == 1
+
+    # Panning back to a recently used input doesn't measure it again
+    engine.prepared_size = 2
+    for key in ["other", "second", "other", "third", "other"]:
+        engine.region(image, steps, (0, 0, 10, 10), key=key)
+    assert measured.count(None) == 3
+
+    # So do the steps that run whole, for the input, the steps and the zoom
+    run_inexact, whole = tiling.run_inexact, []
+    monkeypatch.setattr(tiling, "run_inexact", lambda *args: whole.append(args) or run_inexact(*args))
+    steps = [(operations[name], {**operations[name].defaults(), **params}) for name, params in chains[3]]
+    for box in [(0, 0, 10, 10), (10, 0, 20, 10)]:
+        engine.region(image, steps, box, key="resized")
+    assert len(whole) == 1
@@ -3,6 +3,7 @@ import pytest
 from PIL import Image
 
 from src.editor import node_editor
+from src.engine import INPUT, OUTPUT
 from src.utils import ImageController as dpg_img
 from src.utils.nodes import history_manager
 from src.utils.paths import resource
@@ -34,6 +35,20 @@ def test_nodes(init_dpg):
             assert dpg.get_item_user_data(module.name.lower() + "_0") == module
             assert isinstance(module.run(image, module.name.lower() + "_0"), Image.Image)
 
+    # Turning a setting off reaches the graph and the render
+    rotate = node_editor.graph_node(dpg.get_item_children("rotate_0", 1)[0])
+    node_editor.graph.connect(INPUT, rotate)
+    node_editor.graph.connect(rotate, OUTPUT)
+    node_editor.update_path()
+    assert node_editor.modules[0].pyramid.ready.wait(5)
+    node_editor.update_output("rotate_degrees_0", 90)
+    node_editor.update_output("rotate_expand_0", True)
+    assert node_editor.render_full().size == (256, 251)
+    node_editor.update_output("rotate_expand_0", False)
+    assert node_editor.graph.nodes["rotate_0"].params["expand"] is False
+    assert node_editor.render_full().size == (251, 256)
+    assert dpg.get_item_user_data("rotate_0").settings["rotate_0"]["rotate_expand_0"] is False
+
     # Testing history manager
     for _ in range(len(history_manager.history)):
         curr = history_manager.index
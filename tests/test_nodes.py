@@ -0,0 +1,111 @@
+import itertools
+import random
+import time
+
+import dearpygui.dearpygui as dpg
+
+from src.engine import Graph
+from src.utils.nodes import HistoryItem, HistoryManager, Link, LinkStore
+
+
+def test_graph_stress():
+    """Relinks a chain of 1000 nodes at random, the path and the link index have to match a full walk every time"""
+    rng = random.Random(0)
+    graph = Graph()
+    links = LinkStore()
+    nodes = [graph.add_node("Input").id] + [graph.add_node("Brightness").id for _ in range(1000)]
+    nodes.append(graph.add_node("Output").id)
+    # Attribute ids like the editor's: the input attribute of node i is 2i, its output 2i + 1
+    for i, (source, target) in enumerate(itertools.pairwise(nodes)):
+        graph.connect(source, target)
+        links.add(Link(source=2 * i + 1, target=2 * i + 2, id=i))
+    assert len(graph.path()) == len(nodes)
+
+    def walk() -> list[str]:
+        path, targets = ["Input"], dict(graph.links)
+        while (target := targets.get(path[-1])) is not None and target not in path:
+            path.append(target)
+        return path
+
+    start = time.perf_counter()
+    for link_id in range(len(nodes), len(nodes) + 2000):
+        source, target = rng.sample(range(len(nodes)), 2)
+        if rng.random() < 0.2:
+            graph.disconnect(nodes[source])
+            if link := links.from_source(2 * source + 1):
+                links.remove(link.id)
+        else:
+            graph.connect(nodes[source], nodes[target])
+            links.add(Link(source=2 * source + 1, target=2 * target, id=link_id))
+
+        if link_id % 100 == 0:
+            assert [node.id for node in graph.path()] == walk()
+            assert {(link.source - 1) // 2: link.target // 2 for link in links} == {
+                nodes.index(source): nodes.index(target) for source, target in graph.links
+            }
+
+    graph.remove_node(nodes[500])
+    assert nodes[500] not in graph.sources(nodes[501])
+    assert [node.id for node in graph.path()] == walk()
+    assert time.perf_counter() - start < 5
+
+
+def test_history(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    history = HistoryManager(max_entries=5, merge_window=1.0)
+
+    def update(sender: str, value: int, previous: int):
+        clock[0] += 0.1
+        history.append(HistoryItem(tag="blur_0", action="update", data={sender: (value, previous)}))
+
+    # A dragged slider is a single step, back to the value before the drag
+    for value in range(1, 200):
+        update("blur_percentage_0", value, value - 1)
+    assert len(history.history) == 1
+    assert history.history[0].data == {"blur_percentage_0": (199, 0)}
+
+    # Other settings, pauses longer than the window and undone steps start a new one
+    update("blur_mode_0", "Box", "Gaussian")
+    clock[0] += 2
+    update("blur_mode_0", "Gaussian", "Box")
+    assert len(history.history) == 3
+    history.index -= 1
+    update("blur_mode_0", "Box", "Gaussian")
+    assert len(history.history) == 3
+    assert history.history[-1].data == {"blur_mode_0": ("Box", "Gaussian")}
+
+    # A step that was undone and redone isn't merged into, even within the window
+    monkeypatch.setattr(dpg, "set_value", lambda *args: None)
+    history.update_output = lambda *args: None
+    update("blur_percentage_0", 5, 199)
+    history.undo()
+    history.redo()
+    update("blur_percentage_0", 6, 5)
+    assert len(history.history) == 5
+    assert history.history[-2].data == {"blur_percentage_0": (5, 199)}
+    assert history.history[-1].data == {"blur_percentage_0": (6, 5)}
+
+    for value in range(10):
+        clock[0] += 2
+        update("blur_percentage_0", value, value)
+    assert len(history.history) == 5
+    assert history.index == 4
+    assert history.nbytes == sum(item.nbytes for item in history.history)
+
+    history.max_bytes = history.history[-1].nbytes * 2
+    update("blur_mode_0", "Box", "Gaussian")
+    assert len(history.history) == 2
+    assert history.index == 1
+
+    # Dropping the oldest steps keeps the others at their index from the oldest one
+    history.max_bytes = 4 * 1024 * 1024
+    for value in range(100):
+        clock[0] += 2
+        update("blur_percentage_0", value, value)
+    assert len(history) == 5
+    assert [item.data["blur_percentage_0"][0] for item in history.history] == [95, 96, 97, 98, 99]
+    assert [history.step(index) for index in range(5)] == history.history
+    history.undo()
+    history.redo()
+    assert history.current is history.history[-1]
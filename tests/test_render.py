@@ -0,0 +1,189 @@
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageChops
+
+from src.editor import NodeEditor
+from src.engine import INPUT, OUTPUT, Pyramid
+from src.engine.pyramid import fit, fit_size
+from src.utils.render import RenderWorker, TileJob, TileResult, TileWorker
+from src.utils.tiles import TileStore, pick_level, tiles_in_view
+
+
+def noise(width: int, height: int) -> Image.Image:
+    return Image.fromarray(np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def wait_idle(worker: RenderWorker):
+    deadline = time.monotonic() + 5
+    while worker.busy:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_render_worker():
+    started, cancelled_seen = [], []
+    running, release = threading.Event(), threading.Event()
+
+    def render(job: str, cancelled: callable) -> str:
+        started.append(job)
+        if job == "slow":
+            running.set()
+            release.wait(5)
+            cancelled_seen.append(cancelled())
+        return job
+
+    worker = RenderWorker(render)
+    worker.submit(["slow", "never"])
+    assert running.wait(5)
+
+    # Only the latest job runs, the one it replaced is dropped before it starts
+    # and the running one is cancelled before its next pass
+    worker.submit(["dropped"])
+    worker.submit(["coarse", "full"])
+    release.set()
+    wait_idle(worker)
+    assert started == ["slow", "coarse", "full"]
+    assert cancelled_seen == [True]
+    assert worker.poll() == "full"
+    assert worker.poll() is None
+
+    # A cancelled job leaves no result
+    running.clear()
+    release.clear()
+    worker.submit(["slow"])
+    assert running.wait(5)
+    worker.cancel()
+    release.set()
+    wait_idle(worker)
+    assert cancelled_seen == [True, True]
+    assert worker.poll() is None
+
+
+def test_pyramid():
+    assert fit_size((3000, 2000), 1024) == (1024, 683)
+    assert fit_size((100, 50), 1024) == (100, 50)
+    assert fit_size((5000, 1), 100) == (100, 1)
+
+    image = noise(3000, 2000)
+    built, ready = threading.Event(), []
+    pyramid = Pyramid(image, 450, lambda pyramid: (ready.append(pyramid), built.set()))
+    assert pyramid.ready.wait(5)
+    assert built.wait(5)
+    assert ready == [pyramid]
+    assert [level.size for level in pyramid.levels] == [(3000, 2000), (1500, 1000), (750, 500)]
+
+    # The smallest level that covers the size, the full image when none is smaller
+    assert pyramid.level(1024).size == (1500, 1000)
+    assert pyramid.level(100).size == (750, 500)
+    assert pyramid.level(5000) is image
+
+    assert pyramid.fit(1024).size == (1024, 683)
+    assert ImageChops.difference(pyramid.fit(1024), fit(image, 1024)).getbbox() is None
+    assert pyramid.fit(3000) is image
+
+
+def test_render_passes():
+    editor = NodeEditor(noise(3000, 2000), workers=1)
+    brightness = editor.graph.add_node("Brightness", percentage=120)
+    editor.graph.connect(INPUT, brightness)
+    editor.graph.connect(brightness, OUTPUT)
+    assert editor.modules[0].pyramid.ready.wait(5)
+
+    # A coarse pass is stretched to the size of the pass after it, the full image is only rendered outside preview mode
+    passes = editor.create_passes(approximate=True)
+    assert [job.image.size for job in passes] == [(128, 85), (1024, 683)]
+    assert passes[0].stretch == (1024 / 128, 683 / 85)
+    assert passes[1].stretch == (1.0, 1.0)
+    assert all(job.approximate and job.output_size == (3000, 2000) for job in passes)
+    assert passes[0].key != passes[1].key
+
+    passes = editor.create_passes(coarse=False)
+    assert [job.image.size for job in passes] == [(1024, 683)]
+    assert not passes[0].approximate
+
+    editor.preview = False
+    passes = editor.create_passes()
+    assert [job.image.size for job in passes] == [(128, 85), (1024, 683), (3000, 2000)]
+    assert passes[1].stretch == (3000 / 1024, 2000 / 683)
+    assert passes[2].scale == (1.0, 1.0)
+
+    # Passes that wouldn't run on a larger image are left out
+    editor = NodeEditor(noise(100, 80), workers=1)
+    editor.graph.connect(INPUT, OUTPUT)
+    assert editor.modules[0].pyramid.ready.wait(5)
+    assert [job.image.size for job in editor.create_passes()] == [(100, 80)]
+
+
+def test_tile_worker():
+    started, running, release = [], threading.Event(), threading.Event()
+
+    def render(job: TileJob) -> TileResult:
+        started.append(job.tile)
+        if job.tile == "slow":
+            running.set()
+            release.wait(5)
+        return TileResult(job.tile, job.generation, (1, 1), np.zeros(4, dtype=np.float32))
+
+    def jobs(*tiles: str) -> list[TileJob]:
+        return [TileJob(tile, 0, None, (), (1.0, 1.0), [], (0, 0, 1, 1)) for tile in tiles]
+
+    def results(count: int) -> list[str]:
+        deadline, tiles = time.monotonic() + 5, []
+        while len(tiles) < count:
+            assert time.monotonic() < deadline
+            tiles += [result.tile for result in worker.poll()]
+            time.sleep(0.01)
+        return tiles
+
+    worker = TileWorker(render)
+    worker.request(jobs("slow", "a", "b"))
+    assert running.wait(5)
+    # A request replaces the tiles still waiting, the tile being rendered isn't rendered again
+    worker.request(jobs("slow", "c", "b"))
+    release.set()
+    assert results(3) == ["slow", "c", "b"]
+    assert started == ["slow", "c", "b"]
+
+    # Cancelling drops the tiles still waiting
+    running.clear()
+    release.clear()
+    worker.request(jobs("slow", "d"))
+    assert running.wait(5)
+    worker.cancel()
+    release.set()
+    assert results(1) == ["slow"]
+    assert started[-1] == "slow"
+
+
+def test_tile_store():
+    # Tiles of a 1000x600 output in a view around its middle, the closest to the middle first
+    tiles = tiles_in_view((1000, 600), (300, 200, 700, 400), 256)
+    assert tiles == [(1, 1), (2, 1), (1, 0), (2, 0)]
+    assert tiles_in_view((1000, 600), (900, 520, 1300, 900), 256) == [(3, 2)]
+    assert tiles_in_view((1000, 600), (-500, -500, -1, -1), 256) == []
+    assert pick_level([1.0, 0.4998, 0.25], 0.3) == 1
+    assert pick_level([1.0, 0.5, 0.25], 0.1) == 2
+    assert pick_level([1.0, 0.5, 0.25], 2.0) == 0
+
+    released = []
+    store = TileStore(released.append, budget=300)
+    for tile in "abc":
+        store.add(tile, f"{tile}_texture", (10, 10), 100, 0)
+    store.show("a")
+    store.add("d", "d_texture", (10, 10), 100, 0)
+    # Over budget, "b" has been out of view the longest, but tiles in view are kept
+    store.evict({"b"})
+    assert released == ["c_texture"]
+    assert store.nbytes == 300
+
+    # A tile rendered again replaces its texture
+    store.add("a", "a_new", (10, 10), 100, 1)
+    assert released[-1] == "a_texture"
+    assert store.get("a").generation == 1
+
+    store.max_inactive_time = -1
+    store.evict({"a"})
+    assert len(store) == 1
+    assert "a" in store